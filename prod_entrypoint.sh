@@ -16,6 +16,8 @@ GUNICORN_TIMEOUT="${GUNICORN_TIMEOUT:-360}"
 GUNICORN_ACCESS_LOGFILE="${GUNICORN_ACCESS_LOGFILE:-/app/access.log}"
 GUNICORN_ERROR_LOGFILE="${GUNICORN_ERROR_LOGFILE:-/app/error.log}"
  
+# Sin --preload: el worker gevent tiene que parchear antes de cargar Django
+# para que psycopg espere las queries sin bloquear el worker (ver DB_POOL_* en settings)
 exec uv run gunicorn "vsm_frigo.wsgi:application" \
   --bind "$GUNICORN_BIND" \
   --worker-class "$GUNICORN_WORKER_CLASS" \
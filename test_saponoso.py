@@ -11,6 +11,7 @@
  
 import json
 import os
+import time
 from typing import Any, Dict
  
 import httpx
@@ -25,6 +26,8 @@ class Saponoso:
     endpoints = {
         "pro": os.environ.get("SAP_ENDPOINT_PRO", "https://frclouds4pro.rioplatense.local:10443/sap/bc/soap/rfc"),
         "qas": os.environ.get("SAP_ENDPOINT_QAS", "https://frclouds4qas.rioplatense.local:10443/sap/bc/soap/rfc"),
+        # Fake SAP server for offline load tests (manage.py sap_fake_server)
+        "local": os.environ.get("SAP_ENDPOINT_LOCAL", "http://127.0.0.1:8089/sap/bc/soap/rfc"),
     }
  
     def __init__(self, **kwargs):
@@ -45,6 +48,10 @@ class Saponoso:
         self.debug = kwargs.get("debug", False)
         self.verify_ssl = kwargs.get("verify_ssl", False)
         self.timeout = kwargs.get("timeout", 10.0)
+        # Optional shared httpx.Client (keep-alive pool). Without it a new client is opened per call.
+        self.client = kwargs.get("client")
+        # Timings and sizes of the last call_rfc (network vs parse), for instrumentation.
+        self.last_call_stats = None
  
     def call_rfc(self, rfc_name: str, params: Dict[str, Any]) -> Dict[str, Any]:
         """Call the SAP RFC via SOAP and parse the response."""
@@ -54,17 +61,34 @@ class Saponoso:
             print(f"SOAP Envelope:\n{soap_envelope}")
            
         headers = {'Content-Type': 'text/xml; charset=utf-8'}
-        with httpx.Client(timeout=self.timeout, verify=self.verify_ssl) as client:
-            response = client.post(
+        payload = soap_envelope.encode('utf-8')
+        self.last_call_stats = {"network_s": 0.0, "parse_s": 0.0, "request_bytes": len(payload), "response_bytes": 0}
+        start = time.perf_counter()
+        if self.client is not None:
+            response = self.client.post(
                 self.endpoint,
-                content=soap_envelope.encode('utf-8'),
+                content=payload,
                 headers=headers,
-                auth=(self.username, self.password)
+                auth=(self.username, self.password),
+                timeout=self.timeout
             )
+        else:
+            with httpx.Client(timeout=self.timeout, verify=self.verify_ssl) as client:
+                response = client.post(
+                    self.endpoint,
+                    content=payload,
+                    headers=headers,
+                    auth=(self.username, self.password)
+                )
+        self.last_call_stats["network_s"] = time.perf_counter() - start
+        self.last_call_stats["response_bytes"] = len(response.content)
         response.raise_for_status()
         if self.debug:
             print(f"RFC call executed successfully.\n{response.text}")
-        return self.parse_response(response.text)
+        start = time.perf_counter()
+        result = self.parse_response(response.text)
+        self.last_call_stats["parse_s"] = time.perf_counter() - start
+        return result
  
     def _build_soap_envelope(self, rfc_name: str, params: Dict[str, Any]) -> str:
         """Builds a SOAP envelope for the RFC call."""
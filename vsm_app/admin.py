@@ -66,6 +66,14 @@ class permiso_empresa_almacenAdmin(admin.ModelAdmin):
     list_display = ('empresa', 'almacen')
     search_fields = ('empresa__nombre', 'almacen__nombre')
 
+class outbox_entrega_sapAdmin(admin.ModelAdmin):
+    list_display = ('vsm', 'estado', 'intentos', 'proximo_intento', 'actualizado')
+    list_filter = ('estado',)
+    search_fields = ('vsm__id',)
+
+class stock_snapshot_syncAdmin(admin.ModelAdmin):
+    list_display = ('centro', 'almacen', 'sincronizado', 'materiales', 'cambios')
+
 admin.site.register(tags_productos, TagsProductosAdmin)
 admin.site.register(perfil_riesgo, perfil_riesgoAdmin)
 admin.site.register(permisos, PermisosAdmin)
@@ -77,4 +85,6 @@ admin.site.register(maestro_de_materiales, MaestroDeMaterialesAdmin)
 admin.site.register(PermisoRetiro, PermisoRetiroAdmin)
 admin.site.register(nro_tarjeta, NroTarjetaInline)
 admin.site.register(relacion_cc_perfil_riesgo, relacion_cc_perfil_riesgoAdmin)
-admin.site.register(permiso_empresa_almacen, permiso_empresa_almacenAdmin)
\ No newline at end of file
+admin.site.register(permiso_empresa_almacen, permiso_empresa_almacenAdmin)
+admin.site.register(outbox_entrega_sap, outbox_entrega_sapAdmin)
+admin.site.register(stock_snapshot_sync, stock_snapshot_syncAdmin)
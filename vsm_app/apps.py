@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class VsmAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'vsm_app'
+
+    def ready(self):
+        from django.db.models.signals import m2m_changed
+
+        from .models import Usuarios
+        from .utils.permisos import invalidar_por_m2m
+
+        m2m_changed.connect(invalidar_por_m2m, sender=Usuarios.permisos.through)
@@ -1,7 +1,11 @@
 from mozilla_django_oidc.auth import OIDCAuthenticationBackend # Necesario si usas el superuser check
+from django.db import transaction
 from django.db.models import Q
+import hashlib
 import logging 
-from vsm_app.models import permisos as Permisos
+import time
+from vsm_app.models import Usuarios, permisos as Permisos
+from vsm_app.utils.permisos import invalidar_permisos
 
 
 logger = logging.getLogger(__name__)
@@ -14,9 +18,33 @@ SPECIAL_PERMISSIONS_MAP = {
     "admin_access": ["auth.view_user", "auth.view_group"], 
 }
 
+# Mapa nombre -> id de `permisos`, en memoria del proceso. Se recarga cuando
+# el claim trae un nombre desconocido (como mucho cada MAPA_RECARGA segundos).
+MAPA_RECARGA = 60
+_mapa_permisos = {}
+_mapa_cargado = 0.0
+
 # ------------------------------------
 
 
+def _ids_de_permisos(nombres):
+    """{nombre: id} de los nombres que existen en `permisos`."""
+    global _mapa_permisos, _mapa_cargado
+
+    desconocidos = not _mapa_permisos or not nombres <= _mapa_permisos.keys()
+    if desconocidos and time.monotonic() - _mapa_cargado > MAPA_RECARGA:
+        _mapa_permisos = dict(Permisos.objects.values_list("nombre", "id"))
+        _mapa_cargado = time.monotonic()
+    return {n: _mapa_permisos[n] for n in nombres if n in _mapa_permisos}
+
+
+def _invalidar_mapa():
+    global _mapa_permisos, _mapa_cargado
+
+    _mapa_permisos = {}
+    _mapa_cargado = 0.0
+
+
 class CustomOIDCBackend(OIDCAuthenticationBackend):
     def _get_keycloak_permissions(self, claims):
         
@@ -31,35 +59,59 @@ class CustomOIDCBackend(OIDCAuthenticationBackend):
 
 
     def _sync_permissions(self, user, claims):
-
+        """
+        Aplica el claim de Keycloak a user.permisos sólo si cambió desde la
+        última vez (se compara un hash guardado en el usuario). En cada
+        login/refresh de token con los mismos permisos no toca la DB.
+        """
         desired_permission_names = self._get_keycloak_permissions(claims)
-        
-        # --- DIAGNÓSTICO ---
-        logger.warning(f"Sincronización de permisos iniciada para el usuario: {user.username}")
-        logger.warning(f"Permisos DESEADOS de Keycloak (Nombres): {len(desired_permission_names)} -> {desired_permission_names}")
-        # -------------------
+        ids_por_nombre = _ids_de_permisos(desired_permission_names)
 
-        if not desired_permission_names:
-            user.permisos.clear()
+        # Hash de lo que efectivamente se puede aplicar: si falta un permiso y
+        # después se crea, el hash cambia y se aplica en el próximo refresh.
+        claim_hash = hashlib.sha256("\n".join(sorted(ids_por_nombre)).encode()).hexdigest()
+        if user.permisos_hash == claim_hash:
+            logger.debug(f"Permisos sin cambios para {user.username}")
             return
 
-        desired_permissions = list(Permisos.objects.filter(nombre__in=desired_permission_names))
-        
-        # --- DIAGNÓSTICO ---
-        logger.warning(f"Permisos ENCONTRADOS en la DB: {len(desired_permissions)}")
-        if len(desired_permissions) != len(desired_permission_names):
-             found_names = {p.nombre for p in desired_permissions}
-             missing_names = desired_permission_names - found_names
-             logger.error(f"¡ADVERTENCIA! Faltan permisos en la DB: {missing_names}. Asegúrese de que los nombres coincidan exactamente.")
-        # -------------------
-
-        # 3. Asignar los permisos deseados (sobrescribiendo los anteriores)
+        missing_names = desired_permission_names - ids_por_nombre.keys()
+        if missing_names:
+            logger.warning(f"Permisos de Keycloak sin equivalente en la DB: {missing_names}")
+
+        Through = Usuarios.permisos.through
+        desired_ids = set(ids_por_nombre.values())
         try:
-            user.permisos.set(desired_permissions) 
-            logger.warning(f"Permisos asignados con éxito a user.permisos.")
+            with transaction.atomic():
+                current_ids = set(
+                    Through.objects.filter(usuarios_id=user.pk).values_list("permisos_id", flat=True)
+                )
+                to_add = desired_ids - current_ids
+                to_remove = current_ids - desired_ids
+
+                if to_remove:
+                    Through.objects.filter(usuarios_id=user.pk, permisos_id__in=to_remove).delete()
+                if to_add:
+                    Through.objects.bulk_create(
+                        [Through(usuarios_id=user.pk, permisos_id=pid) for pid in to_add],
+                        ignore_conflicts=True,
+                    )
+
+                Usuarios.objects.filter(pk=user.pk).update(permisos_hash=claim_hash)
+                # Los bulk no disparan m2m_changed: la versión que invalida el
+                # set cacheado en las sesiones se sube acá.
+                if to_add or to_remove:
+                    invalidar_permisos(user)
         except Exception as e:
+            # Puede ser un id viejo en el mapa en memoria: se recarga la próxima vez
+            _invalidar_mapa()
             logger.error(f"ERROR al asignar permisos customizados: {e}")
-        
+            return
+
+        user.permisos_hash = claim_hash
+        if to_add or to_remove:
+            logger.info(
+                f"Permisos de {user.username} actualizados: +{len(to_add)} -{len(to_remove)}"
+            )
         return
 
 
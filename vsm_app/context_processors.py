@@ -1,4 +1,10 @@
+from vsm_app.utils.permisos import permisos_usuario
+
+
 def user_context(request):
+    if request.user.is_authenticated:
+        # Carga (o toma de la sesión) el set de permisos que usan los has_perm del template
+        permisos_usuario(request.user, request.session)
     return {
         'username': request.user.username if request.user.is_authenticated else None
-    }
\ No newline at end of file
+    }
@@ -2,6 +2,8 @@ from functools import wraps
 from django.http import HttpResponseForbidden
 from django.shortcuts import render
 
+from vsm_app.utils.permisos import permisos_usuario
+
 def permission_required(required_permissions):
     """
     Decorador para verificar si el usuario tiene al menos uno de los permisos requeridos.
@@ -16,13 +18,8 @@ def permission_required(required_permissions):
             if not user.is_authenticated:
                 return HttpResponseForbidden("Usuario no autenticado.")
 
-            # Traer permisos activos como strings
-            Usuario  = request.user
-
-            permisos_del_rol = Usuario.permisos.values_list(
-                'nombre', flat=True
-            )
-            permisos_asignados = set(permisos_del_rol)
+            # Permisos activos como strings (una vez por request, cacheados en la sesión)
+            permisos_asignados = permisos_usuario(user, request.session)
 
             # Normalizar siempre a lista
             if isinstance(required_permissions, str):
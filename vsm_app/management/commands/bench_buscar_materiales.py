@@ -0,0 +1,95 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from vsm_app.models import PermisoRetiro, centro_costos, maestro_de_materiales
+from vsm_app.utils.material_search import buscar_materiales
+
+PALABRAS = (
+    "GUANTE", "NITRILO", "BOTÍN", "SEGURIDAD", "CASCO", "PROTECCIÓN", "AUDITIVA",
+    "ANTIPARRA", "MAMELUCO", "DESCARTABLE", "CAMPERA", "TÉRMICA", "DELANTAL",
+    "PVC", "CUCHILLO", "DESHUESAR", "CHAIRA", "ACERO", "BARBIJO", "CAÑO",
+    "MANGUERA", "ÁCIDO", "DETERGENTE", "ALCALINO", "CINTA", "EMBALAJE",
+    "ETIQUETA", "TÉRMICO", "CAJA", "CARTÓN", "BOLSA", "POLIETILENO", "TALLE",
+)
+CONSULTAS = ("guante", "botin segur", "proteccion", "acido", "caño", "12345", "deshuesar 15", "zzz")
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara la búsqueda vieja (descripcion__icontains) con buscar_materiales "
+        "sobre un maestro sintético de 100k materiales. Todo corre en una "
+        "transacción que se descarta al final."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--materiales", type=int, default=100_000)
+        parser.add_argument("--permitidos", type=int, default=5_000, help="Materiales en el PermisoRetiro del centro")
+        parser.add_argument("--repeticiones", type=int, default=20)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            permiso = self._sembrar(options["materiales"], options["permitidos"])
+            try:
+                self._medir(permiso, options["repeticiones"])
+            finally:
+                transaction.set_rollback(True)
+
+    def _sembrar(self, n, permitidos):
+        rnd = random.Random(n)
+        inicio = time.perf_counter()
+        creados = maestro_de_materiales.objects.bulk_create(
+            (
+                maestro_de_materiales(
+                    codigo=str(9_000_000 + i),
+                    descripcion=" ".join(rnd.sample(PALABRAS, 4)) + f" {rnd.randint(1, 99)}",
+                    clase_sap="EPP" if rnd.random() < 0.4 else "INS",
+                    centro="1000",
+                )
+                for i in range(n)
+            ),
+            batch_size=5000,
+        )
+        centro = centro_costos.objects.create(codigo="BENCH", descripcion="Centro benchmark")
+        permiso = PermisoRetiro.objects.create(centro_costo=centro)
+        ids = [m.id for m in creados]
+        Through = PermisoRetiro.producto.through
+        Through.objects.bulk_create(
+            [Through(permisoretiro_id=permiso.id, maestro_de_materiales_id=i) for i in rnd.sample(ids, min(permitidos, len(ids)))],
+            batch_size=5000,
+        )
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute(f"ANALYZE {maestro_de_materiales._meta.db_table}")
+                cursor.execute(f"ANALYZE {Through._meta.db_table}")
+        self.stdout.write(f"Sembrados {n} materiales ({permitidos} permitidos) en {time.perf_counter() - inicio:.1f}s")
+        return permiso
+
+    def _medir(self, permiso, repeticiones):
+        escenarios = (
+            ("maestro", lambda: maestro_de_materiales.objects.all()),
+            ("permiso", lambda: permiso.producto.all()),
+        )
+        for alcance, base in escenarios:
+            for consulta in CONSULTAS:
+                for nombre, fn in (
+                    ("icontains", lambda: base().filter(descripcion__icontains=consulta)[:20]),
+                    ("trigram", lambda: buscar_materiales(base(), consulta)),
+                ):
+                    tiempos = []
+                    for _ in range(repeticiones):
+                        inicio = time.perf_counter()
+                        filas = len(list(fn()))
+                        tiempos.append((time.perf_counter() - inicio) * 1000)
+                    tiempos.sort()
+                    p95 = tiempos[max(0, int(len(tiempos) * 0.95) - 1)]
+                    self.stdout.write(
+                        f"{alcance:8} {consulta!r:16} {nombre:9} filas={filas:>3} "
+                        f"mediana={statistics.median(tiempos):7.2f}ms p95={p95:7.2f}ms"
+                    )
+                if connection.vendor == "postgresql" and alcance == "maestro":
+                    plan = buscar_materiales(base(), consulta).explain()
+                    self.stdout.write("    plan: " + " | ".join(l.strip() for l in plan.splitlines()[:4]))
@@ -0,0 +1,122 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Lo que hace un worker gevent de gunicorn: parchear antes de cargar Django
+# (y psycopg) y atender cada request en un greenlet, cerrando o devolviendo
+# la conexión con las mismas señales que el handler. Por eso corre en un
+# proceso aparte, con los settings del proyecto.
+CARGA = r"""
+import json, os, statistics, sys, time
+
+from gevent import monkey
+monkey.patch_all()
+
+import gevent
+
+if os.environ["BENCH_DRIVER"] == "psycopg2":
+    sys.modules["psycopg"] = None  # Django cae a psycopg2, como antes del pool
+
+import django
+django.setup()
+
+from django.core.signals import request_finished, request_started
+from django.db import connection
+
+requests = int(os.environ["BENCH_REQUESTS"])
+espera = float(os.environ["BENCH_ESPERA"])
+
+
+def request(llegada):
+    request_started.send(sender=None)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_backend_pid(), pg_sleep(%s)", [espera])
+            pid = cursor.fetchone()[0]
+    finally:
+        request_finished.send(sender=None)
+    return pid, time.perf_counter() - llegada
+
+
+def ronda():
+    # Cuánto tarda el hub en volver a un greenlet que duerme 10ms
+    atraso = [0.0]
+    def latido():
+        while True:
+            inicio = time.perf_counter()
+            gevent.sleep(0.01)
+            atraso[0] = max(atraso[0], time.perf_counter() - inicio - 0.01)
+    pulso = gevent.spawn(latido)
+    inicio = time.perf_counter()
+    greenlets = [gevent.spawn(request, inicio) for _ in range(requests)]
+    gevent.joinall(greenlets, raise_error=True)
+    total = time.perf_counter() - inicio
+    pulso.kill()
+    # Desde que llegaron todos juntos hasta que terminó cada uno
+    tiempos = [g.value[1] for g in greenlets]
+    return {
+        "total": total,
+        "p50": statistics.median(tiempos),
+        "max": max(tiempos),
+        "conexiones": len({g.value[0] for g in greenlets}),
+        "atraso_hub": atraso[0],
+    }
+
+
+ronda()  # Precalentar (el pool abre sus conexiones)
+print(json.dumps(ronda()))
+"""
+
+DRIVERS = {
+    # driver: (descripción, DB_POOL_MAX_SIZE)
+    "psycopg2": ("psycopg2, sin pool", "0"),
+    "psycopg": ("psycopg, sin pool", "0"),
+    "pool": ("psycopg + pool", None),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Prueba de carga de la base con el modelo del worker gevent de gunicorn: "
+        "--requests requests concurrentes (greenlets) que hacen una query de "
+        "--espera segundos (pg_sleep). Con psycopg2 el worker se bloquea en cada "
+        "query y los requests salen de a uno; con psycopg cooperativo van en "
+        "paralelo, y con el pool además reusan a lo sumo DB_POOL_MAX_SIZE "
+        "conexiones."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=20)
+        parser.add_argument("--espera", type=float, default=0.2)
+        parser.add_argument("--drivers", nargs="+", choices=list(DRIVERS), default=list(DRIVERS))
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{options['requests']} requests concurrentes x pg_sleep({options['espera']}) "
+            f"(en serie: {options['requests'] * options['espera']:.1f}s); "
+            f"DB_POOL_MAX_SIZE={settings.DB_POOL_MAX_SIZE}"
+        )
+        for driver in options["drivers"]:
+            descripcion, pool = DRIVERS[driver]
+            env = {
+                **os.environ,
+                "BENCH_DRIVER": driver,
+                "BENCH_REQUESTS": str(options["requests"]),
+                "BENCH_ESPERA": str(options["espera"]),
+            }
+            if pool is not None:
+                env["DB_POOL_MAX_SIZE"] = pool
+            proceso = subprocess.run(
+                [sys.executable, "-c", CARGA], cwd=settings.BASE_DIR, env=env, capture_output=True, text=True
+            )
+            if proceso.returncode:
+                raise CommandError(f"{descripcion}: {proceso.stderr.strip()[-2000:]}")
+            r = json.loads(proceso.stdout.strip().splitlines()[-1])
+            self.stdout.write(
+                f"{descripcion:18} total={r['total']:6.2f}s p50={r['p50']:5.2f}s max={r['max']:5.2f}s "
+                f"conexiones={r['conexiones']:>3} hub bloqueado hasta {r['atraso_hub'] * 1000:7.1f}ms"
+            )
@@ -0,0 +1,90 @@
+import statistics
+import time
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import DateField, Max, Sum
+from django.db.models.functions import Coalesce, TruncMonth
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from vsm_app.models import VSM, VSMProducto, consumo_mensual_cc
+from vsm_app.utils import consumo
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara el consumo por mes de 12 meses (hasta el último con consumo) calculado sobre "
+        "VSMProducto + VSM contra leer los acumulados consumo_mensual_*, con los datos "
+        "que hay en la base, y mide lo que agrega mantenerlos en una entrega. Reconstruye "
+        "los acumulados en una transacción que se descarta."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeticiones", type=int, default=5)
+
+    def handle(self, *args, **options):
+        repeticiones = options["repeticiones"]
+
+        with transaction.atomic():
+            try:
+                inicio = time.perf_counter()
+                call_command("reconstruir_consumo", stdout=StringIO())
+                self.stdout.write(f"reconstruir_consumo: {time.perf_counter() - inicio:.1f}s")
+
+                # Los 12 meses hasta el último con consumo
+                hasta = consumo_mensual_cc.objects.aggregate(hasta=Max("mes"))["hasta"] or timezone.localdate()
+                desde = hasta.replace(year=hasta.year - 1)
+
+                for modelo, campo, origen in consumo.TABLAS:
+                    directo = (
+                        VSMProducto.objects.filter(vsm__estado="entregado", vsm__active=True)
+                        .annotate(
+                            mes=TruncMonth(
+                                Coalesce("vsm__fecha_entrega", "vsm__fecha_solicitud"), output_field=DateField()
+                            )
+                        )
+                        .filter(mes__gte=desde, mes__lte=hasta)
+                        .values(origen, "mes")
+                        .annotate(total=Sum("cantidad_entregada"))
+                    )
+                    acumulado = (
+                        modelo.objects.filter(mes__gte=desde, mes__lte=hasta)
+                        .values(campo, "mes")
+                        .annotate(total=Sum("cantidad"))
+                    )
+                    t_directo, filas = self._medir(directo, repeticiones)
+                    t_acumulado, _ = self._medir(acumulado, repeticiones)
+                    self.stdout.write(
+                        f"por {campo:9} filas={filas:>6} VSMProducto={t_directo:8.1f}ms "
+                        f"acumulado={t_acumulado:7.1f}ms"
+                    )
+
+                self._medir_entrega(repeticiones)
+            finally:
+                transaction.set_rollback(True)
+
+    def _medir(self, queryset, repeticiones):
+        tiempos = []
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            filas = len(list(queryset.all()))
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+        return statistics.median(tiempos), filas
+
+    def _medir_entrega(self, repeticiones):
+        vsm = VSM.objects.filter(estado="entregado", active=True, vsmproducto__isnull=False).first()
+        lineas = list(vsm.vsmproducto_set.all())
+        tiempos = []
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            with CaptureQueriesContext(connection) as ctx:
+                consumo.restar(vsm, lineas)
+                consumo.sumar(vsm, lineas)
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+        self.stdout.write(
+            f"reconfirmar un vale de {len(lineas)} líneas (restar + sumar): "
+            f"{len(ctx.captured_queries)} queries, {statistics.median(tiempos):.2f}ms"
+        )
@@ -0,0 +1,82 @@
+import os
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+
+from vsm_app.models import VSM, Usuarios, VSMProducto, centro_costos, empleados, maestro_de_materiales
+from vsm_app.utils import pdf_lote
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide la exportación de PDF en lote (utils/pdf_lote): tiempo hasta el primer "
+        "trozo del ZIP, tiempo total, memoria pico del proceso que arma el ZIP "
+        "(tracemalloc) y tamaño, dibujando en el mismo proceso y con el pool. Los vales "
+        "se crean en una transacción que se descarta."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--vales", type=int, default=200)
+        parser.add_argument("--lineas", type=int, default=10)
+        parser.add_argument(
+            "--procesos", type=int, nargs="+", default=[0, os.cpu_count() or 1], help="0 = en el mismo proceso"
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            try:
+                vales = self._sembrar(options["vales"], options["lineas"])
+                for procesos in options["procesos"]:
+                    self._medir(vales, procesos)
+            finally:
+                transaction.set_rollback(True)
+                pdf_lote._descartar_pool()
+
+    def _sembrar(self, cantidad, lineas):
+        cc = centro_costos.objects.create(codigo="BZIP", descripcion="Centro bench ZIP")
+        retirante = empleados.objects.create(legajo=999_000_002, nombre="Retirante Bench", cc=cc)
+        usuario = Usuarios.objects.create_user(username="bench_zip")
+        materiales = maestro_de_materiales.objects.bulk_create(
+            maestro_de_materiales(codigo=f"BZIP{i}", descripcion=f"MATERIAL BENCH {i}", clase_sap="EPP", centro="1000")
+            for i in range(lineas)
+        )
+        vales = VSM.objects.bulk_create(
+            VSM(centro_costos=cc, solicitante=usuario, retirante=retirante, tipo_entrega=("EPP", "INSUMOS")[i % 2])
+            for i in range(cantidad)
+        )
+        VSMProducto.objects.bulk_create(
+            VSMProducto(vsm=vsm, producto=m, cantidad_solicitada=2, cantidad_entregada=2)
+            for vsm in vales
+            for m in materiales
+        )
+        return VSM.objects.filter(centro_costos=cc).order_by("-fecha_solicitud", "-id")
+
+    def _medir(self, vales, procesos):
+        with override_settings(VSM_PDF_PROCESOS=procesos):
+            if procesos:
+                # Arranque del pool (spawn + django.setup) fuera de la medición
+                list(pdf_lote.zip_de_vales(vales[:procesos]))
+
+            inicio = time.perf_counter()
+            primero = None
+            total = 0
+            for trozo in pdf_lote.zip_de_vales(vales):
+                if primero is None and trozo:
+                    primero = time.perf_counter() - inicio
+                total += len(trozo)
+            duracion = time.perf_counter() - inicio
+
+            # Aparte: con tracemalloc prendido el render en el mismo proceso va mucho más lento
+            tracemalloc.start()
+            for _ in pdf_lote.zip_de_vales(vales):
+                pass
+            _, pico = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        self.stdout.write(
+            f"procesos={procesos:<3} primer_trozo={primero * 1000:7.1f}ms total={duracion:6.2f}s "
+            f"({vales.count() / duracion:6.1f} PDF/s) pico={pico / 1024 / 1024:6.1f}MB zip={total / 1024:8.1f}KB"
+        )
@@ -0,0 +1,53 @@
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from vsm_app.models import VSM
+from vsm_app.utils import exportar_registros
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide la exportación de registros (utils/exportar_registros) con los datos que "
+        "hay en la base: filas, tiempo, tiempo hasta el primer trozo, memoria pico "
+        "(tracemalloc, en una pasada aparte) y tamaño. Con --lista compara contra "
+        "traer todas las filas con list() antes de escribir."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--formatos", nargs="+", default=["csv", "xlsx"], choices=["csv", "xlsx"])
+        parser.add_argument("--cc", help="Filtrar por código de CC (icontains, como registros)")
+        parser.add_argument("--lista", action="store_true", help="Medir también la versión con list()")
+
+    def handle(self, *args, **options):
+        vales = VSM.objects.filter(estado__in=["pendiente", "entregado"], active=True)
+        if options["cc"]:
+            vales = vales.filter(centro_costos__codigo__icontains=options["cc"])
+
+        for formato in options["formatos"]:
+            escribir = exportar_registros.xlsx_en_trozos if formato == "xlsx" else exportar_registros.csv_en_trozos
+            self._medir(f"{formato} iterator", lambda: escribir(exportar_registros.filas(vales)))
+            if options["lista"]:
+                self._medir(f"{formato} list()", lambda: escribir(list(exportar_registros.filas(vales))))
+
+    def _medir(self, nombre, generar):
+        inicio = time.perf_counter()
+        primero = None
+        total = 0
+        for trozo in generar():
+            if primero is None:
+                primero = time.perf_counter() - inicio
+            total += len(trozo)
+        duracion = time.perf_counter() - inicio
+
+        tracemalloc.start()
+        for _ in generar():
+            pass
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        self.stdout.write(
+            f"{nombre:14} total={duracion:6.1f}s primer_trozo={primero:6.2f}s "
+            f"pico={pico / 1024 / 1024:7.1f}MB tamaño={total / 1024 / 1024:6.1f}MB"
+        )
@@ -0,0 +1,148 @@
+import re
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Q
+
+from vsm_app.models import VSM, VSMProducto, maestro_de_materiales, nro_tarjeta
+
+# Índices de la migración 0038 (y el de la FK vsmproducto.vsm que reemplaza)
+INDICES_NUEVOS = (
+    "vsm_listado_idx",
+    "vsm_pendientes_idx",
+    "vsm_aprobacion_idx",
+    "vsmproducto_vsm_prod_idx",
+    "material_codigo_idx",
+    "nro_tarjeta_numero_idx",
+)
+INDICE_FK_VIEJO = "CREATE INDEX bench_vsmproducto_vsm_id ON vsm_app_vsmproducto (vsm_id)"
+
+SEMILLA_SQL = """
+INSERT INTO vsm_app_centro_costos (codigo, descripcion)
+    SELECT 'BCC' || g, 'Centro bench ' || g FROM generate_series(1, 60) g;
+INSERT INTO vsm_app_empleados (legajo, nombre, cc_id)
+    SELECT 900000000 + g, 'Empleado bench ' || g,
+           (SELECT min(id) FROM vsm_app_centro_costos WHERE codigo LIKE 'BCC%%') + g %% 60
+    FROM generate_series(1, 3000) g;
+INSERT INTO vsm_app_usuarios (password, is_superuser, username, first_name, last_name, email,
+                              is_staff, is_active, date_joined, permisos_version, permisos_hash)
+    VALUES ('!', false, 'bench_indices', '', '', '', false, true, now(), 0, '');
+INSERT INTO vsm_app_maestro_de_materiales (codigo, descripcion, clase_sap, centro)
+    SELECT (8000000 + g)::text, 'MATERIAL BENCH ' || g, CASE WHEN g %% 3 = 0 THEN 'EPP' ELSE 'INS' END, '1000'
+    FROM generate_series(1, %(materiales)s) g;
+INSERT INTO vsm_app_nro_tarjeta (numero)
+    SELECT lpad((g * 7919)::text, 10, '0') FROM generate_series(1, 3000) g;
+INSERT INTO vsm_app_vsm (centro_costos_id, solicitante_id, retirante_id, tipo_entrega, tipo_facturacion,
+                         fecha_solicitud, estado, active, estado_sap, actualizado, estado_aprobacion)
+    SELECT (SELECT min(id) FROM vsm_app_centro_costos WHERE codigo LIKE 'BCC%%') + g %% 60,
+           (SELECT id FROM vsm_app_usuarios WHERE username = 'bench_indices'),
+           (SELECT min(id) FROM vsm_app_empleados WHERE legajo > 900000000) + g %% 3000,
+           CASE WHEN g %% 2 = 0 THEN 'EPP' ELSE 'INSUMOS' END, 'FACTURADO',
+           now() - (g || ' minutes')::interval,
+           CASE WHEN g %% 10 = 0 THEN 'rechazado' WHEN g %% 25 = 0 THEN 'pendiente' ELSE 'entregado' END,
+           g %% 50 <> 0, 'procesado', now(),
+           CASE WHEN g %% 7 = 0 THEN 'PENDIENTE' ELSE 'APROBADO' END
+    FROM generate_series(1, %(vales)s) g;
+INSERT INTO vsm_app_vsmproducto (vsm_id, producto_id, cantidad_solicitada, cantidad_entregada)
+    SELECT v.id, (SELECT min(id) FROM vsm_app_maestro_de_materiales WHERE codigo::bigint > 8000000) + (v.id * 31 + k) %% %(materiales)s,
+           1 + k, 1 + k
+    FROM vsm_app_vsm v, generate_series(0, %(lineas)s - 1) k
+    WHERE v.solicitante_id = (SELECT id FROM vsm_app_usuarios WHERE username = 'bench_indices');
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Siembra vales/líneas/materiales y captura EXPLAIN ANALYZE de las consultas de "
+        "los listados sin y con los índices de la migración 0038. Todo corre en una "
+        "transacción que se descarta al final (sólo Postgres)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--vales", type=int, default=300_000)
+        parser.add_argument("--lineas", type=int, default=3, help="Líneas por vale")
+        parser.add_argument("--materiales", type=int, default=20_000)
+        parser.add_argument("--sin-sembrar", action="store_true", help="Usar los datos que ya hay en la base")
+        parser.add_argument("--salida", type=Path, help="Directorio donde guardar los planes completos")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("El benchmark de índices necesita Postgres.")
+
+        with transaction.atomic():
+            try:
+                if not options["sin_sembrar"]:
+                    inicio = time.perf_counter()
+                    with connection.cursor() as cursor:
+                        cursor.execute(SEMILLA_SQL, {k: options[k] for k in ("vales", "lineas", "materiales")})
+                    self.stdout.write(f"Sembrado en {time.perf_counter() - inicio:.1f}s")
+                with connection.cursor() as cursor:
+                    # Las FK de Django son DEFERRABLE: sin esto el CREATE INDEX falla por triggers pendientes
+                    cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+                    cursor.execute("ANALYZE vsm_app_vsm, vsm_app_vsmproducto, vsm_app_maestro_de_materiales, vsm_app_nro_tarjeta")
+
+                consultas = self._consultas()
+
+                sid = transaction.savepoint()
+                with connection.cursor() as cursor:
+                    for nombre in INDICES_NUEVOS:
+                        cursor.execute(f"DROP INDEX IF EXISTS {nombre}")
+                    cursor.execute(INDICE_FK_VIEJO)
+                antes = self._medir(consultas, "antes", options["salida"])
+                transaction.savepoint_rollback(sid)
+
+                despues = self._medir(consultas, "despues", options["salida"])
+            finally:
+                transaction.set_rollback(True)
+
+        self.stdout.write(f"\n{'consulta':28} {'antes':>10} {'después':>10}   plan después")
+        for nombre in consultas:
+            (ms_a, _), (ms_d, nodo_d) = antes[nombre], despues[nombre]
+            self.stdout.write(f"{nombre:28} {ms_a:9.2f}ms {ms_d:9.2f}ms   {nodo_d}")
+
+    def _consultas(self):
+        """Las mismas consultas que arman registros / listar_vsm_pendientes y las vistas de detalle."""
+        base = (
+            VSM.objects.filter(estado__in=["pendiente", "entregado"], active=True)
+            .select_related("solicitante", "retirante__cc", "almacen__empresa")
+            .con_resumen()
+        )
+        orden = ("-fecha_solicitud", "-id")
+
+        # Cursor de una página profunda (~vale 100.000 del listado)
+        profundo = base.order_by(*orden).values("fecha_solicitud", "id")[100_000:100_001].first() or {}
+        fecha, id_ = profundo.get("fecha_solicitud"), profundo.get("id", 0)
+
+        vsm_id = VSM.objects.order_by("-id").values_list("id", flat=True).first() or 0
+        codigo = maestro_de_materiales.objects.order_by("-id").values_list("codigo", flat=True).first() or ""
+        numero = nro_tarjeta.objects.order_by("-id").values_list("numero", flat=True).first() or ""
+
+        consultas = {
+            "registros p1": base.order_by(*orden)[:8],
+            "registros estado=pendiente": base.filter(estado="pendiente").order_by(*orden)[:8],
+            "registros cc": base.filter(centro_costos__codigo__icontains="BCC1").order_by(*orden)[:8],
+            "pendientes aprobación": base.filter(estado="pendiente", estado_aprobacion="PENDIENTE").order_by(*orden)[:8],
+            "lineas de un vale": VSMProducto.objects.filter(vsm_id=vsm_id).select_related("producto"),
+            "material por código": maestro_de_materiales.objects.filter(codigo=codigo),
+            "tarjeta por número": nro_tarjeta.objects.filter(numero=numero),
+        }
+        if fecha:
+            consultas["registros página profunda"] = base.filter(
+                Q(fecha_solicitud__lt=fecha) | Q(fecha_solicitud=fecha, id__lt=id_), fecha_solicitud__lte=fecha
+            ).order_by(*orden)[:8]
+        return consultas
+
+    def _medir(self, consultas, etapa, salida):
+        resultados = {}
+        for nombre, queryset in consultas.items():
+            plan = queryset.explain(analyze=True, buffers=True)
+            ms = float(re.search(r"Execution Time: ([\d.]+) ms", plan).group(1))
+            nodos = re.findall(r"(?:Index Only Scan|Index Scan|Bitmap Index Scan|Seq Scan)[^(]*", plan)
+            resultados[nombre] = (ms, ", ".join(dict.fromkeys(n.strip() for n in nodos))[:110])
+            if salida:
+                salida.mkdir(parents=True, exist_ok=True)
+                archivo = re.sub(r"\W+", "_", nombre).strip("_")
+                (salida / f"{archivo}.{etapa}.txt").write_text(str(queryset.query) + "\n\n" + plan + "\n")
+        return resultados
@@ -0,0 +1,138 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from vsm_app.models import (
+    VSM,
+    PermisoRetiro,
+    Usuarios,
+    almacenes,
+    centro_costos,
+    empleados,
+    empresas,
+    maestro_de_materiales,
+    permiso_empresa_almacen,
+    permisos,
+)
+
+PERMISOS = ("facturado_can_create", "no_facturado_can_create")
+LINEAS = (1, 10, 100)
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide la página nuevo_vsm y sus endpoints JSON (tiempo hasta el primer byte y "
+        "tamaño de la respuesta) con un padrón de empleados sintético, y el alta de vales "
+        "con 1, 10 y 100 líneas. Todo corre en una transacción que se descarta al final."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--empleados", type=int, default=20_000)
+        parser.add_argument("--centros", type=int, default=40, help="Centros de costo permitidos al usuario")
+        parser.add_argument("--almacenes", type=int, default=60)
+        parser.add_argument("--repeticiones", type=int, default=20)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            try:
+                cliente, urls = self._sembrar(options)
+                self._medir(cliente, urls, options["repeticiones"])
+                self._medir_alta(cliente, options["repeticiones"])
+            finally:
+                transaction.set_rollback(True)
+
+    def _sembrar(self, options):
+        inicio = time.perf_counter()
+        centros = centro_costos.objects.bulk_create(
+            centro_costos(codigo=f"BNV{i}", descripcion=f"Centro bench {i}") for i in range(options["centros"])
+        )
+        empleados.objects.bulk_create(
+            (
+                empleados(legajo=800_000_000 + i, nombre=f"Empleado bench {i}", cc=centros[i % len(centros)])
+                for i in range(options["empleados"])
+            ),
+            batch_size=5000,
+        )
+        empresa = empresas.objects.create(empresa="BNV", descripcion="Empresa bench")
+        usuario = Usuarios.objects.create_user(username="bench_nuevo_vsm", password="x")
+        usuario.permisos.set([permisos.objects.get_or_create(nombre=n)[0] for n in PERMISOS])
+        usuario.cc_permitidos.set(centros)
+        usuario.empresas.set([empresa])
+        aprobadores = [usuario]
+        for i in range(options["almacenes"]):
+            vinculo = permiso_empresa_almacen.objects.create(
+                empresa=empresa,
+                almacen=almacenes.objects.create(almacen=f"B{i:03}", empresa=empresa),
+                requiere_aprobacion=i % 3 == 0,
+            )
+            vinculo.usuarios_aprobadores.set(aprobadores)
+        materiales = maestro_de_materiales.objects.bulk_create(
+            maestro_de_materiales(codigo=f"BNV{i}", descripcion=f"Material bench {i}", clase_sap="INS", centro="1000")
+            for i in range(max(LINEAS))
+        )
+        PermisoRetiro.objects.create(centro_costo=centros[0]).producto.set(materiales)
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute(f"ANALYZE {empleados._meta.db_table}")
+        self.stdout.write(f"Sembrados {options['empleados']} empleados en {time.perf_counter() - inicio:.1f}s")
+
+        cliente = Client()
+        cliente.force_login(usuario, backend="django.contrib.auth.backends.ModelBackend")
+        session = cliente.session
+        # Evita que SessionRefresh redirija a Keycloak
+        session["oidc_id_token_expiration"] = time.time() + 3600
+        session.save()
+
+        urls = {
+            "página nuevo_vsm": reverse("nuevo_vsm"),
+            "empleados (1ª página)": f"{reverse('obtener_empleados_por_centro')}?centro_id={centros[0].id}",
+            "empleados buscando": f"{reverse('obtener_empleados_por_centro')}?centro_id={centros[0].id}&q=bench 12",
+            "almacenes de la empresa": f"{reverse('obtener_almacenes_por_empresa')}?empresa_id={empresa.id}",
+        }
+        self.alta = {
+            "solicitante": usuario.id,
+            "centro_costos": centros[0].id,
+            "retirante": empleados.objects.filter(cc=centros[0]).values_list("id", flat=True).first(),
+            "tipo_entrega": "INSUMOS",
+            "almacen": "B000",
+            "tipo_facturacion": "NO_FACTURADO",
+            "estado_aprobacion": "APROBADO",
+        }
+        self.materiales = materiales
+        return cliente, urls
+
+    def _medir(self, cliente, urls, repeticiones):
+        for nombre, url in urls.items():
+            tiempos = []
+            for _ in range(repeticiones):
+                inicio = time.perf_counter()
+                response = cliente.get(url)
+                tiempos.append((time.perf_counter() - inicio) * 1000)
+            tiempos.sort()
+            p95 = tiempos[max(0, int(len(tiempos) * 0.95) - 1)]
+            self.stdout.write(
+                f"{nombre:26} status={response.status_code} bytes={len(response.content):>9} "
+                f"mediana={statistics.median(tiempos):8.2f}ms p95={p95:8.2f}ms"
+            )
+
+    def _medir_alta(self, cliente, repeticiones):
+        for lineas in LINEAS:
+            datos = dict(self.alta, **{f"producto_{m.id}": 2 for m in self.materiales[:lineas]})
+            tiempos = []
+            for _ in range(repeticiones):
+                with CaptureQueriesContext(connection) as ctx:
+                    inicio = time.perf_counter()
+                    response = cliente.post(reverse("nuevo_vsm"), datos)
+                    tiempos.append((time.perf_counter() - inicio) * 1000)
+            vsm = VSM.objects.latest("id")
+            tiempos.sort()
+            p95 = tiempos[max(0, int(len(tiempos) * 0.95) - 1)]
+            self.stdout.write(
+                f"alta con {lineas:>3} líneas        status={response.status_code} queries={len(ctx.captured_queries):>4} "
+                f"lineas={vsm.vsmproducto_set.count():>3} mediana={statistics.median(tiempos):8.2f}ms p95={p95:8.2f}ms"
+            )
@@ -0,0 +1,112 @@
+import base64
+import io
+import statistics
+import time
+import tracemalloc
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+from PIL import Image, ImageDraw
+
+from vsm_app import views
+from vsm_app.models import VSM, Usuarios, VSMProducto, centro_costos, empleados, maestro_de_materiales
+from vsm_app.utils.firmas import compactar_firma, decodificar_firma, guardar_firma, nombre_derivado, nombre_por_contenido
+
+LINEAS = (1, 10, 40)
+
+
+def _firma_de_canvas() -> str:
+    img = Image.new("RGBA", (800, 480), (0, 0, 0, 0))
+    ImageDraw.Draw(img).line([(180, 300), (300, 160), (420, 320), (600, 200)], fill=(20, 20, 20, 255), width=5)
+    salida = io.BytesIO()
+    img.save(salida, "PNG")
+    return "data:image/png;base64," + base64.b64encode(salida.getvalue()).decode()
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara generar_pdf con motor=html (xhtml2pdf) y motor=canvas (ReportLab): "
+        "tiempo de render, memoria pico (tracemalloc) y tamaño, con vales EPP entregados "
+        "de 1, 10 y 40 líneas. Los vales se crean en una transacción que se descarta."
+    )
+
+    _borrar = ()
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeticiones", type=int, default=5)
+        parser.add_argument("--salida", type=Path, help="Directorio donde dejar los PDF para compararlos a ojo")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            try:
+                vales = self._sembrar()
+                for lineas, vsm in vales.items():
+                    for formato in ("vsm", "epp"):
+                        for motor in ("html", "canvas"):
+                            self._medir(vsm, lineas, formato, motor, options)
+            finally:
+                transaction.set_rollback(True)
+                storage = VSMProducto._meta.get_field("firma_retirante").storage
+                for nombre in self._borrar:
+                    storage.delete(nombre)
+                if self._borrar:
+                    # Las subcarpetas firmas/ab/cd que quedaron vacías
+                    carpeta = Path(storage.path(self._borrar[0])).parent
+                    for vacia in (carpeta, carpeta.parent):
+                        if not any(vacia.iterdir()):
+                            vacia.rmdir()
+
+    def _sembrar(self):
+        cc = centro_costos.objects.create(codigo="BPDF", descripcion="Centro bench PDF")
+        retirante = empleados.objects.create(legajo=999_000_001, nombre="Retirante Bench", cc=cc)
+        usuario = Usuarios.objects.create_user(username="bench_pdf")
+        materiales = maestro_de_materiales.objects.bulk_create(
+            maestro_de_materiales(
+                codigo=f"BPDF{i}", descripcion=f"GUANTE NITRILO DESCARTABLE TALLE {i % 4 + 7}", clase_sap="EPP", centro="1000"
+            )
+            for i in range(max(LINEAS))
+        )
+        # Va al storage real (el HTML la busca por ruta); se borra al final si no estaba
+        storage = VSMProducto._meta.get_field("firma_retirante").storage
+        datos = _firma_de_canvas()
+        firma = nombre_por_contenido(compactar_firma(decodificar_firma(datos)))
+        if not storage.exists(firma):
+            self._borrar = [firma, nombre_derivado(firma)]
+        guardar_firma(datos)
+
+        vales = {}
+        for lineas in LINEAS:
+            vsm = VSM.objects.create(
+                centro_costos=cc, solicitante=usuario, retirante=retirante, tipo_entrega="EPP", estado="entregado"
+            )
+            VSMProducto.objects.bulk_create(
+                VSMProducto(vsm=vsm, producto=m, cantidad_solicitada=2, cantidad_entregada=2, firma_retirante=firma)
+                for m in materiales[:lineas]
+            )
+            vales[lineas] = vsm
+        return vales
+
+    def _medir(self, vsm, lineas, formato, motor, options):
+        request = RequestFactory().get("/", {"motor": motor, "formato": formato})
+        views.generar_pdf(request, vsm.id)  # calienta imports y cachés (fuentes, logo)
+
+        tiempos = []
+        for _ in range(options["repeticiones"]):
+            inicio = time.perf_counter()
+            response = views.generar_pdf(request, vsm.id)
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+
+        tracemalloc.start()
+        views.generar_pdf(request, vsm.id)
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        self.stdout.write(
+            f"{formato:3} {lineas:>3} líneas {motor:6} mediana={statistics.median(tiempos):8.1f}ms "
+            f"pico={pico / 1024 / 1024:6.1f}MB bytes={len(response.content):>7}"
+        )
+        if options["salida"]:
+            options["salida"].mkdir(parents=True, exist_ok=True)
+            (options["salida"] / f"{formato}_{lineas}_{motor}.pdf").write_bytes(response.content)
@@ -0,0 +1,55 @@
+import json
+import os
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from test_saponoso import Saponoso
+from vsm_app.utils.sap_transport import close_sap_clients, get_sap_client, sap_env
+
+
+class Command(BaseCommand):
+    help = "Latencia por llamada RFC a SAP con pool frío (cliente nuevo por llamada) vs pool caliente (keep-alive)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rfc", default="STFC_CONNECTION")
+        parser.add_argument("--params", default='{"REQUTEXT": "bench"}', help="Parámetros RFC como JSON")
+        parser.add_argument("--n", type=int, default=20, help="Llamadas por modo")
+        parser.add_argument("--env", default=None, help="QAS/PRO (default: SAP_ENV)")
+
+    def handle(self, *args, **options):
+        env = (options["env"] or sap_env()).upper()
+        params = json.loads(options["params"])
+        n = options["n"]
+
+        kwargs = dict(
+            endpoint=env.lower(),
+            username=os.environ.get("SAP_USERNAME", "COMM_USER1"),
+            password=os.environ.get("SAP_PASSWORD", "Sistemas2013"),
+            verify_ssl=False,
+        )
+
+        close_sap_clients()
+        frio = Saponoso(**kwargs)
+        caliente = Saponoso(client=get_sap_client(env), **kwargs)
+
+        # Una llamada previa abre la conexión del pool; las siguientes la reutilizan.
+        caliente.call_rfc(options["rfc"], params)
+
+        for nombre, sap in (("frio", frio), ("caliente", caliente)):
+            tiempos = []
+            for _ in range(n):
+                inicio = time.perf_counter()
+                sap.call_rfc(options["rfc"], params)
+                tiempos.append((time.perf_counter() - inicio) * 1000)
+            tiempos.sort()
+            self.stdout.write(
+                f"{nombre:9} n={n} "
+                f"media={statistics.mean(tiempos):.1f}ms "
+                f"p50={tiempos[len(tiempos) // 2]:.1f}ms "
+                f"p95={tiempos[min(len(tiempos) - 1, int(len(tiempos) * 0.95))]:.1f}ms "
+                f"max={tiempos[-1]:.1f}ms"
+            )
+
+        close_sap_clients()
@@ -0,0 +1,81 @@
+import random
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from vsm_app.utils.sap_rfc import parse_soap_response
+from vsm_app.utils.soap_stream import iter_stock_rows
+
+
+def generar_respuesta_stock(n_items: int, almacenes=("G001", "G002", "1100"), json_items: bool = False) -> bytes:
+    """Respuesta SOAP sintética de ZRFC_STOCK_SMARTSAFETY con `n_items` filas en T_STOCK."""
+    rnd = random.Random(n_items)
+    filas = []
+    for i in range(n_items):
+        matnr = str(100000 + i).zfill(18)
+        lgort = almacenes[rnd.randrange(len(almacenes))]
+        labst = f"{rnd.randint(0, 500)}.000"
+        if json_items:
+            filas.append(
+                f'<item>{{&quot;MATNR&quot;:&quot;{matnr}&quot;,&quot;LGORT&quot;:&quot;{lgort}&quot;,&quot;LABST&quot;:&quot;{labst}&quot;}}</item>'
+            )
+        else:
+            filas.append(f"<item><MATNR>{matnr}</MATNR><WERKS>1000</WERKS><LGORT>{lgort}</LGORT><LABST>{labst}</LABST></item>")
+
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<soap-env:Envelope xmlns:soap-env="http://schemas.xmlsoap.org/soap/envelope/">'
+        "<soap-env:Body>"
+        '<n0:ZRFC_STOCK_SMARTSAFETYResponse xmlns:n0="urn:sap-com:document:sap:rfc:functions">'
+        f"<T_STOCK>{''.join(filas)}</T_STOCK>"
+        "</n0:ZRFC_STOCK_SMARTSAFETYResponse>"
+        "</soap-env:Body>"
+        "</soap-env:Envelope>"
+    ).encode("utf-8")
+
+
+def _chunks(data: bytes, size: int = 64 * 1024):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+class Command(BaseCommand):
+    help = "Compara parse_soap_response (DOM completo) vs iter_stock_rows (streaming) en respuestas de stock de 1k/10k/100k items."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="1000,10000,100000")
+        parser.add_argument("--materiales", type=int, default=20, help="Materiales pedidos (como el autocomplete)")
+        parser.add_argument("--json", action="store_true", help="Items con JSON embebido en vez de columnas")
+
+    def handle(self, *args, **options):
+        almacen = "G001"
+        for n in [int(x) for x in options["sizes"].split(",")]:
+            xml = generar_respuesta_stock(n, json_items=options["json"])
+            pedidos = {str(100000 + i) for i in range(0, n, max(1, n // options["materiales"]))}
+
+            def dom():
+                data = parse_soap_response(xml.decode("utf-8"))
+                total = 0
+                for item in data.get("T_STOCK") or []:
+                    if item.get("LGORT", "").strip().upper() != almacen:
+                        continue
+                    if item.get("MATNR", "").strip().lstrip("0") in pedidos:
+                        total += 1
+                return total
+
+            def streaming():
+                return sum(1 for _ in iter_stock_rows(_chunks(xml), almacen, pedidos))
+
+            for nombre, fn in (("dom", dom), ("streaming", streaming)):
+                tracemalloc.start()
+                inicio = time.perf_counter()
+                filas = fn()
+                ms = (time.perf_counter() - inicio) * 1000
+                _, pico = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                self.stdout.write(
+                    f"items={n:>7} {nombre:9} filas={filas:>4} "
+                    f"tiempo={ms:8.1f}ms pico_mem={pico / 1024 / 1024:7.2f}MB "
+                    f"xml={len(xml) / 1024 / 1024:.1f}MB"
+                )
@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+
+from vsm_app.models import VSMProducto
+from vsm_app.utils.firmas import compactar_firma, es_por_contenido, guardar_contenido, nombre_derivado, reapuntar_firma
+
+
+class Command(BaseCommand):
+    help = (
+        "Compacta las firmas ya guardadas (recorte al trazo, grises, PNG optimizado), "
+        "genera la versión chica para PDF y apunta las líneas al archivo nuevo. "
+        "Correr después de deduplicar_firmas; se puede volver a correr sin efecto."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Sólo informar, sin escribir ni actualizar nada")
+
+    def handle(self, *args, **options):
+        dry_run = options["dry_run"]
+        storage = VSMProducto._meta.get_field("firma_retirante").storage
+
+        nombres = (
+            VSMProducto.objects.exclude(firma_retirante="")
+            .exclude(firma_retirante__isnull=True)
+            .values_list("firma_retirante", flat=True)
+            .distinct()
+        )
+
+        firmas = compactadas = lineas = bytes_antes = bytes_despues = 0
+        for nombre in sorted(nombres):
+            if not storage.exists(nombre):
+                self.stdout.write(self.style.WARNING(f"⚠️ {nombre} está referenciado pero no existe"))
+                continue
+
+            with storage.open(nombre, "rb") as f:
+                contenido = f.read()
+            compactada = compactar_firma(contenido)
+            if compactada is None:
+                self.stdout.write(self.style.WARNING(f"⚠️ {nombre} no es una imagen, se deja como está"))
+                continue
+
+            firmas += 1
+            bytes_antes += len(contenido)
+            bytes_despues += len(compactada)
+            if dry_run:
+                continue
+
+            nuevo = guardar_contenido(compactada)
+            if nuevo == nombre:
+                continue
+            compactadas += 1
+            lineas += reapuntar_firma(nombre, nuevo)
+            storage.delete(nombre)
+            if es_por_contenido(nombre):
+                storage.delete(nombre_derivado(nombre))
+
+        prefijo = "[dry-run] " if dry_run else ""
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{prefijo}{firmas} firmas, {compactadas} compactadas, {lineas} líneas actualizadas, "
+                f"{bytes_antes / 1024:.1f} KB -> {bytes_despues / 1024:.1f} KB"
+            )
+        )
@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand
+
+from vsm_app.models import VSMProducto
+from vsm_app.utils.firmas import CARPETA, es_por_contenido, guardar_contenido, nombre_por_contenido, reapuntar_firma
+
+
+class Command(BaseCommand):
+    help = (
+        "Pasa las firmas viejas (firmas/firma_<vsm>_<linea>[_xxxx].png) al almacenamiento "
+        "por contenido: cada archivo se guarda bajo su sha256, las líneas que lo usaban "
+        "pasan a apuntar ahí y la copia vieja se borra. Las copias idénticas quedan en un "
+        "solo archivo. Se puede correr más de una vez."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Sólo informar, sin mover ni actualizar nada")
+
+    def handle(self, *args, **options):
+        dry_run = options["dry_run"]
+        storage = VSMProducto._meta.get_field("firma_retirante").storage
+
+        # Archivos sueltos en firmas/ (con o sin línea que los use) y las
+        # referencias de las líneas que todavía no son por contenido.
+        viejos = set()
+        if storage.exists(CARPETA):
+            _, archivos = storage.listdir(CARPETA)
+            viejos.update(f"{CARPETA}/{a}" for a in archivos)
+        referenciados = set(
+            VSMProducto.objects.exclude(firma_retirante="")
+            .exclude(firma_retirante__isnull=True)
+            .values_list("firma_retirante", flat=True)
+            .distinct()
+        )
+        viejos.update(n for n in referenciados if not es_por_contenido(n))
+
+        archivos = lineas = bytes_antes = faltantes = 0
+        unicos = {}
+        for nombre in sorted(viejos):
+            if not storage.exists(nombre):
+                faltantes += 1
+                self.stdout.write(self.style.WARNING(f"⚠️ {nombre} está referenciado pero no existe"))
+                continue
+
+            with storage.open(nombre, "rb") as f:
+                contenido = f.read()
+            nuevo = nombre_por_contenido(contenido)
+            archivos += 1
+            bytes_antes += len(contenido)
+            unicos[nuevo] = len(contenido)
+
+            if dry_run:
+                lineas += VSMProducto.objects.filter(firma_retirante=nombre).count()
+                continue
+
+            guardar_contenido(contenido)
+            lineas += reapuntar_firma(nombre, nuevo)
+            storage.delete(nombre)
+
+        bytes_despues = sum(unicos.values())
+        prefijo = "[dry-run] " if dry_run else ""
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{prefijo}{archivos} archivos -> {len(unicos)} firmas únicas, {lineas} líneas actualizadas, "
+                f"{bytes_antes / 1024:.1f} KB -> {bytes_despues / 1024:.1f} KB"
+                + (f", {faltantes} referencias sin archivo" if faltantes else "")
+            )
+        )
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from vsm_app.utils.sap_outbox import procesar_pendientes
+
+
+class Command(BaseCommand):
+    help = "Drena la cola outbox_entrega_sap posteando las entregas en SAP (ZRFC_INOUT_SMARTSAFETY)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Procesa lo pendiente y termina")
+        parser.add_argument("--lote", type=int, default=10, help="Items por vuelta")
+        parser.add_argument("--intervalo", type=float, default=5.0, help="Segundos de espera con la cola vacía")
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            procesados = procesar_pendientes(options["lote"])
+            if options["once"] and not procesados:
+                break
+            if not procesados:
+                time.sleep(options["intervalo"])
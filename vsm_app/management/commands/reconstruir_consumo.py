@@ -0,0 +1,62 @@
+from itertools import batched
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from vsm_app.utils import consumo
+
+CAMPOS = ("mes", "tipo_entrega", "tipo_facturacion", "cantidad", "lineas", "vales")
+
+
+class Command(BaseCommand):
+    help = (
+        "Arma de cero los acumulados de consumo (consumo_mensual_cc/_material/_almacen) "
+        "desde las líneas de los vales entregados y activos. Corre en una transacción "
+        "con las tablas bloqueadas para escritura: las entregas que se confirmen mientras "
+        "tanto esperan y se suman después. Con --verificar sólo compara."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verificar", action="store_true", help="Informar las diferencias con lo acumulado, sin escribir"
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if not options["verificar"]:
+                # Mismo orden que utils/consumo, para no cruzarse con una entrega
+                with connection.cursor() as cursor:
+                    for modelo, _, _ in consumo.TABLAS:
+                        cursor.execute(f"LOCK TABLE {modelo._meta.db_table} IN EXCLUSIVE MODE")
+
+            for modelo, campo, origen in consumo.TABLAS:
+                filas = consumo.agregados(origen)
+                if options["verificar"]:
+                    self._verificar(modelo, campo, filas)
+                    continue
+
+                modelo.objects.all().delete()
+                total = 0
+                for tanda in batched(filas.iterator(chunk_size=2000), 2000):
+                    modelo.objects.bulk_create(
+                        modelo(**{campo + "_id": f["clave"]}, **{c: f[c] for c in CAMPOS}) for f in tanda
+                    )
+                    total += len(tanda)
+                self.stdout.write(self.style.SUCCESS(f"✅ {modelo._meta.db_table}: {total} filas"))
+
+    def _verificar(self, modelo, campo, filas):
+        def clave(f, dimension):
+            return (f["mes"], f[dimension], f["tipo_entrega"], f["tipo_facturacion"])
+
+        esperado = {clave(f, "clave"): tuple(f[c] for c in CAMPOS[3:]) for f in filas}
+        actual = {
+            clave(f, campo): tuple(f[c] for c in CAMPOS[3:])
+            for f in modelo.objects.values(campo, *CAMPOS)
+        }
+        distintas = [k for k in esperado.keys() | actual.keys() if esperado.get(k) != actual.get(k)]
+        if distintas:
+            self.stdout.write(self.style.WARNING(f"⚠️ {modelo._meta.db_table}: {len(distintas)} filas distintas"))
+            for k in sorted(distintas, key=str)[:20]:
+                self.stdout.write(f"   {k}: acumulado={actual.get(k)} esperado={esperado.get(k)}")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"✅ {modelo._meta.db_table}: {len(esperado)} filas, sin diferencias"))
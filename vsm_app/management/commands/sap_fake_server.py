@@ -0,0 +1,49 @@
+import os
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+
+from vsm_app.utils.sap_fake import FakeSapConfig, run_fake_sap
+from vsm_app.utils.sap_transport import SAP_BASE_URLS
+
+
+class Command(BaseCommand):
+    help = (
+        "Levanta un SAP SOAP simulado (ZRFC_STOCK_SMARTSAFETY / ZRFC_INOUT_SMARTSAFETY). "
+        "Apuntar la app con SAP_ENV=LOCAL (y SAP_ENDPOINT_LOCAL si se cambia host/puerto). "
+        "Con --record DIR hace de proxy contra SAP real y graba; con --replay DIR reproduce lo grabado."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8089)
+        parser.add_argument("--latencia-ms", type=float, default=200)
+        parser.add_argument("--jitter-ms", type=float, default=50)
+        parser.add_argument("--error-rate", type=float, default=0.0, help="0..1, fracción de respuestas HTTP 500")
+        parser.add_argument("--stock-items", type=int, default=1000, help="Filas de T_STOCK si el request no trae T_MATNR")
+        parser.add_argument("--almacenes", default="G001,G002,1100")
+        parser.add_argument("--record", type=Path, help="Directorio donde grabar (proxy contra --upstream)")
+        parser.add_argument("--upstream", default="QAS", help="Entorno SAP real para --record (QAS/PRO)")
+        parser.add_argument("--replay", type=Path, help="Directorio con respuestas grabadas")
+
+    def handle(self, *args, **options):
+        config = FakeSapConfig(
+            latencia_ms=options["latencia_ms"],
+            jitter_ms=options["jitter_ms"],
+            error_rate=options["error_rate"],
+            stock_items=options["stock_items"],
+            almacenes=tuple(a.strip().upper() for a in options["almacenes"].split(",") if a.strip()),
+            replay_dir=options["replay"],
+        )
+
+        if options["record"]:
+            config.record_dir = options["record"]
+            config.upstream = SAP_BASE_URLS[options["upstream"].upper()]
+            config.upstream_auth = (
+                os.getenv("SAP_USER", "comm_user1"),
+                os.getenv("SAP_PASS", "Sistemas2013"),
+            )
+
+        modo = "proxy+grabación" if config.upstream else ("replay" if config.replay_dir else "simulado")
+        self.stdout.write(f"SAP simulado ({modo}) en http://{options['host']}:{options['port']}/sap/bc/soap/rfc")
+        run_fake_sap(options["host"], options["port"], config)
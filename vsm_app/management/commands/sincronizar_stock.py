@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from vsm_app.models import almacenes, maestro_de_materiales
+from vsm_app.utils.stock_snapshot import sincronizar_almacen
+
+
+class Command(BaseCommand):
+    help = (
+        "Sincroniza stock_snapshot con el stock SAP de todos los almacenes. "
+        "Programarlo por cron o correrlo con --intervalo."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--centro", default="1000")
+        parser.add_argument("--almacen", action="append", help="Sólo estos almacenes (repetible)")
+        parser.add_argument("--lote", type=int, default=1000, help="Materiales por llamada a SAP")
+        parser.add_argument("--intervalo", type=float, default=0, help="Repetir cada N segundos (0 = una vez)")
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            self.sincronizar(options)
+            if not options["intervalo"]:
+                break
+            time.sleep(options["intervalo"])
+
+    def sincronizar(self, options):
+        codigos = list(
+            maestro_de_materiales.objects.exclude(codigo="")
+            .values_list("codigo", flat=True)
+            .distinct()
+        )
+        lista_almacenes = options["almacen"] or list(
+            almacenes.objects.values_list("almacen", flat=True).distinct()
+        )
+
+        for almacen in lista_almacenes:
+            inicio = time.perf_counter()
+            res = sincronizar_almacen(options["centro"], almacen, codigos, lote=options["lote"])
+            segundos = time.perf_counter() - inicio
+            if res is None:
+                self.stderr.write(f"❌ {almacen}: SAP no respondió o no hay materiales, snapshot sin cambios")
+                continue
+            self.stdout.write(
+                f"✅ {almacen}: {res['materiales']} materiales, "
+                f"{res['nuevas']} nuevas, {res['cambiadas']} cambiadas, {res['borradas']} borradas ({segundos:.1f}s)"
+            )
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:30
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vsm_app', '0032_outbox_entrega_sap'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='stock_snapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('centro', models.CharField(max_length=4)),
+                ('almacen', models.CharField(max_length=5)),
+                ('material', models.CharField(max_length=100)),
+                ('stock', models.IntegerField(default=0)),
+                ('modificado', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'unique_together': {('centro', 'almacen', 'material')},
+            },
+        ),
+        migrations.CreateModel(
+            name='stock_snapshot_sync',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('centro', models.CharField(max_length=4)),
+                ('almacen', models.CharField(max_length=5)),
+                ('sincronizado', models.DateTimeField()),
+                ('materiales', models.PositiveIntegerField(default=0)),
+                ('cambios', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('centro', 'almacen')},
+            },
+        ),
+    ]
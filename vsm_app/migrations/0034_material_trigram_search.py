@@ -0,0 +1,40 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:05
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+import vsm_app.utils.material_search
+from django.contrib.postgres.operations import TrigramExtension, UnaccentExtension
+from django.db import migrations
+
+
+# unaccent() es STABLE (depende del search_path), así que no se puede usar en
+# un índice. El wrapper fija el diccionario con el schema y se declara IMMUTABLE.
+F_UNACCENT_SQL = """
+CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text
+LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT AS
+$func$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $func$;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vsm_app', '0033_stock_snapshot'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        UnaccentExtension(),
+        migrations.RunSQL(
+            sql=F_UNACCENT_SQL,
+            reverse_sql='DROP FUNCTION IF EXISTS f_unaccent(text);',
+        ),
+        migrations.AddIndex(
+            model_name='maestro_de_materiales',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('codigo'), name='gin_trgm_ops'), name='material_codigo_trgm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='maestro_de_materiales',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper(vsm_app.utils.material_search.FUnaccent('descripcion')), name='gin_trgm_ops'), name='material_desc_trgm_idx'),
+        ),
+    ]
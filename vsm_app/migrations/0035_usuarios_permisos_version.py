@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 13:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vsm_app', '0034_material_trigram_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usuarios',
+            name='permisos_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
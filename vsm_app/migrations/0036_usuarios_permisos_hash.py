@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 13:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vsm_app', '0035_usuarios_permisos_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usuarios',
+            name='permisos_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
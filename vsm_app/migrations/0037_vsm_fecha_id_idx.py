@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-18 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vsm_app', '0036_usuarios_permisos_hash'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='vsm',
+            index=models.Index(fields=['-fecha_solicitud', '-id'], name='vsm_fecha_id_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.6 on 2026-10-18 14:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vsm_app', '0037_vsm_fecha_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='vsm',
+            index=models.Index(condition=models.Q(('active', True), ('estado__in', ['pendiente', 'entregado'])), fields=['-fecha_solicitud', '-id'], name='vsm_listado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vsm',
+            index=models.Index(condition=models.Q(('active', True), ('estado', 'pendiente')), fields=['-fecha_solicitud', '-id'], name='vsm_pendientes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vsm',
+            index=models.Index(condition=models.Q(('active', True), ('estado', 'pendiente')), fields=['estado_aprobacion', '-fecha_solicitud', '-id'], name='vsm_aprobacion_idx'),
+        ),
+        # Primero el compuesto y después se saca el índice simple de la FK
+        migrations.AddIndex(
+            model_name='vsmproducto',
+            index=models.Index(fields=['vsm', 'producto'], include=('cantidad_solicitada', 'cantidad_entregada'), name='vsmproducto_vsm_prod_idx'),
+        ),
+        migrations.AlterField(
+            model_name='vsmproducto',
+            name='vsm',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='vsm_app.vsm'),
+        ),
+        migrations.AddIndex(
+            model_name='maestro_de_materiales',
+            index=models.Index(fields=['codigo'], name='material_codigo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='nro_tarjeta',
+            index=models.Index(fields=['numero'], name='nro_tarjeta_numero_idx'),
+        ),
+    ]
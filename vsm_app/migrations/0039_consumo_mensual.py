@@ -0,0 +1,62 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vsm_app', '0038_indices_listados'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='consumo_mensual_almacen',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mes', models.DateField()),
+                ('tipo_entrega', models.CharField(blank=True, default='', max_length=20)),
+                ('tipo_facturacion', models.CharField(blank=True, default='', max_length=20)),
+                ('cantidad', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('lineas', models.IntegerField(default=0)),
+                ('vales', models.IntegerField(default=0)),
+                ('almacen', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='vsm_app.almacenes')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('mes', 'almacen', 'tipo_entrega', 'tipo_facturacion'), name='consumo_almacen_unico', nulls_distinct=False)],
+            },
+        ),
+        migrations.CreateModel(
+            name='consumo_mensual_cc',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mes', models.DateField()),
+                ('tipo_entrega', models.CharField(blank=True, default='', max_length=20)),
+                ('tipo_facturacion', models.CharField(blank=True, default='', max_length=20)),
+                ('cantidad', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('lineas', models.IntegerField(default=0)),
+                ('vales', models.IntegerField(default=0)),
+                ('cc', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='vsm_app.centro_costos')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('mes', 'cc', 'tipo_entrega', 'tipo_facturacion'), name='consumo_cc_unico')],
+            },
+        ),
+        migrations.CreateModel(
+            name='consumo_mensual_material',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mes', models.DateField()),
+                ('tipo_entrega', models.CharField(blank=True, default='', max_length=20)),
+                ('tipo_facturacion', models.CharField(blank=True, default='', max_length=20)),
+                ('cantidad', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('lineas', models.IntegerField(default=0)),
+                ('vales', models.IntegerField(default=0)),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='vsm_app.maestro_de_materiales')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('mes', 'producto', 'tipo_entrega', 'tipo_facturacion'), name='consumo_material_unico')],
+            },
+        ),
+    ]
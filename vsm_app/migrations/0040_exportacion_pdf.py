@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-18 16:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vsm_app', '0039_consumo_mensual'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='exportacion_pdf',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('exportacion', models.CharField(max_length=64)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('hechos', models.PositiveIntegerField(default=0)),
+                ('cancelada', models.BooleanField(default=False)),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('usuario', 'exportacion')},
+            },
+        ),
+    ]
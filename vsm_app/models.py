@@ -1,5 +1,12 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.db.models import Count, F, Q, Subquery, Sum
+from django.db.models.functions import Coalesce, Upper
+from django.utils import timezone
+
+from vsm_app.utils.firmas import es_por_contenido, nombre_derivado
+from vsm_app.utils.material_search import FUnaccent
 
 
 # Create your models here.
@@ -51,6 +58,21 @@ class maestro_de_materiales(models.Model):
         almacenes, on_delete=models.CASCADE, null=True, blank=True
     )
 
+    class Meta:
+        indexes = [
+            # Búsqueda por substring con pg_trgm (ver utils/material_search.py)
+            GinIndex(
+                OpClass(Upper("codigo"), name="gin_trgm_ops"),
+                name="material_codigo_trgm_idx",
+            ),
+            GinIndex(
+                OpClass(Upper(FUnaccent("descripcion")), name="gin_trgm_ops"),
+                name="material_desc_trgm_idx",
+            ),
+            # Búsqueda exacta por código (stock, altas de vales)
+            models.Index(fields=["codigo"], name="material_codigo_idx"),
+        ]
+
     def __str__(self):
         return f"{self.codigo} - {self.descripcion}"
 
@@ -74,6 +96,11 @@ class Usuarios(AbstractUser):
     empresas = models.ManyToManyField(
         empresas, related_name="usuarios_empresas", blank=True
     )
+    # Se incrementa cada vez que cambian los permisos: invalida el set
+    # cacheado en la sesión (ver utils/permisos.py)
+    permisos_version = models.PositiveIntegerField(default=0)
+    # Hash del último claim Permiso_VSM aplicado (backends._sync_permissions)
+    permisos_hash = models.CharField(max_length=64, blank=True, default="")
 
     def __str__(self):
         return self.username
@@ -82,6 +109,32 @@ class Usuarios(AbstractUser):
         return self.permisos.all()
 
 
+class VSMQuerySet(models.QuerySet):
+    def con_resumen(self):
+        """
+        Anota por vale la cantidad de ítems, los totales solicitado/entregado
+        y las líneas todavía no entregadas completas, con subconsultas que
+        Postgres evalúa sólo para las filas de la página (sin cargar líneas).
+        """
+        lineas = VSMProducto.objects.filter(vsm=models.OuterRef("pk")).order_by().values("vsm")
+        incompleta = Q(cantidad_entregada__isnull=True) | Q(cantidad_entregada__lt=F("cantidad_solicitada"))
+        cantidad = models.DecimalField(max_digits=12, decimal_places=2)
+
+        def por_vale(agregado, output_field):
+            return Coalesce(
+                Subquery(lineas.annotate(valor=agregado).values("valor"), output_field=output_field),
+                0,
+                output_field=output_field,
+            )
+
+        return self.annotate(
+            items=por_vale(Count("id"), models.IntegerField()),
+            total_solicitado=por_vale(Sum("cantidad_solicitada"), cantidad),
+            total_entregado=por_vale(Sum("cantidad_entregada"), cantidad),
+            lineas_pendientes=por_vale(Count("id", filter=incompleta), models.IntegerField()),
+        )
+
+
 class VSM(models.Model):
     ESTADO_CHOICES = [
         ("pendiente", "Pendiente"),
@@ -137,14 +190,44 @@ class VSM(models.Model):
         default="APROBADO",
     )
 
+    class Meta:
+        indexes = [
+            # Orden de los listados y cursores de la paginación keyset
+            models.Index(fields=["-fecha_solicitud", "-id"], name="vsm_fecha_id_idx"),
+            # Parciales para los filtros fijos de registros / pendientes
+            models.Index(
+                fields=["-fecha_solicitud", "-id"],
+                name="vsm_listado_idx",
+                condition=Q(active=True, estado__in=["pendiente", "entregado"]),
+            ),
+            models.Index(
+                fields=["-fecha_solicitud", "-id"],
+                name="vsm_pendientes_idx",
+                condition=Q(active=True, estado="pendiente"),
+            ),
+            models.Index(
+                fields=["estado_aprobacion", "-fecha_solicitud", "-id"],
+                name="vsm_aprobacion_idx",
+                condition=Q(active=True, estado="pendiente"),
+            ),
+        ]
+
+    objects = VSMQuerySet.as_manager()
+
     def entrega_completa(self):
-        return (
-            self.estado == "entregado"
-            and self.cantidad_entregada == self.cantidad_solicitada
-        )
+        """Entregado y con todas las líneas entregadas por lo solicitado."""
+        if self.estado != "entregado":
+            return False
+        pendientes = getattr(self, "lineas_pendientes", None)  # con_resumen()
+        if pendientes is None:
+            pendientes = self.vsmproducto_set.filter(
+                Q(cantidad_entregada__isnull=True) | Q(cantidad_entregada__lt=F("cantidad_solicitada"))
+            ).count()
+        return pendientes == 0
 
 class VSMProducto(models.Model):
-    vsm = models.ForeignKey(VSM, on_delete=models.CASCADE)
+    # Sin índice propio: lo cubre vsmproducto_vsm_prod_idx (vsm primero)
+    vsm = models.ForeignKey(VSM, on_delete=models.CASCADE, db_index=False)
     producto = models.ForeignKey("maestro_de_materiales", on_delete=models.CASCADE)
     cantidad_solicitada = models.DecimalField(max_digits=10, decimal_places=2)
     cantidad_entregada = models.DecimalField(
@@ -152,9 +235,30 @@ class VSMProducto(models.Model):
     )
     firma_retirante = models.ImageField(upload_to="firmas/", null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Líneas de un vale; las cantidades incluidas permiten que el
+            # resumen de los listados (con_resumen) sea index-only.
+            models.Index(
+                fields=["vsm", "producto"],
+                include=["cantidad_solicitada", "cantidad_entregada"],
+                name="vsmproducto_vsm_prod_idx",
+            ),
+        ]
+
     def __str__(self):
         return f"{self.producto.descripcion} - {self.cantidad_solicitada} unidades"
 
+    @property
+    def firma_pdf(self):
+        """Nombre de la firma a incrustar en los PDF: la derivada chica si la hay."""
+        nombre = self.firma_retirante.name
+        return nombre_derivado(nombre) if es_por_contenido(nombre) else nombre
+
+    @property
+    def firma_pdf_url(self):
+        return self.firma_retirante.storage.url(self.firma_pdf) if self.firma_retirante else ""
+
 
 class PermisoRetiro(models.Model):
     centro_costo = models.ForeignKey(centro_costos, on_delete=models.CASCADE)
@@ -184,6 +288,11 @@ class perfil_riesgo(models.Model):
 class nro_tarjeta(models.Model):
     numero = models.CharField(max_length=100)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["numero"], name="nro_tarjeta_numero_idx"),
+        ]
+
     def __str__(self):
         return f"{self.numero}"
 
@@ -209,4 +318,144 @@ class permiso_empresa_almacen(models.Model):
         return f"{self.empresa} - {self.almacen}"
 
     class Meta:
-        unique_together = ("empresa", "almacen")
\ No newline at end of file
+        unique_together = ("empresa", "almacen")
+
+
+class outbox_entrega_sap(models.Model):
+    """Cola (en la DB) de entregas a postear en SAP; la drena procesar_outbox_sap."""
+    ESTADO_CHOICES = [
+        ("pendiente", "Pendiente"),
+        ("procesando", "Procesando"),
+        ("procesado", "Procesado"),
+        ("error", "Error"),
+    ]
+    vsm = models.ForeignKey(VSM, on_delete=models.CASCADE, related_name="outbox_sap")
+    estado = models.CharField(
+        max_length=20, choices=ESTADO_CHOICES, default="pendiente"
+    )
+    intentos = models.PositiveIntegerField(default=0)
+    proximo_intento = models.DateTimeField(default=timezone.now)
+    ultimo_error = models.TextField(null=True, blank=True)
+    creado = models.DateTimeField(auto_now_add=True)
+    actualizado = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"VSM {self.vsm_id} - {self.estado} ({self.intentos} intentos)"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["estado", "proximo_intento"], name="outbox_sap_estado_prox_idx"),
+        ]
+
+
+class stock_snapshot(models.Model):
+    """Copia local del stock SAP por (centro, almacen, material); la llena sincronizar_stock."""
+    centro = models.CharField(max_length=4)
+    almacen = models.CharField(max_length=5)
+    material = models.CharField(max_length=100)
+    stock = models.IntegerField(default=0)
+    modificado = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.centro}/{self.almacen} {self.material}: {self.stock}"
+
+    class Meta:
+        unique_together = ("centro", "almacen", "material")
+
+
+class stock_snapshot_sync(models.Model):
+    """Última sincronización completa de stock_snapshot por centro/almacén."""
+    centro = models.CharField(max_length=4)
+    almacen = models.CharField(max_length=5)
+    sincronizado = models.DateTimeField()
+    materiales = models.PositiveIntegerField(default=0)
+    cambios = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.centro}/{self.almacen} - {self.sincronizado}"
+
+    class Meta:
+        unique_together = ("centro", "almacen")
+
+
+class consumo_mensual(models.Model):
+    """
+    Base de los acumulados de consumo: líneas de vales entregados y activos
+    por mes de entrega, tipo de entrega y facturación. Los mantiene
+    utils/consumo.py al confirmar o eliminar una entrega; reconstruir_consumo
+    los arma de cero.
+    """
+    mes = models.DateField()  # primer día del mes
+    tipo_entrega = models.CharField(max_length=20, blank=True, default="")
+    tipo_facturacion = models.CharField(max_length=20, blank=True, default="")
+    cantidad = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    lineas = models.IntegerField(default=0)
+    vales = models.IntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class consumo_mensual_cc(consumo_mensual):
+    cc = models.ForeignKey(centro_costos, on_delete=models.CASCADE)
+
+    def __str__(self):
+        return f"{self.mes:%Y-%m} {self.cc_id} {self.tipo_entrega}/{self.tipo_facturacion}: {self.cantidad}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["mes", "cc", "tipo_entrega", "tipo_facturacion"], name="consumo_cc_unico"
+            ),
+        ]
+
+
+class consumo_mensual_material(consumo_mensual):
+    producto = models.ForeignKey(maestro_de_materiales, on_delete=models.CASCADE)
+
+    def __str__(self):
+        return f"{self.mes:%Y-%m} {self.producto_id} {self.tipo_entrega}/{self.tipo_facturacion}: {self.cantidad}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["mes", "producto", "tipo_entrega", "tipo_facturacion"], name="consumo_material_unico"
+            ),
+        ]
+
+
+class consumo_mensual_almacen(consumo_mensual):
+    # Los vales sin almacén van en la fila con almacen = NULL
+    almacen = models.ForeignKey(almacenes, on_delete=models.CASCADE, null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.mes:%Y-%m} {self.almacen_id} {self.tipo_entrega}/{self.tipo_facturacion}: {self.cantidad}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["mes", "almacen", "tipo_entrega", "tipo_facturacion"],
+                name="consumo_almacen_unico",
+                nulls_distinct=False,
+            ),
+        ]
+
+
+class exportacion_pdf(models.Model):
+    """
+    Avance y cancelación de una exportación de PDF en ZIP (utils/pdf_lote).
+    Va en la DB y no en el cache porque el ZIP lo arma un worker de gunicorn
+    y la consulta o el pedido de corte pueden caer en otro.
+    """
+    usuario = models.ForeignKey(Usuarios, on_delete=models.CASCADE)
+    exportacion = models.CharField(max_length=64)
+    total = models.PositiveIntegerField(default=0)
+    hechos = models.PositiveIntegerField(default=0)
+    cancelada = models.BooleanField(default=False)
+    actualizado = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.usuario_id}/{self.exportacion}: {self.hechos}/{self.total}"
+
+    class Meta:
+        unique_together = ("usuario", "exportacion")
@@ -1,5 +1,7 @@
 from django import template
 
+from vsm_app.utils.permisos import permisos_usuario
+
 register = template.Library()
 
 @register.filter
@@ -7,4 +9,4 @@ def has_perm(user, perm_name):
 
     if not user.is_authenticated:
         return False
-    return user.permisos.filter(nombre=perm_name).exists()
\ No newline at end of file
+    return perm_name in permisos_usuario(user)
@@ -1,3 +1,1160 @@
-from django.test import TestCase
+import base64
+import csv
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+from urllib.parse import parse_qs
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from openpyxl import load_workbook
+from PIL import Image, ImageDraw
+
+from .models import (
+    VSM,
+    PermisoRetiro,
+    Usuarios,
+    VSMProducto,
+    almacenes,
+    centro_costos,
+    consumo_mensual_almacen,
+    consumo_mensual_cc,
+    consumo_mensual_material,
+    empleados,
+    empresas,
+    maestro_de_materiales,
+    outbox_entrega_sap,
+    permiso_empresa_almacen,
+    permisos,
+    stock_snapshot as stock_snapshot_modelo,
+    stock_snapshot_sync,
+)
+from .utils import exportar_registros, keyset, pdf_lote, sap_outbox, stock_snapshot
+from .utils.firmas import compactar_firma, decodificar_firma, nombre_derivado, nombre_por_contenido
+from .utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+from .utils.permisos import SESSION_KEY
+from .utils.sap_metrics import SapMetrics
+from .utils.singleflight import SingleFlight
+from .utils.soap_stream import iter_stock_rows
+from .utils.stock_cache import StockCache
+
+
+class ListadoTestCase(TestCase):
+    """Usuario logueado con permisos sobre los listados de vales."""
+
+    PERMISOS = (
+        "registros_can_view",
+        "facturado_can_create",
+        "facturado_can_edit",
+        "facturado_can_delete",
+        "facturado_can_deliver",
+        "facturado_can_approve",
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        cc = centro_costos.objects.create(codigo="1000", descripcion="Faena")
+        retirante = empleados.objects.create(legajo=1, nombre="Retirante", cc=cc)
+        cls.user = Usuarios.objects.create_user(username="operador", password="x")
+        cls.user.permisos.set([permisos.objects.create(nombre=n) for n in cls.PERMISOS])
+        cls.cc = cc
+        cls.retirante = retirante
+
+    def setUp(self):
+        self.client.force_login(self.user, backend="django.contrib.auth.backends.ModelBackend")
+        session = self.client.session
+        # Evita que SessionRefresh redirija a Keycloak
+        session["oidc_id_token_expiration"] = time.time() + 3600
+        session.save()
+
+    def _crear_vales(self, cantidad):
+        return VSM.objects.bulk_create(
+            VSM(centro_costos=self.cc, solicitante=self.user, retirante=self.retirante)
+            for _ in range(cantidad)
+        )
+
+
+class PermisosCacheadosTests(ListadoTestCase):
+    """Las páginas de listado consultan los permisos del usuario una sola vez."""
+
+    def _consultas_de_permisos(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return sum(1 for q in ctx.captured_queries if "vsm_app_usuarios_permisos" in q["sql"])
+
+    def _olvidar_permisos_de_sesion(self):
+        session = self.client.session
+        session.pop(SESSION_KEY, None)
+        session.save()
+
+    def test_listados_consultan_permisos_una_vez(self):
+        for nombre in ("registros", "listar_vsm_pendientes"):
+            with self.subTest(pagina=nombre):
+                url = reverse(nombre)
+                self._crear_vales(1)
+                self._olvidar_permisos_de_sesion()
+                con_un_vale = self._consultas_de_permisos(url)
+
+                self._crear_vales(20)
+                self._olvidar_permisos_de_sesion()
+                con_pagina_llena = self._consultas_de_permisos(url)
+
+                self.assertEqual(con_un_vale, 1)
+                self.assertEqual(con_pagina_llena, 1)
+
+    def test_requests_siguientes_usan_la_sesion(self):
+        url = reverse("registros")
+        self._crear_vales(10)
+        self._consultas_de_permisos(url)
+        self.assertEqual(self._consultas_de_permisos(url), 0)
+
+    def test_cambio_de_permisos_invalida_la_sesion(self):
+        url = reverse("registros")
+        self._consultas_de_permisos(url)
+
+        self.user.permisos.remove(permisos.objects.get(nombre="registros_can_view"))
+
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+
+class ResumenDeValesTests(ListadoTestCase):
+    """Los listados muestran ítems y totales sin cargar las líneas."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.materiales = maestro_de_materiales.objects.bulk_create(
+            maestro_de_materiales(codigo=str(i), descripcion=f"Material {i}", clase_sap="EPP", centro="1000")
+            for i in range(3)
+        )
+
+    def _crear_vales_con_lineas(self, cantidad, estado="entregado", entregada=None):
+        vales = self._crear_vales(cantidad)
+        VSM.objects.filter(id__in=[v.id for v in vales]).update(estado=estado)
+        VSMProducto.objects.bulk_create(
+            VSMProducto(vsm=vsm, producto=m, cantidad_solicitada=2, cantidad_entregada=2 if entregada is None else entregada)
+            for vsm in vales
+            for m in self.materiales
+        )
+        return vales
+
+    def _consultas(self, url):
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_listados_no_dependen_de_las_lineas(self):
+        for nombre in ("registros", "listar_vsm_pendientes"):
+            with self.subTest(pagina=nombre):
+                url = reverse(nombre)
+                self._crear_vales_con_lineas(1)
+                con_un_vale = self._consultas(url)
+                self._crear_vales_con_lineas(10)
+                self.assertEqual(self._consultas(url), con_un_vale)
+
+    def test_resumen_y_entrega_completa(self):
+        completo = self._crear_vales_con_lineas(1)[0]
+        parcial = self._crear_vales_con_lineas(1, entregada=1)[0]
+        pendiente = self._crear_vales_con_lineas(1, estado="pendiente", entregada=0)[0]
+
+        resumen = VSM.objects.con_resumen().in_bulk([completo.id, parcial.id, pendiente.id])
+        self.assertEqual(resumen[completo.id].items, 3)
+        self.assertEqual(resumen[completo.id].total_solicitado, 6)
+        self.assertEqual(resumen[parcial.id].total_entregado, 3)
+
+        for vsm, esperado in ((completo, True), (parcial, False), (pendiente, False)):
+            self.assertEqual(resumen[vsm.id].entrega_completa(), esperado)
+            self.assertEqual(VSM.objects.get(id=vsm.id).entrega_completa(), esperado)
+
+
+class KeysetTests(ListadoTestCase):
+    """Paginación por (fecha_solicitud, id) y total cacheado de los listados."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.addCleanup(cache.clear)
+        base = timezone.now()
+        self.vales = self._crear_vales(7)
+        # Empates de fecha: tres vales en la misma, dos en otra
+        for vsm, minutos in zip(self.vales, (0, 0, 0, 5, 5, 10, 15)):
+            VSM.objects.filter(id=vsm.id).update(fecha_solicitud=base + timedelta(minutes=minutos))
+        self.orden = list(VSM.objects.order_by("-fecha_solicitud", "-id").values_list("id", flat=True))
+
+    def _pagina(self, **params):
+        request = RequestFactory().get("/registros", {"estado": "#", **params})
+        return keyset.paginar_keyset(VSM.objects.all(), request, 3, "prueba")
+
+    def _seguir(self, url):
+        params = {k: v[-1] for k, v in parse_qs(url.lstrip("?")).items()}
+        self.assertEqual(params.pop("estado"), "#")  # los filtros se conservan
+        return self._pagina(**params)
+
+    def _ids(self, pagina):
+        return [vsm.id for vsm in pagina]
+
+    def test_recorrer_para_adelante_y_para_atras(self):
+        paginas = [self._pagina()]
+        while paginas[-1].has_next:
+            paginas.append(self._seguir(paginas[-1].next_url))
+
+        self.assertEqual([self._ids(p) for p in paginas], [self.orden[0:3], self.orden[3:6], self.orden[6:]])
+        self.assertFalse(paginas[0].has_previous)
+
+        vuelta = [paginas[-1]]
+        while vuelta[-1].has_previous:
+            vuelta.append(self._seguir(vuelta[-1].previous_url))
+        self.assertEqual([self._ids(p) for p in vuelta], [self._ids(p) for p in reversed(paginas)])
+        self.assertTrue(vuelta[-1].has_next)
+
+    def test_cursor_invalido_es_la_primera_pagina(self):
+        for cursor in ("%%%", "bm9wZQ", "eHwx"):  # basura, "nope", "x|1"
+            with self.subTest(cursor=cursor):
+                for param in (keyset.PARAM_DESPUES, keyset.PARAM_ANTES):
+                    pagina = self._pagina(**{param: cursor})
+                    self.assertEqual(self._ids(pagina), self.orden[:3])
+                    self.assertFalse(pagina.has_previous)
+
+    def test_antes_del_primero_es_la_primera_pagina(self):
+        primero = VSM.objects.get(id=self.orden[0])
+        pagina = self._pagina(antes=keyset._codificar(primero))
+
+        self.assertEqual(self._ids(pagina), self.orden[:3])
+        self.assertFalse(pagina.has_previous)
+        self.assertTrue(pagina.has_next)
+
+    def test_despues_del_ultimo_esta_vacia(self):
+        ultimo = VSM.objects.get(id=self.orden[-1])
+        pagina = self._pagina(despues=keyset._codificar(ultimo))
+
+        self.assertEqual(self._ids(pagina), [])
+        self.assertFalse(pagina.has_next)
+        self.assertIsNone(pagina.previous_url)
+
+    def test_total_cacheado_por_filtros(self):
+        self.assertEqual((self._pagina().total, self._pagina().total_aproximado), (7, False))
+
+        self._crear_vales(2)
+        self.assertEqual(self._pagina().total, 7)  # sigue el cacheado
+        self.assertEqual(self._pagina(estado="pendiente").total, 9)  # otra combinación de filtros
+        cache.clear()
+        self.assertEqual(self._pagina().total, 9)
+
+    @override_settings(VSM_LISTADO_COUNT_EXACTO_MAX=0)
+    def test_total_estimado_por_el_planner(self):
+        with CaptureQueriesContext(connection) as ctx:
+            pagina = self._pagina()
+
+        self.assertTrue(pagina.total_aproximado)
+        self.assertGreater(pagina.total, 0)
+        self.assertFalse(any("COUNT(" in q["sql"].upper() for q in ctx.captured_queries))
+
+
+@override_settings(VSM_JSON_POR_PAGINA=5)
+class DatosDeNuevoVsmTests(ListadoTestCase):
+    """nuevo_vsm no trae el padrón: retirantes y almacenes llegan paginados."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        otro_cc = centro_costos.objects.create(codigo="2000", descripcion="Otro")
+        empleados.objects.bulk_create(
+            [empleados(legajo=100 + i, nombre=f"Empleado {i}", cc=cls.cc) for i in range(12)]
+            + [empleados(legajo=900, nombre="Ajeno", cc=otro_cc)]
+        )
+        cls.user.cc_permitidos.set([cls.cc])
+        cls.otro_cc = otro_cc
+        cls.empresa = empresas.objects.create(empresa="1000", descripcion="Rioplatense")
+        cls.user.empresas.set([cls.empresa])
+        for i in range(7):
+            permiso_empresa_almacen.objects.create(
+                empresa=cls.empresa, almacen=almacenes.objects.create(almacen=f"A{i}", empresa=cls.empresa)
+            )
+
+    def test_pagina_no_incluye_empleados(self):
+        response = self.client.get(reverse("nuevo_vsm"))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("Empleado 1", response.content.decode())
+
+    def test_empleados_paginados_y_del_centro(self):
+        url = reverse("obtener_empleados_por_centro")
+        primera = self.client.get(url, {"centro_id": self.cc.id}).json()
+        self.assertEqual(len(primera["results"]), 5)
+        self.assertTrue(primera["pagination"]["more"])
+
+        ultima = self.client.get(url, {"centro_id": self.cc.id, "page": 3}).json()
+        self.assertEqual([e["text"] for e in ultima["results"]], ["109, Empleado 9", "110, Empleado 10", "111, Empleado 11"])
+        self.assertFalse(ultima["pagination"]["more"])
+
+        buscando = self.client.get(url, {"centro_id": self.cc.id, "q": "Empleado 1"}).json()
+        self.assertEqual(len(buscando["results"]), 3)
+
+        ajeno = self.client.get(url, {"centro_id": self.otro_cc.id}).json()
+        self.assertEqual(ajeno["results"], [])
+
+    def test_almacenes_paginados_y_de_empresas_del_usuario(self):
+        url = reverse("obtener_almacenes_por_empresa")
+        primera = self.client.get(url, {"empresa_id": self.empresa.id}).json()
+        segunda = self.client.get(url, {"empresa_id": self.empresa.id, "page": 2}).json()
+        self.assertEqual(len(primera["almacenes"]), 5)
+        self.assertEqual(len(segunda["almacenes"]), 2)
+        self.assertFalse(segunda["pagination"]["more"])
+
+        otra = empresas.objects.create(empresa="2000", descripcion="Otra")
+        self.assertEqual(self.client.get(url, {"empresa_id": otra.id}).json()["almacenes"], [])
+
+
+class AltaDeValeTests(ListadoTestCase):
+    """nuevo_vsm crea cabecera y líneas con una cantidad fija de queries."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.materiales = maestro_de_materiales.objects.bulk_create(
+            maestro_de_materiales(codigo=str(i), descripcion=f"Material {i}", clase_sap="INS", centro="1000")
+            for i in range(30)
+        )
+        PermisoRetiro.objects.create(centro_costo=cls.cc).producto.set(cls.materiales[:25])
+
+    def _alta(self, materiales):
+        datos = {
+            "solicitante": self.user.id,
+            "centro_costos": self.cc.id,
+            "retirante": self.retirante.id,
+            "tipo_entrega": "INSUMOS",
+            **{f"producto_{m.id}": 3 for m in materiales},
+        }
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(reverse("nuevo_vsm"), datos)
+        return response, len(ctx.captured_queries)
+
+    def test_queries_no_dependen_de_las_lineas(self):
+        self._alta(self.materiales[:1])  # deja los permisos en la sesión
+        _, con_una = self._alta(self.materiales[:1])
+        response, con_veinte = self._alta(self.materiales[:20])
+
+        self.assertRedirects(response, reverse("home"), fetch_redirect_response=False)
+        self.assertEqual(con_una, con_veinte)
+        self.assertEqual(VSM.objects.latest("id").vsmproducto_set.count(), 20)
+
+    def test_producto_no_permitido_no_crea_el_vale(self):
+        response, _ = self._alta(self.materiales[20:])
+
+        self.assertRedirects(response, reverse("nuevo_vsm"), fetch_redirect_response=False)
+        self.assertFalse(VSM.objects.exists())
+        self.assertFalse(VSMProducto.objects.exists())
+
+
+def _firma_de_canvas():
+    """Data URL como el que manda el canvas: RGBA 800x480 transparente con un trazo."""
+    img = Image.new("RGBA", (800, 480), (0, 0, 0, 0))
+    ImageDraw.Draw(img).line([(200, 150), (400, 300), (550, 180)], fill=(0, 0, 0, 255), width=4)
+    salida = BytesIO()
+    img.save(salida, "PNG")
+    return "data:image/png;base64," + base64.b64encode(salida.getvalue()).decode()
+
+
+class ConfirmarEntregaTests(ListadoTestCase):
+    """La entrega escribe la firma una vez y las líneas en un solo UPDATE."""
+
+    FIRMA = _firma_de_canvas()
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.materiales = maestro_de_materiales.objects.bulk_create(
+            maestro_de_materiales(codigo=str(i), descripcion=f"Material {i}", clase_sap="EPP", centro="1000")
+            for i in range(20)
+        )
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media = media.name
+        ajuste = self.settings(MEDIA_ROOT=self.media)
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+
+    def _entregar(self, lineas):
+        vsm = VSM.objects.create(
+            centro_costos=self.cc, solicitante=self.user, retirante=self.retirante, tipo_entrega="EPP"
+        )
+        VSMProducto.objects.bulk_create(
+            VSMProducto(vsm=vsm, producto=m, cantidad_solicitada=2) for m in self.materiales[:lineas]
+        )
+        datos = {f"cantidad_entregada_{vp.id}": 2 for vp in vsm.vsmproducto_set.all()}
+        datos["firma_base64"] = self.FIRMA
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(reverse("confirmar_entrega", args=[vsm.id]), datos)
+        self.assertEqual(response.status_code, 200)
+        return vsm, len(ctx.captured_queries)
+
+    def test_queries_y_archivos_fijos(self):
+        self._entregar(1)  # deja los permisos en la sesión
+        _, con_una = self._entregar(1)
+        vsm, con_veinte = self._entregar(20)
+
+        self.assertEqual(con_una, con_veinte)
+        lineas = list(vsm.vsmproducto_set.all())
+        self.assertEqual({vp.firma_retirante.name for vp in lineas}, {self._nombre_compactada()})
+        self.assertTrue(all(vp.cantidad_entregada == 2 for vp in lineas))
+        # La misma firma en tres entregas: un solo archivo (y su derivada para PDF)
+        self.assertEqual(len(self._archivos()), 2)
+
+        vsm.refresh_from_db()
+        self.assertEqual(vsm.estado, "entregado")
+
+    def _nombre_compactada(self):
+        return nombre_por_contenido(compactar_firma(decodificar_firma(self.FIRMA)))
+
+    def _archivos(self):
+        return sorted(
+            os.path.relpath(os.path.join(d, a), self.media) for d, _, archivos in os.walk(self.media) for a in archivos
+        )
+
+    def test_firma_compactada(self):
+        vsm, _ = self._entregar(1)
+        vp = vsm.vsmproducto_set.get()
+
+        with Image.open(vp.firma_retirante.path) as img:
+            self.assertEqual(img.mode, "L")
+            self.assertLess(img.width, 400)
+        with Image.open(os.path.join(self.media, vp.firma_pdf)) as img:
+            self.assertEqual(img.mode, "1")
+        self.assertEqual(vp.firma_pdf, nombre_derivado(vp.firma_retirante.name))
+
+    def _actualizado(self, vsm):
+        return VSM.objects.values_list("actualizado", flat=True).get(id=vsm.id)
+
+    def test_deduplicar_y_compactar_firmas_viejas(self):
+        vsm, _ = self._entregar(2)
+        carpeta = os.path.join(self.media, "firmas")
+        contenido = decodificar_firma(self.FIRMA)
+        for i, vp in enumerate(vsm.vsmproducto_set.all()):
+            viejo = f"firma_{vsm.id}_{vp.id}_{i}.png"
+            with open(os.path.join(carpeta, viejo), "wb") as f:
+                f.write(contenido)
+            VSMProducto.objects.filter(id=vp.id).update(firma_retirante=f"firmas/{viejo}")
+        with open(os.path.join(carpeta, "firma_huerfana.png"), "wb") as f:
+            f.write(contenido)
+
+        antes = self._actualizado(vsm)
+        call_command("deduplicar_firmas", stdout=StringIO())
+        self.assertEqual(set(vsm.vsmproducto_set.values_list("firma_retirante", flat=True)), {nombre_por_contenido(contenido)})
+        # Cambió la firma que va en el PDF: el ETag tiene que cambiar
+        self.assertGreater(self._actualizado(vsm), antes)
+
+        antes = self._actualizado(vsm)
+        call_command("compactar_firmas", stdout=StringIO())
+        self.assertGreater(self._actualizado(vsm), antes)
+        nombre = self._nombre_compactada()
+        self.assertEqual(set(vsm.vsmproducto_set.values_list("firma_retirante", flat=True)), {nombre})
+        self.assertEqual(self._archivos(), sorted([nombre, nombre_derivado(nombre)]))
+
+    def test_pdf_revalida_con_etag(self):
+        vsm, _ = self._entregar(1)
+        url = reverse("generar_pdf", args=[vsm.id])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        revalidacion = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(revalidacion.status_code, 304)
+
+        VSM.objects.get(id=vsm.id).save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 200)
+
+    def test_pdf_con_motor_canvas(self):
+        vsm, _ = self._entregar(3)
+        url = reverse("generar_pdf", args=[vsm.id])
+        etags = set()
+        for formato in ("vsm", "epp"):
+            for motor in ("html", "canvas"):
+                response = self.client.get(url, {"formato": formato, "motor": motor})
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response.content.startswith(b"%PDF"))
+                etags.add(response["ETag"])
+        # Cada combinación revalida por separado
+        self.assertEqual(len(etags), 4)
+
+
+class ExportarPdfsTests(ListadoTestCase):
+    """El ZIP de PDF respeta los filtros de registros, informa el avance y se puede cortar."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        otro_cc = centro_costos.objects.create(codigo="2000", descripcion="Mantenimiento")
+        material = maestro_de_materiales.objects.create(codigo="1", descripcion="Guante", clase_sap="EPP", centro="1000")
+        cls.vales = [
+            VSM.objects.create(centro_costos=cc, solicitante=cls.user, retirante=cls.retirante, tipo_entrega=tipo)
+            for cc, tipo in ((cls.cc, "EPP"), (cls.cc, "INSUMOS"), (cls.cc, "EPP"), (otro_cc, "EPP"))
+        ]
+        VSMProducto.objects.bulk_create(
+            VSMProducto(vsm=vsm, producto=material, cantidad_solicitada=1) for vsm in cls.vales
+        )
+
+    def _exportar(self, **params):
+        response = self.client.get(reverse("exportar_pdfs"), {"cc": "1000", "exportacion": "prueba", **params})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Vales-Total"], "3")
+        return response
+
+    def _pdfs(self, response):
+        with zipfile.ZipFile(BytesIO(b"".join(response.streaming_content))) as archivo:
+            pdfs = {nombre: archivo.read(nombre) for nombre in archivo.namelist()}
+        self.assertTrue(all(pdf.startswith(b"%PDF") for pdf in pdfs.values()))
+        return pdfs
+
+    def _estado(self):
+        return self.client.get(reverse("estado_exportacion_pdfs", args=["prueba"])).json()
+
+    @override_settings(VSM_PDF_PROCESOS=0, VSM_EXPORTAR_CHUNK=2)
+    def test_zip_con_los_vales_filtrados(self):
+        pdfs = self._pdfs(self._exportar())
+
+        self.assertEqual(set(pdfs), {f"VSM_{vsm.id}.pdf" for vsm in self.vales[:3]})
+        self.assertEqual(self._estado(), {"total": 3, "hechos": 3, "cancelada": False})
+
+    @override_settings(VSM_PDF_PROCESOS=0)
+    def test_cancelar_cierra_el_zip_con_lo_hecho(self):
+        response = self._exportar()
+        self.client.post(reverse("estado_exportacion_pdfs", args=["prueba"]))
+
+        self.assertEqual(len(self._pdfs(response)), 1)
+        self.assertEqual(self._estado(), {"total": 3, "hechos": 1, "cancelada": True})
+
+    @override_settings(
+        VSM_PDF_PROCESOS=0,
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}},
+    )
+    def test_avance_y_corte_sin_estado_del_proceso(self):
+        # Con un cache que no guarda nada, como si la consulta cayera en otro worker
+        response = self._exportar()
+        self.assertEqual(self._estado(), {"total": 3, "hechos": 0, "cancelada": False})
+        self.client.post(reverse("estado_exportacion_pdfs", args=["prueba"]))
+
+        self.assertEqual(len(self._pdfs(response)), 1)
+        self.assertEqual(self._estado(), {"total": 3, "hechos": 1, "cancelada": True})
+
+    @override_settings(VSM_PDF_PROCESOS=2)
+    def test_pool_de_procesos(self):
+        self.addCleanup(pdf_lote._descartar_pool)
+        pdfs = self._pdfs(self._exportar())
+
+        self.assertEqual(set(pdfs), {f"VSM_{vsm.id}.pdf" for vsm in self.vales[:3]})
+
+
+class ExportarRegistrosTests(ListadoTestCase):
+    """CSV y XLSX: una fila por línea de los vales filtrados."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        otro_cc = centro_costos.objects.create(codigo="2000", descripcion="Mantenimiento")
+        materiales = maestro_de_materiales.objects.bulk_create(
+            maestro_de_materiales(codigo=str(i), descripcion=f"Material {i}", clase_sap="EPP", centro="1000")
+            for i in range(3)
+        )
+        cls.vsm = VSM.objects.create(
+            centro_costos=cls.cc, solicitante=cls.user, retirante=cls.retirante, numero_sap="4900000001"
+        )
+        otro = VSM.objects.create(centro_costos=otro_cc, solicitante=cls.user, retirante=cls.retirante)
+        VSMProducto.objects.bulk_create(
+            [VSMProducto(vsm=cls.vsm, producto=m, cantidad_solicitada=2, cantidad_entregada=1) for m in materiales]
+            + [VSMProducto(vsm=otro, producto=materiales[0], cantidad_solicitada=5)]
+        )
+
+    def _descargar(self, **params):
+        response = self.client.get(reverse("exportar_registros"), {"cc": "1000", "estado": "#", **params})
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content)
+
+    @override_settings(VSM_EXPORTAR_FILAS_CHUNK=2)
+    def test_csv(self):
+        contenido = self._descargar().decode("utf-8-sig")
+        encabezado, *filas = list(csv.reader(StringIO(contenido)))
+
+        self.assertEqual(encabezado, [nombre for nombre, _ in exportar_registros.COLUMNAS])
+        self.assertEqual([f[10] for f in filas], ["0", "1", "2"])
+        self.assertEqual({(f[0], f[8], f[12], f[13], f[14]) for f in filas}, {(str(self.vsm.id), "1000", "2.00", "1.00", "4900000001")})
+
+    def test_xlsx_sigue_en_otra_hoja(self):
+        with mock.patch.object(exportar_registros, "MAX_FILAS_HOJA", 3):
+            libro = load_workbook(BytesIO(self._descargar(formato="xlsx")), read_only=True)
+
+        self.assertEqual(libro.sheetnames, ["Registros", "Registros 2"])
+        filas = [fila for hoja in libro for fila in hoja.iter_rows(min_row=2, values_only=True)]
+        self.assertEqual([f[10] for f in filas], ["0", "1", "2"])
+        self.assertEqual(filas[0][12], 2)
+        self.assertIsNone(filas[0][2])
+
+
+class ConsumoTests(ListadoTestCase):
+    """Los acumulados de consumo siguen a confirmar_entrega y eliminar_vsm, y coinciden con reconstruir."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.materiales = maestro_de_materiales.objects.bulk_create(
+            maestro_de_materiales(codigo=str(i), descripcion=f"Material {i}", clase_sap="INS", centro="1000")
+            for i in range(3)
+        )
+
+    def _vale(self, tipo_facturacion="FACTURADO"):
+        vsm = VSM.objects.create(
+            centro_costos=self.cc, solicitante=self.user, retirante=self.retirante,
+            tipo_entrega="INSUMOS", tipo_facturacion=tipo_facturacion,
+        )
+        VSMProducto.objects.bulk_create(
+            VSMProducto(vsm=vsm, producto=m, cantidad_solicitada=5) for m in self.materiales[:2]
+        )
+        return vsm
+
+    def _entregar(self, vsm, cantidad):
+        datos = {f"cantidad_entregada_{vp.id}": cantidad for vp in vsm.vsmproducto_set.all()}
+        response = self.client.post(reverse("confirmar_entrega", args=[vsm.id]), datos)
+        self.assertEqual(response.status_code, 200)
+
+    def _por_cc(self):
+        return {
+            (f.tipo_facturacion, f.cantidad, f.lineas, f.vales)
+            for f in consumo_mensual_cc.objects.filter(cc=self.cc)
+        }
+
+    def _sin_diferencias(self):
+        salida = StringIO()
+        call_command("reconstruir_consumo", "--verificar", stdout=salida)
+        self.assertEqual(salida.getvalue().count("sin diferencias"), 3, salida.getvalue())
+
+    def test_entregar_reconfirmar_y_eliminar(self):
+        a, b, c = self._vale(), self._vale(), self._vale("NO_FACTURADO")
+        self._entregar(a, 2)
+        self._entregar(b, 3)
+        self._entregar(c, 1)
+        self.assertEqual(self._por_cc(), {("FACTURADO", 10, 4, 2), ("NO_FACTURADO", 2, 2, 1)})
+        self.assertEqual(consumo_mensual_material.objects.get(producto=self.materiales[0], tipo_facturacion="FACTURADO").cantidad, 5)
+        self._sin_diferencias()
+
+        # Reconfirmar no suma dos veces
+        self._entregar(a, 4)
+        self.assertEqual(self._por_cc(), {("FACTURADO", 14, 4, 2), ("NO_FACTURADO", 2, 2, 1)})
+
+        self.client.post(reverse("eliminar_vsm", args=[c.id]))
+        self.assertEqual(self._por_cc(), {("FACTURADO", 14, 4, 2)})
+        self.assertFalse(consumo_mensual_almacen.objects.filter(tipo_facturacion="NO_FACTURADO").exists())
+        self._sin_diferencias()
+
+    def test_rechazo_de_sap_descuenta_el_vale(self):
+        a, b = self._vale(), self._vale()
+        self._entregar(a, 2)
+        self._entregar(b, 3)
+
+        rechazo = {"success": False, "error": "Material bloqueado", "reintentable": False}
+        with mock.patch.object(sap_outbox, "enviar_entrega_a_sap", return_value=rechazo):
+            sap_outbox.procesar_item(a.outbox_sap.get().id)
+
+        a.refresh_from_db()
+        self.assertEqual((a.estado, a.estado_sap), ("pendiente", "error"))
+        self.assertEqual(self._por_cc(), {("FACTURADO", 6, 2, 1)})
+        self._sin_diferencias()
+
+        # Reconfirmado vuelve a sumar una sola vez
+        self._entregar(a, 2)
+        self.assertEqual(self._por_cc(), {("FACTURADO", 10, 4, 2)})
+        self._sin_diferencias()
+
+    def test_vale_eliminado_no_se_entrega(self):
+        a, b = self._vale(), self._vale()
+        self._entregar(a, 2)
+        VSM.objects.filter(id=b.id).update(active=False)
+
+        datos = {f"cantidad_entregada_{vp.id}": 3 for vp in b.vsmproducto_set.all()}
+        response = self.client.post(reverse("confirmar_entrega", args=[b.id]), datos)
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self._por_cc(), {("FACTURADO", 4, 2, 1)})
+        self.assertFalse(b.outbox_sap.exists())
+        self.assertEqual(VSM.objects.get(id=b.id).estado, "pendiente")
+        self._sin_diferencias()
+
+    def test_reconstruir_y_reporte(self):
+        self._entregar(self._vale(), 2)
+        self._entregar(self._vale("NO_FACTURADO"), 1)
+        antes = self._por_cc()
+        consumo_mensual_cc.objects.all().delete()
+
+        call_command("reconstruir_consumo", stdout=StringIO())
+        self.assertEqual(self._por_cc(), antes)
+        self._sin_diferencias()
+
+        self.client.get(reverse("reporte_consumo"))  # deja los permisos en la sesión
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse("reporte_consumo"), {"por": "material", "tipo_facturacion": "FACTURADO"})
+        filas = response.context["filas"]
+        self.assertEqual([(f["nombre"], f["total"], f["vales"]) for f in filas], [
+            (str(self.materiales[0]), 2, 1), (str(self.materiales[1]), 2, 1),
+        ])
+        self.assertEqual(filas[0]["meses"][-1], 2)
+
+
+class OutboxTestCase(ListadoTestCase):
+    """Vales entregados con su envío a SAP en la cola."""
+
+    EXITO = {"success": True, "mat_doc": "4900000001", "doc_year": "2026"}
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.material = maestro_de_materiales.objects.create(codigo="1", descripcion="Guante", clase_sap="EPP", centro="1000")
+
+    def _encolado(self):
+        vsm = VSM.objects.create(
+            centro_costos=self.cc, solicitante=self.user, retirante=self.retirante,
+            estado="entregado", fecha_entrega=timezone.now(),
+        )
+        VSMProducto.objects.create(vsm=vsm, producto=self.material, cantidad_solicitada=1, cantidad_entregada=1)
+        return vsm, sap_outbox.encolar_entrega(vsm)
+
+    def _procesar(self, item, resultado, **kwargs):
+        with mock.patch.object(sap_outbox, "enviar_entrega_a_sap", return_value=resultado, **kwargs):
+            return sap_outbox.procesar_item(item.id)
+
+
+class OutboxTests(OutboxTestCase):
+    """Cola de envíos a SAP: reclamo con lease, reintentos con backoff y resultado en el vale."""
+
+    def test_encolar_reutiliza_el_envio_en_curso(self):
+        vsm, item = self._encolado()
+        self.assertEqual(sap_outbox.encolar_entrega(vsm), item)
+
+        outbox_entrega_sap.objects.filter(id=item.id).update(estado="procesando")
+        self.assertEqual(sap_outbox.encolar_entrega(vsm), item)
+
+        outbox_entrega_sap.objects.filter(id=item.id).update(estado="error")
+        self.assertNotEqual(sap_outbox.encolar_entrega(vsm), item)
+
+    @override_settings(SAP_OUTBOX_LEASE=300)
+    def test_lease_y_reclamo(self):
+        _, item = self._encolado()
+        self.assertEqual(sap_outbox.reclamar_pendientes(), [item.id])
+        self.assertEqual(sap_outbox.reclamar_pendientes(), [])
+
+        # El worker que lo tenía murió: vencido el lease otro lo retoma
+        outbox_entrega_sap.objects.filter(id=item.id).update(proximo_intento=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(sap_outbox.reclamar_pendientes(), [item.id])
+
+    def test_exito_escribe_el_documento(self):
+        vsm, item = self._encolado()
+        sap_outbox.reclamar_pendientes()
+
+        self.assertTrue(self._procesar(item, self.EXITO))
+
+        vsm.refresh_from_db()
+        self.assertEqual((vsm.numero_sap, vsm.anio_documento), ("4900000001", "2026"))
+        self.assertEqual((vsm.estado, vsm.estado_sap), ("entregado", "procesado"))
+        item.refresh_from_db()
+        self.assertEqual((item.estado, item.intentos, item.ultimo_error), ("procesado", 1, None))
+
+    @override_settings(SAP_OUTBOX_BACKOFF_BASE=30, SAP_OUTBOX_BACKOFF_MAX=3600, SAP_OUTBOX_MAX_INTENTOS=3)
+    def test_reintentos_con_backoff_hasta_max_intentos(self):
+        vsm, item = self._encolado()
+        falla = {"success": False, "error": "timeout", "reintentable": True}
+
+        for intento, espera in ((1, 30), (2, 60)):
+            antes = timezone.now()
+            self.assertFalse(self._procesar(item, falla))
+            item.refresh_from_db()
+            self.assertEqual((item.estado, item.intentos), ("pendiente", intento))
+            self.assertGreaterEqual(item.proximo_intento, antes + timedelta(seconds=espera))
+            self.assertLess(item.proximo_intento, antes + timedelta(seconds=espera + 5))
+            self.assertEqual(sap_outbox.reclamar_pendientes(), [])
+
+        # Una excepción también es reintentable; en el último intento el vale vuelve a pendiente
+        self.assertFalse(self._procesar(item, None, side_effect=RuntimeError("SAP caído")))
+        item.refresh_from_db()
+        self.assertEqual((item.estado, item.intentos, item.ultimo_error), ("error", 3, "SAP caído"))
+        vsm.refresh_from_db()
+        self.assertEqual((vsm.estado, vsm.estado_sap), ("pendiente", "error"))
+
+    def test_rechazo_no_reintentable(self):
+        vsm, item = self._encolado()
+
+        self.assertFalse(self._procesar(item, {"success": False, "error": "Material bloqueado", "reintentable": False}))
+
+        item.refresh_from_db()
+        self.assertEqual((item.estado, item.intentos), ("error", 1))
+        vsm.refresh_from_db()
+        self.assertEqual((vsm.estado, vsm.estado_sap, vsm.numero_sap), ("pendiente", "error", None))
+
+
+class OutboxSkipLockedTests(TransactionTestCase):
+    """Dos workers no toman el mismo item: el bloqueado por otro se saltea."""
+
+    def test_item_bloqueado_se_saltea(self):
+        cc = centro_costos.objects.create(codigo="1000", descripcion="Faena")
+        retirante = empleados.objects.create(legajo=1, nombre="Retirante", cc=cc)
+        usuario = Usuarios.objects.create_user(username="operador", password="x")
+        bloqueado, libre = (
+            sap_outbox.encolar_entrega(VSM.objects.create(centro_costos=cc, solicitante=usuario, retirante=retirante))
+            for _ in range(2)
+        )
+        tomado, soltar = threading.Event(), threading.Event()
+
+        def otro_worker():
+            try:
+                with transaction.atomic():
+                    outbox_entrega_sap.objects.select_for_update().get(id=bloqueado.id)
+                    tomado.set()
+                    soltar.wait(5)
+            finally:
+                connection.close()
+
+        hilo = threading.Thread(target=otro_worker)
+        hilo.start()
+        try:
+            self.assertTrue(tomado.wait(5))
+            self.assertEqual(sap_outbox.reclamar_pendientes(), [libre.id])
+        finally:
+            soltar.set()
+            hilo.join(5)
+        self.assertEqual(sap_outbox.reclamar_pendientes(), [bloqueado.id])
+
+
+class EliminarDuranteEnvioTests(OutboxTestCase):
+    """Un vale no se elimina a mitad del envío y el worker no escribe sobre uno eliminado."""
+
+    def test_envio_en_curso_no_se_elimina(self):
+        vsm, item = self._encolado()
+        sap_outbox.reclamar_pendientes()
+
+        response = self.client.post(reverse("eliminar_vsm", args=[vsm.id]))
+
+        self.assertEqual(response.status_code, 409)
+        self.assertTrue(VSM.objects.get(id=vsm.id).active)
+
+    def test_envio_pendiente_se_cancela(self):
+        vsm, item = self._encolado()
+
+        response = self.client.post(reverse("eliminar_vsm", args=[vsm.id]))
+
+        self.assertTrue(response.json()["success"])
+        item.refresh_from_db()
+        self.assertEqual(item.estado, "error")
+        self.assertEqual(sap_outbox.reclamar_pendientes(), [])
+
+    def test_eliminado_durante_el_envio_se_revierte(self):
+        vsm, item = self._encolado()
+
+        def eliminar_en_el_medio(_vsm):
+            VSM.objects.filter(id=vsm.id).update(active=False)
+            return self.EXITO
+
+        with mock.patch.object(sap_outbox, "eliminar_entrega_de_sap", return_value={"success": True}) as reversa:
+            self.assertFalse(self._procesar(item, None, side_effect=eliminar_en_el_medio))
+
+        self.assertEqual(reversa.call_args.args[0].numero_sap, "4900000001")
+        vsm.refresh_from_db()
+        self.assertIsNone(vsm.numero_sap)
+        item.refresh_from_db()
+        self.assertEqual(item.estado, "error")
+        self.assertIn("4900000001", item.ultimo_error)
+
+
+def _envejecer(cache, segundos):
+    """Corre hacia atrás la hora de guardado de todas las entradas del cache."""
+    for clave, (valor, guardado) in cache._entries.items():
+        cache._entries[clave] = (valor, guardado - segundos)
+
+
+class StockCacheTests(SimpleTestCase):
+    """Cache de stock SAP por proceso."""
+
+    def _esperar_refresh(self, cache):
+        limite = time.monotonic() + 5
+        while cache.stats()["refreshing"] and time.monotonic() < limite:
+            time.sleep(0.01)
+
+    def test_ttl_stale_y_refresh(self):
+        cache = StockCache(ttl=60, stale_ttl=300)
+        fetch = mock.Mock(side_effect=lambda codigos: {c: 1 for c in codigos})
+
+        self.assertEqual(cache.get_many("1000", "A1", ["1", "2"], fetch), {"1": 1, "2": 1})
+        self.assertEqual(cache.get_many("1000", "A1", ["1", "2"], fetch), {"1": 1, "2": 1})
+        fetch.assert_called_once_with(["1", "2"])
+
+        # Vencido el TTL se sirve el valor viejo y se refresca una vez en segundo plano
+        _envejecer(cache, 61)
+        fetch.side_effect = lambda codigos: {c: 2 for c in codigos}
+        self.assertEqual(cache.get_many("1000", "A1", ["1", "2"], fetch), {"1": 1, "2": 1})
+        self._esperar_refresh(cache)
+        self.assertEqual(cache.get_many("1000", "A1", ["1", "2"], fetch), {"1": 2, "2": 2})
+        self.assertEqual(fetch.call_count, 2)
+
+        # Fuera de la ventana stale se va a SAP en línea
+        _envejecer(cache, 400)
+        fetch.side_effect = lambda codigos: {c: 3 for c in codigos}
+        self.assertEqual(cache.get_many("1000", "A1", ["1"], fetch), {"1": 3})
+
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["stale_hits"], stats["misses"]), (4, 2, 3))
+        self.assertEqual((stats["refreshes"], stats["refresh_errors"]), (1, 0))
+
+    def test_refresh_fallido_conserva_el_valor(self):
+        cache = StockCache(ttl=60, stale_ttl=300)
+        cache.set_many("1000", "A1", {"1": 5})
+        _envejecer(cache, 61)
+
+        self.assertEqual(cache.get_many("1000", "A1", ["1"], lambda codigos: None), {"1": 5})
+        self._esperar_refresh(cache)
+        self.assertEqual(cache.stats()["refresh_errors"], 1)
+        self.assertEqual(cache.peek_many("1000", "A1", ["1"]), {"1": 5})
+
+    def test_tope_de_entradas_descarta_las_menos_usadas(self):
+        cache = StockCache(ttl=60, stale_ttl=300, max_entries=3)
+        cache.set_many("1000", "A1", {"1": 1, "2": 2, "3": 3})
+        cache.peek_many("1000", "A1", ["1"])
+        cache.set_many("1000", "A1", {"4": 4})
+
+        self.assertEqual(cache.peek_many("1000", "A1", ["1", "2", "3", "4"]), {"1": 1, "3": 3, "4": 4})
+        self.assertEqual(cache.stats()["entries"], 3)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_nada_mas_viejo_que_max_age(self):
+        cache = StockCache(ttl=60, stale_ttl=300, max_age=3600)
+        cache.set_many("1000", "A1", {"1": 5})
+        _envejecer(cache, 3601)
+
+        self.assertEqual(cache.peek_many("1000", "A1", ["1"]), {})
+        self.assertEqual(cache.stats()["entries"], 0)
+        self.assertIsNone(cache.get_many("1000", "A1", ["1"], lambda codigos: None))
+
+
+@override_settings(SAP_METRICS_ALLOWED_IPS=["127.0.0.1"])
+class MetricasSapTests(TestCase):
+    """/metrics: todas las series llevan TYPE y el pid del worker."""
+
+    def test_series_con_tipo_y_pid(self):
+        response = self.client.get(reverse("metricas_sap"))
+        self.assertEqual(response.status_code, 200)
+
+        lineas = response.content.decode().splitlines()
+        tipos = {linea.split()[2] for linea in lineas if linea.startswith("# TYPE")}
+        muestras = [linea for linea in lineas if linea and not linea.startswith("#")]
+        self.assertIn("sap_stock_cache_hits_total", tipos)
+        self.assertIn("sap_stock_singleflight_in_flight", tipos)
+        for muestra in muestras:
+            self.assertIn(f'pid="{os.getpid()}"', muestra)
+            nombre = muestra.split("{")[0]
+            self.assertTrue(nombre in tipos or nombre.rsplit("_", 1)[0] in tipos, nombre)
+
+    def test_circuito_abierto_no_suma_latencia(self):
+        metricas = SapMetrics()
+        metricas.observe("ZRFC", "qas", 0.8)
+        metricas.observe("ZRFC", "qas", None, error="circuit_open")
+
+        texto = metricas.render()
+        self.assertIn('sap_rfc_errors_total{rfc="ZRFC",env="QAS",error_class="circuit_open"', texto)
+        self.assertIn('result="error",pid="%d"} 1' % os.getpid(), texto)
+        self.assertIn(f'sap_rfc_network_seconds_count{{rfc="ZRFC",env="QAS",pid="{os.getpid()}"}} 1', texto)
+
+
+class StockSnapshotTests(TestCase):
+    """sincronizar_almacen deja el snapshot igual a lo que devolvió SAP."""
+
+    def _sincronizar(self, stock):
+        with mock.patch.object(stock_snapshot, "_consultar_stock_sap", return_value=stock):
+            return stock_snapshot.sincronizar_almacen("1000", "a1", ["1", "2", "3"])
+
+    def test_altas_cambios_y_bajas(self):
+        self._sincronizar({"1": 5, "2": 3, "3": 1})
+        res = self._sincronizar({"1": 5, "2": 4})
+
+        self.assertEqual(res, {"materiales": 2, "nuevas": 0, "cambiadas": 1, "borradas": 1})
+        self.assertEqual(
+            dict(stock_snapshot_modelo.objects.filter(centro="1000", almacen="A1").values_list("material", "stock")),
+            {"1": 5, "2": 4},
+        )
+        self.assertEqual(stock_snapshot.leer_snapshot(["1", "3"], "A1"), {"1": 5, "3": 0})
+
+    def test_sin_respuesta_de_sap_no_toca_el_snapshot(self):
+        self._sincronizar({"1": 5})
+        self.assertIsNone(self._sincronizar(None))
+        self.assertEqual(stock_snapshot_modelo.objects.get().stock, 5)
+
+    def test_sin_materiales_no_toca_el_snapshot(self):
+        self._sincronizar({"1": 5})
+        with mock.patch.object(stock_snapshot, "_consultar_stock_sap") as consultar:
+            self.assertIsNone(stock_snapshot.sincronizar_almacen("1000", "A1", []))
+        consultar.assert_not_called()
+        self.assertEqual(stock_snapshot_modelo.objects.get().stock, 5)
+        self.assertEqual(stock_snapshot_sync.objects.get().materiales, 1)
+
+
+class SingleFlightTests(SimpleTestCase):
+    """Las llamadas iguales en vuelo esperan a la primera y comparten su resultado."""
+
+    def _en_paralelo(self, sf, fn):
+        """Lanza dos llamadas con la misma clave; la segunda entra mientras la primera está en vuelo."""
+        liberar = threading.Event()
+        resultados = []
+
+        def llamar():
+            try:
+                resultados.append(sf.do("clave", lambda: liberar.wait(5) and fn()))
+            except Exception as e:
+                resultados.append(e)
+
+        hilos = [threading.Thread(target=llamar) for _ in range(2)]
+        hilos[0].start()
+        while sf.stats()["in_flight"] == 0:
+            time.sleep(0.001)
+        hilos[1].start()
+        while sf.stats()["saved"] == 0:
+            time.sleep(0.001)
+        liberar.set()
+        for hilo in hilos:
+            hilo.join(5)
+        return resultados
+
+    def test_coalescencia(self):
+        sf = SingleFlight()
+        fn = mock.Mock(return_value={"1": 5})
+
+        self.assertEqual(self._en_paralelo(sf, fn), [{"1": 5}, {"1": 5}])
+        fn.assert_called_once()
+        self.assertEqual(sf.stats(), {"calls": 2, "executions": 1, "saved": 1, "in_flight": 0})
+
+        # Terminada la llamada, la siguiente vuelve a ejecutar
+        sf.do("clave", fn)
+        self.assertEqual(fn.call_count, 2)
+
+    def test_error_se_propaga_a_todos(self):
+        sf = SingleFlight()
+        error = RuntimeError("SAP caído")
+
+        resultados = self._en_paralelo(sf, mock.Mock(side_effect=error))
+
+        self.assertEqual(resultados, [error, error])
+        self.assertEqual(sf.stats()["in_flight"], 0)
+
+
+class IterStockRowsTests(SimpleTestCase):
+    """Parser incremental de la respuesta de ZRFC_STOCK_SMARTSAFETY."""
+
+    RESPUESTA = (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<soap-env:Envelope xmlns:soap-env="http://schemas.xmlsoap.org/soap/envelope/"><soap-env:Body>'
+        '<n0:ZRFC_STOCK_SMARTSAFETYResponse xmlns:n0="urn:sap-com:document:sap:rfc:functions">'
+        "<T_STOCK>"
+        "<item><MATNR>000000000000100001</MATNR><LGORT>g001</LGORT><LABST>12.000</LABST></item>"
+        "<item><MATNR>000000000000100002</MATNR><LGORT>G002</LGORT><LABST>7.000</LABST></item>"
+        "<item><MATNR>000000000000100003</MATNR><LGORT>G001</LGORT><LABST>3.500</LABST></item>"
+        "</T_STOCK>"
+        "<STOCK>"
+        "<item>{&quot;MATNR&quot;:&quot;000000000000100004&quot;,&quot;LGORT&quot;:&quot;G001&quot;,&quot;LABST&quot;:&quot;4.000&quot;}</item>"
+        "<item>no es json G001</item>"
+        "</STOCK>"
+        "<E_RETURN><item><MATNR>100005</MATNR><LGORT>G001</LGORT><LABST>1</LABST></item></E_RETURN>"
+        "<T_OTRA><item><MATNR>100006</MATNR><LGORT>G001</LGORT><LABST>9</LABST></item></T_OTRA>"
+        "</n0:ZRFC_STOCK_SMARTSAFETYResponse></soap-env:Body></soap-env:Envelope>"
+    ).encode()
+
+    def _filas(self, almacen, materiales=None, trozo=7):
+        chunks = (self.RESPUESTA[i:i + trozo] for i in range(0, len(self.RESPUESTA), trozo))
+        return list(iter_stock_rows(chunks, almacen, materiales))
+
+    def test_filtra_por_almacen_y_lee_las_tres_tablas(self):
+        self.assertEqual(
+            self._filas(" g001 "),
+            [("100001", 12), ("100003", 3), ("100004", 4), ("100005", 1)],
+        )
+        self.assertEqual(self._filas("G002"), [("100002", 7)])
+
+    def test_filtra_por_materiales(self):
+        self.assertEqual(self._filas("G001", {"100003", "100004", "999"}), [("100003", 3), ("100004", 4)])
+        self.assertEqual(self._filas("G001", set()), [])
+
+    def test_columnas_con_namespace(self):
+        respuesta = (
+            '<r xmlns:c="urn:c"><T_STOCK>'
+            "<item><c:MATNR>0100007</c:MATNR><c:LGORT>G001</c:LGORT><c:LABST>2.000</c:LABST></item>"
+            "</T_STOCK></r>"
+        ).encode()
+        self.assertEqual(list(iter_stock_rows([respuesta], "G001")), [("100007", 2)])
+
+    def test_no_depende_del_tamano_de_los_trozos(self):
+        self.assertEqual(self._filas("G001", trozo=1), self._filas("G001", trozo=len(self.RESPUESTA)))
+
+
+@override_settings(SAP_CB_FALLOS=3, SAP_CB_LENTO_MS=1000, SAP_CB_COOLDOWN=30, SAP_TIMEOUT_MIN=2.0, SAP_TIMEOUT_FACTOR=3.0)
+class CircuitBreakerTests(SimpleTestCase):
+    """Estados del circuit breaker y timeout adaptativo."""
+
+    def _reabrir_ya(self, breaker):
+        breaker.abierto_desde -= breaker.cooldown
+
+    def test_closed_open_half_open(self):
+        breaker = CircuitBreaker("ZRFC@QAS", timeout_default=10.0)
+        for _ in range(2):
+            breaker.antes()
+            breaker.fallo(0.1)
+        self.assertEqual(breaker.estado, "closed")
+
+        breaker.exito(0.1)  # un éxito reinicia la cuenta de fallos seguidos
+        for _ in range(2):
+            breaker.fallo()
+        self.assertEqual(breaker.estado, "closed")
+        breaker.exito(1.5)  # más lento que SAP_CB_LENTO_MS cuenta como fallo
+        self.assertEqual(breaker.estado, "open")
+        with self.assertRaises(CircuitOpenError):
+            breaker.antes()
+
+        # Pasado el cooldown deja pasar una sola llamada de prueba
+        self._reabrir_ya(breaker)
+        breaker.antes()
+        self.assertEqual(breaker.estado, "half_open")
+        with self.assertRaises(CircuitOpenError):
+            breaker.antes()
+
+        # Si la prueba falla se vuelve a abrir; si sale bien se cierra
+        breaker.fallo(0.1)
+        self.assertEqual(breaker.estado, "open")
+        self._reabrir_ya(breaker)
+        breaker.antes()
+        breaker.exito(0.1)
+        self.assertEqual(breaker.estado, "closed")
+        breaker.antes()
+
+        stats = breaker.stats()
+        self.assertEqual((stats["aperturas"], stats["rechazadas"]), (2, 2))
+
+    def test_timeout_por_p95_acotado(self):
+        breaker = CircuitBreaker("ZRFC@QAS", timeout_default=10.0)
+        for _ in range(4):
+            breaker.exito(0.5)
+        self.assertEqual(breaker.timeout(), 10.0)  # con pocas muestras, el default
+
+        breaker.exito(0.9)
+        self.assertEqual(breaker.timeout(), 2.7)
+
+        for _ in range(50):
+            breaker.exito(0.1)
+        self.assertEqual(breaker.timeout(), 2.0)  # no baja de SAP_TIMEOUT_MIN
+
+        for _ in range(50):
+            breaker.fallo(5.0)
+        self.assertEqual(breaker.timeout(), 10.0)  # ni pasa del default
@@ -8,6 +8,14 @@ urlpatterns = [
     path("", views.home, name="index"),
     path("home", views.home, name="home"),
     path("registros", views.registros, name="registros"),
+    path("registros/exportar", views.exportar_registros_planilla, name="exportar_registros"),
+    path("registros/exportar_pdfs", views.exportar_pdfs, name="exportar_pdfs"),
+    path("reportes/consumo", views.reporte_consumo, name="reporte_consumo"),
+    path(
+        "registros/exportar_pdfs/<str:exportacion>",
+        views.estado_exportacion_pdfs,
+        name="estado_exportacion_pdfs",
+    ),
     path("nuevo_vsm", views.nuevo_vsm, name="nuevo_vsm"),
     path("editar_vsm/<int:id>", views.editar_vsm, name="editar_vsm"),
     path("vsm/<int:vsm_id>/eliminar/", views.eliminar_vsm, name="eliminar_vsm"),
@@ -60,6 +68,8 @@ urlpatterns = [
     path("get_tags/<int:empleado_id>", views.get_tags_por_empleado, name="get_tags"),
     path("test_sap_connection", views.test_sap_connection, name="test_sap_connection"),
     path("ajax/consultar_stock", views.consultar_stock, name="consultar_stock"),
+    path("ajax/stock_cache", views.estado_cache_stock, name="estado_cache_stock"),
+    path("metrics", views.metricas_sap, name="metricas_sap"),
     path('ajax/almacenes_por_empresa/', views.obtener_almacenes_por_empresa, name='obtener_almacenes_por_empresa'),
     path('vsm/aprobar/<int:vsm_id>/', views.aprobar_vsm, name='aprobar_vsm'),
 ]
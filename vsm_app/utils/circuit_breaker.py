@@ -0,0 +1,116 @@
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+
+class CircuitOpenError(Exception):
+    """El circuito del RFC está abierto: no se llama a SAP."""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker por RFC y entorno SAP.
+
+    - closed: las llamadas pasan. Tras `fallos_max` fallos seguidos se abre.
+      Una llamada más lenta que `lento_ms` cuenta como fallo.
+    - open: falla rápido (CircuitOpenError) durante `cooldown` segundos.
+    - half_open: deja pasar una llamada de prueba; si sale bien se cierra,
+      si falla se vuelve a abrir.
+
+    El timeout de cada llamada se adapta al p95 de las últimas latencias
+    (p95 * factor, acotado entre timeout_min y el timeout por defecto).
+    """
+
+    def __init__(self, nombre: str, timeout_default: float):
+        self.nombre = nombre
+        self.timeout_default = timeout_default
+        self.fallos_max = getattr(settings, "SAP_CB_FALLOS", 5)
+        self.lento_ms = getattr(settings, "SAP_CB_LENTO_MS", 10000)
+        self.cooldown = getattr(settings, "SAP_CB_COOLDOWN", 30)
+        self.timeout_min = getattr(settings, "SAP_TIMEOUT_MIN", 2.0)
+        self.timeout_factor = getattr(settings, "SAP_TIMEOUT_FACTOR", 3.0)
+        self.estado = "closed"
+        self.fallos = 0
+        self.abierto_desde = 0.0
+        self.prueba_en_curso = False
+        self.latencias = deque(maxlen=50)
+        self.aperturas = 0
+        self.rechazadas = 0
+        self._lock = threading.Lock()
+
+    def timeout(self) -> float:
+        with self._lock:
+            if len(self.latencias) < 5:
+                return self.timeout_default
+            ordenadas = sorted(self.latencias)
+            p95 = ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * 0.95))]
+        return max(self.timeout_min, min(self.timeout_default, p95 * self.timeout_factor))
+
+    def antes(self):
+        """Llamar antes de ir a SAP. Lanza CircuitOpenError si no corresponde llamar."""
+        with self._lock:
+            if self.estado == "closed":
+                return
+            if self.estado == "open" and time.monotonic() - self.abierto_desde >= self.cooldown:
+                self.estado = "half_open"
+                self.prueba_en_curso = False
+            if self.estado == "half_open" and not self.prueba_en_curso:
+                self.prueba_en_curso = True
+                return
+            self.rechazadas += 1
+        raise CircuitOpenError(f"Circuito SAP abierto para {self.nombre}")
+
+    def exito(self, segundos: float):
+        if segundos * 1000 > self.lento_ms:
+            self.fallo(segundos)
+            return
+        with self._lock:
+            self.latencias.append(segundos)
+            self.fallos = 0
+            self.estado = "closed"
+            self.prueba_en_curso = False
+
+    def fallo(self, segundos: float | None = None):
+        with self._lock:
+            if segundos is not None:
+                self.latencias.append(segundos)
+            self.fallos += 1
+            if self.estado == "half_open" or self.fallos >= self.fallos_max:
+                if self.estado != "open":
+                    self.aperturas += 1
+                self.estado = "open"
+                self.abierto_desde = time.monotonic()
+                self.prueba_en_curso = False
+
+    def stats(self) -> dict:
+        timeout = self.timeout()
+        with self._lock:
+            return {
+                "estado": self.estado,
+                "fallos_seguidos": self.fallos,
+                "aperturas": self.aperturas,
+                "rechazadas": self.rechazadas,
+                "timeout": round(timeout, 2),
+            }
+
+
+_breakers: dict[tuple[str, str], CircuitBreaker] = {}
+_lock = threading.Lock()
+
+
+def get_breaker(rfc_name: str, env: str, timeout_default: float = 30.0) -> CircuitBreaker:
+    clave = (rfc_name, env.upper())
+    with _lock:
+        breaker = _breakers.get(clave)
+        if breaker is None:
+            breaker = CircuitBreaker(f"{rfc_name}@{env.upper()}", timeout_default)
+            _breakers[clave] = breaker
+        return breaker
+
+
+def breakers_stats() -> dict:
+    with _lock:
+        breakers = list(_breakers.values())
+    return {b.nombre: b.stats() for b in breakers}
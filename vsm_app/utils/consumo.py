@@ -0,0 +1,126 @@
+"""
+Acumulados de consumo por mes (consumo_mensual_cc / _material / _almacen).
+
+Cuentan las líneas de los vales entregados y activos, por el mes de la
+entrega y separados por tipo de entrega (EPP / INSUMOS) y facturación.
+Se mantienen por diferencia en la misma transacción que cambia el vale:
+
+- confirmar_entrega: si el vale ya estaba entregado (se reconfirma) se
+  resta lo que aportaba y se suma lo nuevo.
+- eliminar_vsm: se resta lo que aportaba.
+
+Cada tabla se toca con un solo INSERT ... ON CONFLICT DO UPDATE (las
+restas son aportes negativos) y las filas que quedan sin vales se
+borran. Si algo se desfasa (datos cargados a mano, vales editados
+después de entregados), reconstruir_consumo las arma de cero desde
+VSMProducto.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import connection
+from django.db.models import Count, DateField, DecimalField, F, Sum, Value
+from django.db.models.functions import Coalesce, TruncMonth
+from django.utils import timezone
+
+from vsm_app.models import VSMProducto, consumo_mensual_almacen, consumo_mensual_cc, consumo_mensual_material
+
+# (modelo, campo de la dimensión en el acumulado, de dónde sale en VSMProducto)
+TABLAS = (
+    (consumo_mensual_cc, "cc", "vsm__centro_costos"),
+    (consumo_mensual_material, "producto", "producto"),
+    (consumo_mensual_almacen, "almacen", "vsm__almacen"),
+)
+
+
+def cuenta(vsm) -> bool:
+    """Si el vale suma en los acumulados."""
+    return vsm.estado == "entregado" and vsm.active
+
+
+def _mes(vsm):
+    fecha = vsm.fecha_entrega or vsm.fecha_solicitud
+    return timezone.localtime(fecha).date().replace(day=1)
+
+
+def _claves(vsm, linea):
+    return {"cc": vsm.centro_costos_id, "producto": linea.producto_id, "almacen": vsm.almacen_id}
+
+
+def _aportes(vsm, lineas, campo):
+    """{valor de la dimensión: [cantidad, líneas, vales]} del vale."""
+    aportes = defaultdict(lambda: [Decimal(0), 0, 1])
+    for linea in lineas:
+        aporte = aportes[_claves(vsm, linea)[campo]]
+        aporte[0] += Decimal(str(linea.cantidad_entregada or 0))
+        aporte[1] += 1
+    return aportes
+
+
+def _columnas(modelo, campo):
+    return modelo._meta.db_table, modelo._meta.get_field(campo).column
+
+
+def _aplicar(vsm, lineas, signo):
+    lineas = list(lineas)
+    if not lineas:
+        return
+    base = (_mes(vsm), vsm.tipo_entrega or "", vsm.tipo_facturacion or "")
+    with connection.cursor() as cursor:
+        for modelo, campo, _ in TABLAS:
+            tabla, columna = _columnas(modelo, campo)
+            aportes = _aportes(vsm, lineas, campo)
+            valores = ", ".join(["(%s, %s, %s, %s, %s, %s, %s)"] * len(aportes))
+            params = [
+                p
+                for clave, (cantidad, n_lineas, vales) in aportes.items()
+                for p in (*base, clave, signo * cantidad, signo * n_lineas, signo * vales)
+            ]
+            cursor.execute(
+                f"""
+                INSERT INTO {tabla} (mes, tipo_entrega, tipo_facturacion, {columna}, cantidad, lineas, vales)
+                VALUES {valores}
+                ON CONFLICT (mes, {columna}, tipo_entrega, tipo_facturacion) DO UPDATE SET
+                    cantidad = {tabla}.cantidad + EXCLUDED.cantidad,
+                    lineas = {tabla}.lineas + EXCLUDED.lineas,
+                    vales = {tabla}.vales + EXCLUDED.vales
+                RETURNING id, vales
+                """,
+                params,
+            )
+            # Lo que quedó sin vales (o una resta sin fila previa) se borra
+            vacias = [id_ for id_, vales in cursor.fetchall() if vales <= 0]
+            if vacias:
+                cursor.execute(f"DELETE FROM {tabla} WHERE id = ANY(%s)", [vacias])
+
+
+def sumar(vsm, lineas):
+    """Suma a los acumulados las `lineas` (VSMProducto) del vale entregado `vsm`."""
+    _aplicar(vsm, lineas, 1)
+
+
+def restar(vsm, lineas):
+    """Resta lo que aportaban las `lineas` de `vsm` (tal como estaban guardadas)."""
+    _aplicar(vsm, lineas, -1)
+
+
+def agregados(origen):
+    """
+    Filas de un acumulado calculadas desde VSMProducto (para reconstruir);
+    `origen` es la dimensión vista desde la línea (ver TABLAS).
+    """
+    return (
+        VSMProducto.objects.filter(vsm__estado="entregado", vsm__active=True)
+        .values(
+            mes=TruncMonth(Coalesce("vsm__fecha_entrega", "vsm__fecha_solicitud"), output_field=DateField()),
+            tipo_entrega=Coalesce("vsm__tipo_entrega", Value("")),
+            tipo_facturacion=Coalesce("vsm__tipo_facturacion", Value("")),
+            clave=F(origen),
+        )
+        .annotate(
+            cantidad=Sum(Coalesce("cantidad_entregada", Value(Decimal(0))), output_field=DecimalField()),
+            lineas=Count("id"),
+            vales=Count("vsm_id", distinct=True),
+        )
+        .order_by()
+    )
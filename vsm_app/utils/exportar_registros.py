@@ -0,0 +1,119 @@
+"""
+Exportación de registros a CSV / XLSX: una fila por línea de vale.
+
+Las filas salen de un values_list recorrido con .iterator(chunk_size=...)
+(cursor del lado del servidor en Postgres, dentro de una transacción de
+lectura), así que del lado de Django hay a lo sumo VSM_EXPORTAR_FILAS_CHUNK
+tuplas a la vez, sin instancias de modelo.
+
+- CSV: se escribe fila por fila y se manda de a FILAS_POR_TROZO filas; la
+  memoria no depende del total.
+- XLSX: openpyxl en modo write-only va bajando las filas a un archivo
+  temporal; al final arma el .xlsx en otro temporal y se manda en trozos.
+  La memoria queda plana, pero el primer byte sale recién cuando están
+  todas las filas. Cada hoja llega hasta el máximo de filas de Excel y
+  sigue en la siguiente.
+"""
+import csv
+import io
+import tempfile
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+
+from vsm_app.models import VSMProducto
+
+COLUMNAS = (
+    ("VSM", "vsm_id"),
+    ("Fecha solicitud", "vsm__fecha_solicitud"),
+    ("Fecha entrega", "vsm__fecha_entrega"),
+    ("Estado", "vsm__estado"),
+    ("Tipo entrega", "vsm__tipo_entrega"),
+    ("Solicitante", "vsm__solicitante__username"),
+    ("Legajo retirante", "vsm__retirante__legajo"),
+    ("Retirante", "vsm__retirante__nombre"),
+    ("CC", "vsm__centro_costos__codigo"),
+    ("Almacén", "vsm__almacen__almacen"),
+    ("Código material", "producto__codigo"),
+    ("Material", "producto__descripcion"),
+    ("Cantidad solicitada", "cantidad_solicitada"),
+    ("Cantidad entregada", "cantidad_entregada"),
+    ("Documento SAP", "vsm__numero_sap"),
+    ("Año documento", "vsm__anio_documento"),
+)
+_FECHAS = [i for i, (_, campo) in enumerate(COLUMNAS) if "fecha" in campo]
+
+FILAS_POR_TROZO = 1000
+TROZO_XLSX = 64 * 1024
+MAX_FILAS_HOJA = 1_048_576  # límite de Excel, con el encabezado
+
+
+def filas(vales):
+    """Tuplas (en el orden de COLUMNAS) de las líneas de los vales del queryset `vales`."""
+    lineas = (
+        VSMProducto.objects.filter(vsm__in=vales.values("id"))
+        .order_by("-vsm__fecha_solicitud", "-vsm_id", "id")
+        .values_list(*(campo for _, campo in COLUMNAS))
+    )
+    chunk = getattr(settings, "VSM_EXPORTAR_FILAS_CHUNK", 2000)
+    # Dentro de una transacción el cursor no necesita WITH HOLD; en
+    # autocommit Postgres materializa el resultado entero antes de dar la
+    # primera fila.
+    with transaction.atomic():
+        for fila in lineas.iterator(chunk_size=chunk):
+            fila = list(fila)
+            for i in _FECHAS:
+                if fila[i] is not None:
+                    # Excel no acepta fechas con zona horaria: van en hora local
+                    fila[i] = timezone.localtime(fila[i]).replace(tzinfo=None)
+            yield fila
+
+
+def csv_en_trozos(filas):
+    salida = io.StringIO()
+    escritor = csv.writer(salida)
+    # BOM: para que Excel lo abra como UTF-8
+    salida.write("\ufeff")
+    escritor.writerow(nombre for nombre, _ in COLUMNAS)
+    for n, fila in enumerate(filas, start=1):
+        escritor.writerow(fila)
+        if n % FILAS_POR_TROZO == 0:
+            yield salida.getvalue().encode()
+            salida.seek(0)
+            salida.truncate()
+    yield salida.getvalue().encode()
+
+
+def _hoja(libro, numero):
+    hoja = libro.create_sheet(f"Registros {numero}" if numero > 1 else "Registros")
+    encabezado = []
+    for nombre, _ in COLUMNAS:
+        celda = WriteOnlyCell(hoja, nombre)
+        celda.font = Font(bold=True)
+        encabezado.append(celda)
+    hoja.append(encabezado)
+    return hoja
+
+
+def xlsx_en_trozos(filas):
+    libro = Workbook(write_only=True)
+    numero = 1
+    hoja = _hoja(libro, numero)
+    en_hoja = 1
+    for fila in filas:
+        if en_hoja == MAX_FILAS_HOJA:
+            numero += 1
+            hoja = _hoja(libro, numero)
+            en_hoja = 1
+        hoja.append(fila)
+        en_hoja += 1
+
+    with tempfile.TemporaryFile() as archivo:
+        libro.save(archivo)
+        archivo.seek(0)
+        while trozo := archivo.read(TROZO_XLSX):
+            yield trozo
@@ -0,0 +1,156 @@
+"""
+Firma del retirante en las entregas de EPP.
+
+La firma llega del canvas como data URL (data:image/png;base64,...) y es
+la misma para todas las líneas del vale. Se guarda por contenido: el
+nombre es el sha256 de los bytes, repartido en subcarpetas
+(firmas/ab/cd/abcd….png) para no juntar miles de archivos en una. Guardar
+una firma que ya está no escribe nada, y todas las líneas (y reintentos)
+apuntan al mismo archivo.
+
+Antes de guardarla se compacta: el canvas manda un PNG RGBA de 800x480
+casi todo transparente; queda recortada al trazo, en escala de grises y
+recomprimida. Al lado se guarda una versión chica de 1 bit
+(<sha256>_pdf.png) que es la que se incrusta en los PDF.
+"""
+import base64
+import binascii
+import hashlib
+import io
+import re
+
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+CARPETA = "firmas"
+SUFIJO_PDF = "_pdf.png"
+UMBRAL_TRAZO = 24  # diferencia mínima con el blanco para contar como trazo
+MARGEN = 8  # px alrededor del trazo
+TAMANO_PDF = (320, 160)  # se muestra a ~80 px de alto: 2x para impresión
+_POR_CONTENIDO = re.compile(rf"^{CARPETA}/[0-9a-f]{{2}}/[0-9a-f]{{2}}/[0-9a-f]{{64}}\.png$")
+
+
+def decodificar_firma(firma_base64: str) -> bytes | None:
+    """Bytes de la imagen de un data URL (o base64 pelado); None si no es válido."""
+    if not firma_base64:
+        return None
+    _, _, imgstr = firma_base64.rpartition(";base64,")
+    try:
+        return base64.b64decode(imgstr, validate=True) or None
+    except (binascii.Error, ValueError):
+        return None
+
+
+def _png(img) -> bytes:
+    salida = io.BytesIO()
+    img.save(salida, "PNG", optimize=True)
+    return salida.getvalue()
+
+
+def _en_grises(img):
+    if img.mode == "L":
+        return img
+    # Lo transparente del canvas pasa a blanco
+    img = img.convert("RGBA")
+    fondo = Image.new("RGBA", img.size, (255, 255, 255, 255))
+    fondo.alpha_composite(img)
+    return fondo.convert("L")
+
+
+def compactar_firma(contenido: bytes) -> bytes | None:
+    """PNG en grises recortado al trazo (con MARGEN); None si no es una imagen."""
+    try:
+        img = Image.open(io.BytesIO(contenido))
+        img.load()
+    except (UnidentifiedImageError, OSError):
+        return None
+    img = _en_grises(img)
+    caja = ImageOps.invert(img).point(lambda p: 255 if p > UMBRAL_TRAZO else 0).getbbox()
+    if caja:
+        izq, arriba, der, abajo = caja
+        img = img.crop(
+            (
+                max(izq - MARGEN, 0),
+                max(arriba - MARGEN, 0),
+                min(der + MARGEN, img.width),
+                min(abajo + MARGEN, img.height),
+            )
+        )
+    return _png(img)
+
+
+def derivar_para_pdf(contenido: bytes) -> bytes:
+    """Versión de 1 bit, como mucho TAMANO_PDF, de una firma ya compactada."""
+    img = _en_grises(Image.open(io.BytesIO(contenido)))
+    img.thumbnail(TAMANO_PDF)
+    return _png(img.convert("1", dither=Image.Dither.NONE))
+
+
+def nombre_derivado(nombre: str) -> str:
+    return nombre.removesuffix(".png") + SUFIJO_PDF
+
+
+def nombre_por_contenido(contenido: bytes) -> str:
+    digest = hashlib.sha256(contenido).hexdigest()
+    return f"{CARPETA}/{digest[:2]}/{digest[2:4]}/{digest}.png"
+
+
+def es_por_contenido(nombre: str) -> bool:
+    return bool(_POR_CONTENIDO.match(nombre or ""))
+
+
+def _storage():
+    from vsm_app.models import VSMProducto
+
+    return VSMProducto._meta.get_field("firma_retirante").storage
+
+
+def _guardar(storage, nombre: str, contenido: bytes):
+    if not storage.exists(nombre):
+        guardado = storage.save(nombre, ContentFile(contenido))
+        if guardado != nombre:
+            # Otro request la guardó entre el exists y el save: queda la suya
+            storage.delete(guardado)
+
+
+def guardar_contenido(contenido: bytes) -> str:
+    """
+    Guarda una firma ya compactada bajo su hash, con su derivada para PDF
+    (si no estaban), y devuelve el nombre.
+    """
+    storage = _storage()
+    nombre = nombre_por_contenido(contenido)
+    derivado = nombre_derivado(nombre)
+    if not storage.exists(derivado):
+        _guardar(storage, derivado, derivar_para_pdf(contenido))
+    _guardar(storage, nombre, contenido)
+    return nombre
+
+
+def guardar_firma(firma_base64: str) -> str | None:
+    """Compacta y guarda la firma (data URL); devuelve el nombre para firma_retirante."""
+    contenido = decodificar_firma(firma_base64)
+    if contenido is None:
+        return None
+    compactada = compactar_firma(contenido)
+    if compactada is None:
+        return None
+    return guardar_contenido(compactada)
+
+
+def reapuntar_firma(nombre: str, nuevo: str) -> int:
+    """
+    Pasa las líneas que usan la firma `nombre` a `nuevo` y marca sus vales
+    como actualizados (el ETag del PDF sale de VSM.actualizado). Devuelve
+    cuántas líneas cambiaron.
+    """
+    from vsm_app.models import VSM, VSMProducto
+
+    with transaction.atomic():
+        lineas = VSMProducto.objects.filter(firma_retirante=nombre)
+        vales = list(lineas.values_list("vsm_id", flat=True).distinct())
+        cambiadas = lineas.update(firma_retirante=nuevo)
+        VSM.objects.filter(id__in=vales).update(actualizado=timezone.now())
+    return cambiadas
@@ -0,0 +1,19 @@
+"""
+Páginas para los endpoints JSON que alimentan los select2 (retirantes,
+almacenes). select2 pide `?page=N` (desde 1) y espera
+`{"results": [...], "pagination": {"more": bool}}`; se trae una fila de
+más para saber si hay otra página sin hacer COUNT.
+"""
+from django.conf import settings
+
+
+def pagina_json(queryset, request, por_pagina=None):
+    """Filas de la página `page` de `queryset` (ya ordenado) y si hay más."""
+    por_pagina = por_pagina or getattr(settings, "VSM_JSON_POR_PAGINA", 30)
+    try:
+        pagina = max(int(request.GET.get("page", 1)), 1)
+    except ValueError:
+        pagina = 1
+    inicio = (pagina - 1) * por_pagina
+    filas = list(queryset[inicio : inicio + por_pagina + 1])
+    return filas[:por_pagina], len(filas) > por_pagina
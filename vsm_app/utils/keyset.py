@@ -0,0 +1,121 @@
+"""
+Paginación keyset (seek) para los listados de vales.
+
+En vez de OFFSET se pagina por (fecha_solicitud, id) descendente: la página
+siguiente son los vales "anteriores" al último mostrado. El costo no depende
+de qué tan profunda sea la página. Los cursores van en la URL (?despues= /
+?antes=) y el total se calcula aparte, cacheado por combinación de filtros
+(y estimado por el planner cuando es muy grande).
+"""
+import base64
+import hashlib
+import json
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Q
+
+PARAM_DESPUES = "despues"
+PARAM_ANTES = "antes"
+
+
+def _codificar(vsm) -> str:
+    valor = f"{vsm.fecha_solicitud.isoformat()}|{vsm.id}"
+    return base64.urlsafe_b64encode(valor.encode()).decode().rstrip("=")
+
+
+def _decodificar(cursor: str):
+    try:
+        relleno = "=" * (-len(cursor) % 4)
+        fecha, id_ = base64.urlsafe_b64decode(cursor + relleno).decode().split("|")
+        return datetime.fromisoformat(fecha), int(id_)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+class KeysetPage:
+    def __init__(self, object_list, querystring, hay_anterior, hay_siguiente, total, total_aproximado):
+        self.object_list = object_list
+        self.has_previous = hay_anterior and bool(object_list)
+        self.has_next = hay_siguiente and bool(object_list)
+        self.total = total
+        self.total_aproximado = total_aproximado
+        base = f"?{querystring}&" if querystring else "?"
+        self.previous_url = f"{base}{PARAM_ANTES}={_codificar(object_list[0])}" if self.has_previous else None
+        self.next_url = f"{base}{PARAM_DESPUES}={_codificar(object_list[-1])}" if self.has_next else None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+
+def contar_cacheado(queryset, clave: str):
+    """
+    Total del listado para una combinación de filtros, cacheado
+    VSM_LISTADO_COUNT_TTL segundos. Si el planner estima más de
+    VSM_LISTADO_COUNT_EXACTO_MAX filas no se hace el COUNT(*): se usa la
+    estimación (total_aproximado=True).
+    """
+    clave = "vsm_listado_total:" + hashlib.sha1(clave.encode()).hexdigest()
+    resultado = cache.get(clave)
+    if resultado is None:
+        queryset = queryset.order_by()
+        estimado = None
+        if connection.vendor == "postgresql":
+            plan = json.loads(queryset.explain(format="json"))
+            estimado = int(plan[0]["Plan"]["Plan Rows"])
+        if estimado is not None and estimado > getattr(settings, "VSM_LISTADO_COUNT_EXACTO_MAX", 10000):
+            resultado = (estimado, True)
+        else:
+            resultado = (queryset.count(), False)
+        cache.set(clave, resultado, getattr(settings, "VSM_LISTADO_COUNT_TTL", 120))
+    return resultado
+
+
+def paginar_keyset(queryset, request, por_pagina: int, nombre: str) -> KeysetPage:
+    """
+    Página de `queryset` ordenada por (-fecha_solicitud, -id) según los
+    cursores de request.GET. Los demás parámetros (filtros) se conservan en
+    los links de anterior/siguiente y, junto con `nombre` (el listado),
+    forman la clave del total cacheado.
+    """
+    params = request.GET.copy()
+    despues = _decodificar(params.pop(PARAM_DESPUES, [""])[-1])
+    antes = _decodificar(params.pop(PARAM_ANTES, [""])[-1])
+    params.pop("page", None)
+    querystring = params.urlencode()
+
+    filtros = sorted((k, v) for k, valores in params.lists() for v in valores if v)
+    total, total_aproximado = contar_cacheado(queryset, f"{nombre}:{filtros}")
+
+    if antes:
+        # Página anterior: los más nuevos que el primero mostrado, en orden
+        # ascendente, y después se invierten. fecha__gte va como condición
+        # de índice; el OR resuelve el empate por id.
+        fecha, id_ = antes
+        filas = list(
+            queryset.filter(Q(fecha_solicitud__gt=fecha) | Q(fecha_solicitud=fecha, id__gt=id_), fecha_solicitud__gte=fecha)
+            .order_by("fecha_solicitud", "id")[: por_pagina + 1]
+        )
+        if filas:
+            hay_anterior = len(filas) > por_pagina
+            filas = filas[:por_pagina][::-1]
+            return KeysetPage(filas, querystring, hay_anterior, True, total, total_aproximado)
+        # Cursor más allá del primero (p. ej. se borraron vales): primera página
+
+    if despues:
+        fecha, id_ = despues
+        queryset = queryset.filter(
+            Q(fecha_solicitud__lt=fecha) | Q(fecha_solicitud=fecha, id__lt=id_), fecha_solicitud__lte=fecha
+        )
+
+    filas = list(queryset.order_by("-fecha_solicitud", "-id")[: por_pagina + 1])
+    hay_siguiente = len(filas) > por_pagina
+    return KeysetPage(filas[:por_pagina], querystring, bool(despues), hay_siguiente, total, total_aproximado)
@@ -0,0 +1,78 @@
+"""
+Búsqueda de materiales para el autocomplete (código o descripción).
+
+En Postgres usa los índices GIN de pg_trgm de maestro_de_materiales
+(migración 0034): el filtro es `UPPER(f_unaccent(descripcion)) LIKE ...`
+por palabra, que es exactamente la expresión indexada, y el orden es por
+similitud de trigramas. f_unaccent es un wrapper IMMUTABLE de unaccent (la
+función original no se puede usar en un índice).
+
+En otros motores (sqlite de desarrollo) cae a icontains sin ranking.
+"""
+import unicodedata
+
+from django.contrib.postgres.search import TrigramSimilarity, TrigramWordSimilarity
+from django.db import connection
+from django.db.models import CharField, FloatField, Q, Transform, Value
+from django.db.models.functions import Greatest
+
+CANDIDATOS = 500
+
+
+class FUnaccent(Transform):
+    """`campo__f_unaccent`: f_unaccent(campo), sin tildes."""
+
+    lookup_name = "f_unaccent"
+    function = "f_unaccent"
+    output_field = CharField()
+
+
+CharField.register_lookup(FUnaccent)
+
+
+def sin_tildes(texto: str) -> str:
+    """Mismo criterio que unaccent para los caracteres del español."""
+    descompuesto = unicodedata.normalize("NFKD", texto)
+    return "".join(c for c in descompuesto if not unicodedata.combining(c))
+
+
+def buscar_materiales(productos, query: str, limite: int = 20):
+    """
+    Filtra `productos` (un queryset de maestro_de_materiales, ya restringido
+    por PermisoRetiro si corresponde) por código o descripción y devuelve los
+    primeros `limite`, los más parecidos primero.
+    """
+    query = (query or "").strip()
+    if not query:
+        return productos[:limite]
+
+    termino = sin_tildes(query)
+
+    # Cada palabra tiene que aparecer (en cualquier orden): "botin segur"
+    # encuentra "BOTÍN DE SEGURIDAD". El código se busca con el texto entero.
+    if connection.vendor != "postgresql":
+        por_palabra = Q()
+        for palabra in query.split():
+            por_palabra &= Q(descripcion__icontains=palabra)
+        return productos.filter(por_palabra | Q(codigo__icontains=query))[:limite]
+
+    por_palabra = Q()
+    for palabra in termino.split():
+        por_palabra &= Q(descripcion__f_unaccent__icontains=palabra)
+
+    # word_similarity cuesta más que el filtro: con un término muy común
+    # (miles de coincidencias) se rankean sólo los primeros CANDIDATOS que
+    # devuelve el índice. Con menos coincidencias el orden es exacto.
+    candidatos = productos.filter(por_palabra | Q(codigo__icontains=termino)).values("id")[:CANDIDATOS]
+
+    return (
+        productos.model.objects.filter(id__in=candidatos)
+        .annotate(
+            similitud=Greatest(
+                TrigramWordSimilarity(Value(termino), FUnaccent("descripcion")),
+                TrigramSimilarity("codigo", Value(termino)),
+                output_field=FloatField(),
+            )
+        )
+        .order_by("-similitud", "descripcion")[:limite]
+    )
@@ -0,0 +1,351 @@
+"""
+Render directo a PDF (ReportLab) de los vales, sin pasar por HTML.
+
+Dibuja sobre un canvas los mismos bloques que vsm_pdf.html y epp_pdf.html
+(encabezado, tabla de líneas con la firma, pie) en vez de armar el HTML y
+que xhtml2pdf lo parsee con su CSS en cada request. Las tablas son de
+platypus dibujadas con drawOn, así que el texto largo se parte en líneas
+y, si un vale no entra en una hoja, la tabla de líneas sigue en la
+siguiente repitiendo el encabezado.
+
+generar_pdf lo usa con motor=canvas (o VSM_PDF_MOTOR = "canvas").
+"""
+import io
+from functools import lru_cache
+
+from django.contrib.staticfiles import finders
+from django.utils import timezone
+from reportlab.graphics import renderPDF
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+from reportlab.platypus import Flowable, Paragraph, Table, TableStyle
+from svglib.svglib import svg2rlg
+
+MARGEN = 28
+ANCHO_PAGINA, ALTO_PAGINA = A4
+ANCHO_UTIL = ANCHO_PAGINA - 2 * MARGEN
+
+_CELDA = ParagraphStyle("celda", fontName="Helvetica", fontSize=8, leading=10, alignment=1)
+_CELDA_IZQ = ParagraphStyle("celda_izq", parent=_CELDA, alignment=0)
+_ENCABEZADO = ParagraphStyle("encabezado", parent=_CELDA, fontName="Helvetica-Bold")
+_LEGAL = ParagraphStyle("legal", parent=_CELDA, alignment=4, fontSize=7.5, leading=9.5)
+
+_GRILLA = [
+    ("GRID", (0, 0), (-1, -1), 1, colors.black),
+    ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+    ("ALIGN", (0, 0), (-1, -1), "CENTER"),
+]
+
+
+@lru_cache(maxsize=1)
+def _logo():
+    """Logo de static/images/logo.svg como dibujo de ReportLab (se parsea una vez)."""
+    ruta = finders.find("images/logo.svg")
+    return svg2rlg(ruta) if ruta else None
+
+
+def _texto(valor) -> str:
+    return "" if valor is None else str(valor)
+
+
+def _escapar(valor) -> str:
+    return _texto(valor).replace("&", "&amp;").replace("<", "&lt;")
+
+
+def _p(texto, estilo=_CELDA) -> Paragraph:
+    return Paragraph(_escapar(texto), estilo)
+
+
+def _fecha(valor, formato) -> str:
+    return timezone.localtime(valor).strftime(formato) if valor else ""
+
+
+class _Firma(Flowable):
+    def __init__(self, imagen, ancho, alto):
+        super().__init__()
+        self.imagen, self.width, self.height = imagen, ancho, alto
+
+    def draw(self):
+        self.canv.drawImage(self.imagen, 0, 0, self.width, self.height)
+
+
+class _Hoja:
+    """Canvas con un cursor vertical; pasa de hoja cuando lo que sigue no entra."""
+
+    def __init__(self, destino):
+        self.canvas = canvas.Canvas(destino, pagesize=A4)
+        self.y = ALTO_PAGINA - MARGEN
+        self._firmas = {}
+
+    def nueva_hoja(self):
+        self.canvas.showPage()
+        self.y = ALTO_PAGINA - MARGEN
+
+    def espacio(self, alto):
+        self.y -= alto
+
+    def dibujar(self, flowable, x=MARGEN, ancho=ANCHO_UTIL):
+        _, alto = flowable.wrapOn(self.canvas, ancho, self.y - MARGEN)
+        if alto > self.y - MARGEN and self.y < ALTO_PAGINA - MARGEN:
+            self.nueva_hoja()
+            _, alto = flowable.wrapOn(self.canvas, ancho, self.y - MARGEN)
+        flowable.drawOn(self.canvas, x, self.y - alto)
+        self.y -= alto
+
+    def dibujar_tabla(self, tabla):
+        """Como dibujar, pero si la tabla no entra la parte y sigue en otra hoja."""
+        while tabla is not None:
+            _, alto = tabla.wrapOn(self.canvas, ANCHO_UTIL, self.y - MARGEN)
+            if alto <= self.y - MARGEN:
+                tabla.drawOn(self.canvas, MARGEN, self.y - alto)
+                self.y -= alto
+                return
+            partes = tabla.split(ANCHO_UTIL, self.y - MARGEN)
+            if len(partes) < 2:
+                self.nueva_hoja()
+                continue
+            primera, tabla = partes[0], partes[1]
+            _, alto = primera.wrapOn(self.canvas, ANCHO_UTIL, self.y - MARGEN)
+            primera.drawOn(self.canvas, MARGEN, self.y - alto)
+            self.nueva_hoja()
+
+    def firma(self, linea, ancho, alto):
+        """La firma de la línea (derivada para PDF) escalada a ancho x alto."""
+        nombre = linea.firma_pdf if linea.firma_retirante else ""
+        if not nombre:
+            return ""
+        if nombre not in self._firmas:
+            # Un solo ImageReader por firma: ReportLab decodifica y embebe la imagen una vez
+            try:
+                with linea.firma_retirante.storage.open(nombre, "rb") as f:
+                    self._firmas[nombre] = ImageReader(io.BytesIO(f.read()))
+            except OSError:
+                self._firmas[nombre] = None
+        imagen = self._firmas[nombre]
+        if imagen is None:
+            return ""
+        ancho_img, alto_img = imagen.getSize()
+        escala = min(ancho / ancho_img, alto / alto_img)
+        return _Firma(imagen, ancho_img * escala, alto_img * escala)
+
+    def logo(self, x, y, ancho, alto):
+        """Logo con la esquina superior izquierda en (x, y), dentro de ancho x alto."""
+        dibujo = _logo()
+        if dibujo is None:
+            return
+        escala = min(ancho / dibujo.width, alto / dibujo.height)
+        self.canvas.saveState()
+        self.canvas.translate(x, y - dibujo.height * escala)
+        self.canvas.scale(escala, escala)
+        renderPDF.draw(dibujo, self.canvas, 0, 0)
+        self.canvas.restoreState()
+
+    def cerrar(self):
+        self.canvas.save()
+
+
+def render_vsm(vsm, lineas) -> bytes:
+    """Layout de vsm_pdf.html."""
+    salida = io.BytesIO()
+    hoja = _Hoja(salida)
+    c = hoja.canvas
+    c.setTitle(f"VSM {vsm.id}")
+
+    c.setFont("Helvetica-Bold", 15)
+    c.drawString(MARGEN + 8, hoja.y - 30, "VALE DE SALIDA DE MATERIALES (VSM)")
+    hoja.logo(ANCHO_PAGINA - MARGEN - 110, hoja.y, 100, 44)
+    hoja.espacio(56)
+
+    retirante = vsm.retirante
+    encabezado = Table(
+        [
+            [_p(t, _ENCABEZADO) for t in ("Cod. CBTE.", "N. CBTE.", "TIPO FACT.", "FECHA CBTE", "N° DOCUMENTO SAP", "CC")],
+            [
+                "201",
+                _p(f"N° {vsm.id}"),
+                _p(vsm.tipo_facturacion),
+                _p(_fecha(vsm.fecha_solicitud, "%d/%m/%Y")),
+                _p(vsm.numero_sap),
+                _p(retirante.cc.codigo if retirante and retirante.cc else ""),
+            ],
+        ],
+        colWidths=[ANCHO_UTIL / 6] * 6,
+        rowHeights=[None, 40],
+    )
+    encabezado.setStyle(TableStyle(_GRILLA + [("FONT", (0, 1), (0, 1), "Helvetica-Bold", 20)]))
+    hoja.dibujar(encabezado)
+    hoja.espacio(12)
+
+    anchos = [p * ANCHO_UTIL for p in (0.08, 0.34, 0.15, 0.08, 0.35)]
+    filas = [
+        [
+            _p(t, _ENCABEZADO)
+            for t in ("CANT. SOLICITADA", "DESCRIPCION", "CODIGO ARTICULO", "CANT. ENTREGADA", "RECIBI CONFORME")
+        ]
+    ]
+    for linea in lineas:
+        filas.append(
+            [
+                _p(linea.cantidad_solicitada),
+                _p(linea.producto.descripcion),
+                _p(linea.producto.codigo),
+                _p(linea.cantidad_entregada),
+                hoja.firma(linea, anchos[4] - 12, 40),
+            ]
+        )
+    tabla = Table(filas, colWidths=anchos, repeatRows=1)
+    tabla.setStyle(TableStyle(_GRILLA + [("TOPPADDING", (0, 1), (-1, -1), 10), ("BOTTOMPADDING", (0, 1), (-1, -1), 10)]))
+    hoja.dibujar_tabla(tabla)
+    hoja.espacio(10)
+
+    pie = Table(
+        [
+            [_p(t, _ENCABEZADO) for t in ("SOLICITA", "AUTORIZA", "CONTROL", "DESPACHO", "OBSERVACIONES")],
+            [_p(retirante.nombre if retirante else ""), _p(vsm.solicitante), "", "", _p(vsm.observaciones)],
+        ],
+        colWidths=[p * ANCHO_UTIL for p in (0.15, 0.15, 0.15, 0.15, 0.40)],
+        rowHeights=[None, 36],
+    )
+    pie.setStyle(TableStyle(_GRILLA))
+    hoja.dibujar(pie)
+
+    hoja.cerrar()
+    return salida.getvalue()
+
+
+DISPOSICIONES = (
+    "De la Ley 19587 de Higiene y Seguridad en el Trabajo Art. 10: El trabajador estará obligado a:<br/>"
+    "Cumplir con las normas de Higiene y Seguridad y con las recomendaciones que se le formulen referentes a "
+    "las obligaciones de uso, conservación y cuidado del equipo de protección personal y de las propias "
+    "maquinarias y procesos de trabajo. Dec. 351/79 Cap. 19 Art. 188 al 203<br/>"
+    "<b>Disposiciones de la empresa:</b><br/>"
+    "El elemento de protección personal que se le entregara será de “uso obligatorio”, siendo responsabilidad "
+    "del trabajador mantenerlo en buen estado. Todo defecto rotura o deterioro del mismo deberá ser comunicado "
+    "de inmediato, para proceder a su reemplazo.<br/>"
+    "Corresponderá apercibimiento en caso de encontrarse al operario trabajando sin sus elementos de "
+    "protección personal."
+)
+ELEMENTOS = (
+    "ELEMENTOS DE PROTECCIÓN NECESARIOS PARA EL TRABAJADOR, SEGÚN EL PUESTO:<br/>"
+    "SUPERINTENDENCIA DE RIESGOS DE TRABAJO. RESOLUCIÓN 299/2011. ADÓPTENSE LAS REGLAMENTACIONES QUE "
+    "PROCUREN LA PROVISIÓN DE ELEMENTOS DE PROTECCIÓN PERSONAL"
+)
+
+
+def _dato(etiqueta, valor) -> Paragraph:
+    return Paragraph(f"<b>{etiqueta}:</b> {_escapar(valor)}", _CELDA_IZQ)
+
+
+def _recuadro(html) -> Table:
+    """Párrafo legal con borde a los costados, como los <p> de epp_pdf.html."""
+    tabla = Table([[Paragraph(html, _LEGAL)]], colWidths=[ANCHO_UTIL])
+    tabla.setStyle(TableStyle([("LINEBEFORE", (0, 0), (0, 0), 1, colors.black), ("LINEAFTER", (0, 0), (0, 0), 1, colors.black)]))
+    return tabla
+
+
+def render_epp(vsm, lineas) -> bytes:
+    """Layout de epp_pdf.html (constancia de entrega de EPP)."""
+    salida = io.BytesIO()
+    hoja = _Hoja(salida)
+    hoja.canvas.setTitle(f"Constancia de entrega {vsm.id}")
+    entregado = vsm.estado == "entregado"
+    retirante = vsm.retirante
+
+    titulo = Table(
+        [["", _p("CONSTANCIA DE ENTREGA DE ROPA DE TRABAJO Y ELEMENTOS DE PROTECCIÓN PERSONAL", _ENCABEZADO)]],
+        colWidths=[ANCHO_UTIL * 0.3, ANCHO_UTIL * 0.7],
+        rowHeights=[50],
+    )
+    titulo.setStyle(TableStyle(_GRILLA))
+    y_titulo = hoja.y
+    hoja.dibujar(titulo)
+    hoja.logo(MARGEN + 10, y_titulo - 6, ANCHO_UTIL * 0.3 - 20, 38)
+
+    datos = Table(
+        [
+            [
+                _dato("RAZÓN SOCIAL", getattr(retirante, "razon_social", "")),
+                _dato("CUIT", getattr(retirante, "cuil", "")),
+                _dato("DIRECCIÓN", "Av. De los CONSTITUYENTES 2499"),
+                _dato("LOCALIDAD", "PACHECO"),
+            ],
+            [
+                _dato("CP", "1617"),
+                _dato(
+                    "NOMBRE Y APELLIDO DEL TRABAJADOR",
+                    f"{getattr(retirante, 'nombre', '')} {getattr(retirante, 'apellido', '')}".strip(),
+                ),
+                "",
+                _dato("DNI", getattr(retirante, "dni", "")),
+            ],
+            [
+                _dato("LEGAJO", getattr(retirante, "legajo", "")),
+                _dato("PERFIL DE RIESGO (DESCRIPCIÓN)", getattr(retirante, "perfil_riesgo", "")),
+                "",
+                "",
+            ],
+        ],
+        colWidths=[ANCHO_UTIL / 4] * 4,
+    )
+    datos.setStyle(TableStyle(_GRILLA + [("SPAN", (1, 1), (2, 1)), ("SPAN", (1, 2), (3, 2))]))
+    hoja.dibujar(datos)
+    hoja.dibujar(_recuadro(ELEMENTOS))
+
+    anchos = [p * ANCHO_UTIL for p in (0.17, 0.17, 0.09, 0.11, 0.09, 0.11, 0.14, 0.12)]
+    filas = [
+        [
+            _p(t, _ENCABEZADO)
+            for t in (
+                "PRODUCTO",
+                "TIPO/MODELO",
+                "MARCA",
+                "POSEE CERTIFICACIÓN SI/NO",
+                "CANTIDAD",
+                "FECHA DE ENTREGA",
+                "FIRMA DEL TRABAJADOR",
+                "OBSERVACIONES",
+            )
+        ]
+    ]
+    fecha_entrega = _fecha(vsm.fecha_entrega, "%d-%m-%Y")
+    for linea in lineas:
+        filas.append(
+            [
+                _p(linea.producto.descripcion),
+                _p(linea.producto.descripcion),
+                _p(getattr(linea, "marca", "")),
+                "SI",
+                _p(linea.cantidad_entregada),
+                _p(fecha_entrega),
+                hoja.firma(linea, 40, 40) if entregado else "",
+                "",
+            ]
+        )
+    filas.append([""] * 8)
+    tabla = Table(filas, colWidths=anchos, repeatRows=1)
+    tabla.setStyle(
+        TableStyle(
+            _GRILLA
+            + [
+                ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#f2f2f2")),
+                ("FONT", (0, 1), (-1, -1), "Helvetica", 8),
+                ("SPAN", (0, -1), (-1, -1)),
+            ]
+        )
+    )
+    hoja.dibujar_tabla(tabla)
+    hoja.dibujar(_recuadro(DISPOSICIONES))
+
+    primera = lineas[0] if lineas else None
+    notificado = [_p("FUI NOTIFICADO", _ENCABEZADO)]
+    if entregado and primera is not None:
+        notificado.append(hoja.firma(primera, 40, 40))
+    pie = Table([["", notificado]], colWidths=[ANCHO_UTIL * 0.8, ANCHO_UTIL * 0.2], rowHeights=[70])
+    pie.setStyle(TableStyle(_GRILLA))
+    hoja.dibujar(pie)
+
+    hoja.cerrar()
+    return salida.getvalue()
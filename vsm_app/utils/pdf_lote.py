@@ -0,0 +1,198 @@
+"""
+Exportación en lote de los PDF de vales: un ZIP que se va mandando
+mientras se arma.
+
+Los PDF se dibujan con pdf_canvas en un pool de procesos (VSM_PDF_PROCESOS,
+por defecto uno por core) y cada uno entra al ZIP apenas termina, en el
+orden en que terminan. El ZipFile escribe sobre un buffer sin seek que se
+vacía en cada yield (zipfile usa entonces data descriptors y el directorio
+central va al final), así que el archivo nunca está entero en memoria. Al
+pool se mandan como mucho EN_VUELO_POR_PROCESO vales por proceso y los
+vales se leen de la base con un cursor del lado del servidor, de a
+VSM_EXPORTAR_CHUNK.
+
+El pool arranca sus procesos con spawn, no con fork: el worker de gunicorn
+corre con gevent (hub, conexiones abiertas) y no se puede clonar. Se crea
+una vez por worker, en la primera exportación. Con VSM_PDF_PROCESOS=0 los
+PDF se dibujan en el mismo proceso.
+
+El avance y la cancelación van en la tabla exportacion_pdf (por usuario y
+exportación), no en el cache, que es por proceso: la consulta del avance o
+el pedido de corte pueden caer en otro worker que el que arma el ZIP. Si
+el cliente corta la descarga, los trabajos que no empezaron se cancelan.
+"""
+import itertools
+import multiprocessing
+import os
+import threading
+import zipfile
+from datetime import timedelta
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.conf import settings
+from django.db.models import Prefetch
+from django.utils import timezone
+
+from vsm_app.utils import pdf_canvas
+
+EN_VUELO_POR_PROCESO = 2
+VIDA_AVANCE = timedelta(days=1)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _iniciar_proceso():
+    django.setup()
+
+
+def _render(formato, vsm, lineas) -> bytes:
+    render = pdf_canvas.render_epp if formato == "epp" else pdf_canvas.render_vsm
+    return render(vsm, lineas)
+
+
+def _procesos() -> int:
+    return getattr(settings, "VSM_PDF_PROCESOS", os.cpu_count() or 1)
+
+
+def _obtener_pool(procesos):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=procesos,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_iniciar_proceso,
+            )
+        return _pool
+
+
+def _descartar_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _vales_con_lineas(vales):
+    """(formato, vsm, líneas) de cada vale, leyendo de a VSM_EXPORTAR_CHUNK."""
+    from vsm_app.models import VSMProducto
+
+    vales = vales.select_related("retirante__cc", "solicitante").prefetch_related(
+        Prefetch("vsmproducto_set", queryset=VSMProducto.objects.select_related("producto").order_by("id"))
+    )
+    for vsm in vales.iterator(chunk_size=getattr(settings, "VSM_EXPORTAR_CHUNK", 100)):
+        lineas = list(vsm.vsmproducto_set.all())
+        # Las líneas ya viajan como argumento: que no vayan dos veces al pool
+        del vsm._prefetched_objects_cache
+        yield ("epp" if vsm.tipo_entrega == "EPP" else "vsm"), vsm, lineas
+
+
+def _renderizar(vales):
+    """(vsm_id, pdf) de cada vale, a medida que terminan."""
+    procesos = _procesos()
+    if not procesos:
+        for formato, vsm, lineas in vales:
+            yield vsm.id, _render(formato, vsm, lineas)
+        return
+
+    pool = _obtener_pool(procesos)
+    pendientes = {}
+    try:
+        while True:
+            for formato, vsm, lineas in itertools.islice(vales, procesos * EN_VUELO_POR_PROCESO - len(pendientes)):
+                pendientes[pool.submit(_render, formato, vsm, lineas)] = vsm.id
+            if not pendientes:
+                return
+            listos, _ = wait(pendientes, return_when=FIRST_COMPLETED)
+            for futuro in listos:
+                yield pendientes.pop(futuro), futuro.result()
+    except BrokenProcessPool:
+        # Murió un proceso (OOM, kill): la próxima exportación arma otro pool
+        _descartar_pool()
+        raise
+    finally:
+        # Corte del cliente o cancelación: lo que no empezó no se dibuja
+        for futuro in pendientes:
+            futuro.cancel()
+
+
+class _Salida:
+    """Destino del ZipFile, sin seek: junta lo escrito hasta el próximo yield."""
+
+    def __init__(self):
+        self._partes = []
+
+    def write(self, datos):
+        self._partes.append(bytes(datos))
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def vaciar(self) -> bytes:
+        datos = b"".join(self._partes)
+        self._partes.clear()
+        return datos
+
+
+def zip_de_vales(vales, avance=None):
+    """
+    Bytes del ZIP con el PDF (VSM_<id>.pdf) de cada vale del queryset
+    `vales`, en trozos, para un StreamingHttpResponse. Después de cada PDF
+    llama a `avance(hechos)`; si devuelve False se corta ahí y el ZIP se
+    cierra con lo que ya tenía.
+    """
+    salida = _Salida()
+    renders = _renderizar(_vales_con_lineas(vales))
+    try:
+        with zipfile.ZipFile(salida, "w", zipfile.ZIP_DEFLATED) as archivo:
+            for hechos, (vsm_id, pdf) in enumerate(renders, start=1):
+                archivo.writestr(f"VSM_{vsm_id}.pdf", pdf)
+                seguir = avance(hechos) if avance else True
+                yield salida.vaciar()
+                if seguir is False:
+                    break
+    finally:
+        renders.close()
+    yield salida.vaciar()
+
+
+def iniciar_avance(usuario_id, exportacion: str, total: int):
+    """Registra la exportación y devuelve el callback `avance` para zip_de_vales."""
+    from vsm_app.models import exportacion_pdf
+
+    exportacion_pdf.objects.filter(usuario_id=usuario_id, actualizado__lt=timezone.now() - VIDA_AVANCE).delete()
+    registro, _ = exportacion_pdf.objects.update_or_create(
+        usuario_id=usuario_id,
+        exportacion=exportacion,
+        defaults={"total": total, "hechos": 0, "cancelada": False},
+    )
+    pendientes = exportacion_pdf.objects.filter(id=registro.id)
+
+    def avance(hechos):
+        pendientes.update(hechos=hechos, actualizado=timezone.now())
+        return not pendientes.filter(cancelada=True).exists()
+
+    return avance
+
+
+def estado_avance(usuario_id, exportacion: str) -> dict | None:
+    from vsm_app.models import exportacion_pdf
+
+    return (
+        exportacion_pdf.objects.filter(usuario_id=usuario_id, exportacion=exportacion)
+        .values("total", "hechos", "cancelada")
+        .first()
+    )
+
+
+def cancelar(usuario_id, exportacion: str):
+    from vsm_app.models import exportacion_pdf
+
+    exportacion_pdf.objects.filter(usuario_id=usuario_id, exportacion=exportacion).update(
+        cancelada=True, actualizado=timezone.now()
+    )
@@ -0,0 +1,54 @@
+"""
+Set de permisos (nombres de `permisos`) del usuario, cargado una vez.
+
+- Por request: queda memorizado en el objeto user (request.user es uno
+  por request), así el decorador y todos los `has_perm` del template
+  comparten una sola carga.
+- Entre requests: se guarda en la sesión junto con `permisos_version`.
+  El usuario se lee de la DB en cada request igual, así que comparar la
+  versión no cuesta queries; cuando los permisos cambian
+  (_sync_permissions, admin) se incrementa la versión y el set se recarga.
+"""
+from django.db.models import F
+
+SESSION_KEY = "_permisos_vsm"
+_ATRIBUTO = "_permisos_vsm"
+
+
+def permisos_usuario(user, session=None) -> frozenset:
+    if not user.is_authenticated:
+        return frozenset()
+
+    nombres = getattr(user, _ATRIBUTO, None)
+    if nombres is not None:
+        return nombres
+
+    guardado = session.get(SESSION_KEY) if session is not None else None
+    if guardado and guardado.get("version") == user.permisos_version:
+        nombres = frozenset(guardado["nombres"])
+    else:
+        nombres = frozenset(user.permisos.values_list("nombre", flat=True))
+        if session is not None:
+            session[SESSION_KEY] = {"version": user.permisos_version, "nombres": sorted(nombres)}
+
+    setattr(user, _ATRIBUTO, nombres)
+    return nombres
+
+
+def invalidar_permisos(user):
+    """Marca los permisos cacheados del usuario como viejos (en todas sus sesiones)."""
+    type(user).objects.filter(pk=user.pk).update(permisos_version=F("permisos_version") + 1)
+    user.permisos_version += 1
+    user.__dict__.pop(_ATRIBUTO, None)
+
+
+def invalidar_por_m2m(sender, instance, action, reverse, model, pk_set, **kwargs):
+    """m2m_changed de Usuarios.permisos (cambios desde el admin o el shell)."""
+    if reverse:
+        # Desde el lado del permiso: instance es el permiso, pk_set los usuarios
+        if action == "pre_clear":
+            instance.usuarios.update(permisos_version=F("permisos_version") + 1)
+        elif action in ("post_add", "post_remove") and pk_set:
+            model.objects.filter(pk__in=pk_set).update(permisos_version=F("permisos_version") + 1)
+    elif action in ("post_add", "post_remove", "post_clear"):
+        invalidar_permisos(instance)
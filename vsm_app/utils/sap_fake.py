@@ -0,0 +1,201 @@
+"""
+SAP SOAP RFC simulado para pruebas de carga sin red (manage.py sap_fake_server).
+
+Implementa ZRFC_STOCK_SMARTSAFETY y ZRFC_INOUT_SMARTSAFETY con latencia,
+tasa de error y tamaño de tabla configurables. También puede grabar
+respuestas reales (modo proxy contra QAS) y reproducirlas después.
+"""
+import hashlib
+import itertools
+import json
+import random
+import threading
+import time
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+import httpx
+
+NS_SOAP = "http://schemas.xmlsoap.org/soap/envelope/"
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+@dataclass
+class FakeSapConfig:
+    latencia_ms: float = 200
+    jitter_ms: float = 50
+    error_rate: float = 0.0
+    stock_items: int = 1000
+    almacenes: tuple = ("G001", "G002", "1100")
+    record_dir: Path | None = None
+    replay_dir: Path | None = None
+    upstream: str | None = None
+    upstream_auth: tuple | None = None
+    _doc_seq: itertools.count = field(default_factory=lambda: itertools.count(4900000001))
+    _doc_lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def siguiente_doc(self) -> int:
+        with self._doc_lock:
+            return next(self._doc_seq)
+
+
+def _clave_grabacion(rfc_name: str, body: bytes) -> str:
+    """Clave estable por RFC + contenido del request (ignora espacios entre tags)."""
+    normalizado = b"><".join(parte.strip() for parte in body.split(b"><"))
+    return f"{rfc_name}_{hashlib.sha1(normalizado).hexdigest()[:16]}"
+
+
+def _parse_request(body: bytes) -> tuple[str, ET.Element]:
+    root = ET.fromstring(body)
+    soap_body = next(e for e in root.iter() if _local(e.tag) == "Body")
+    rfc = next(iter(soap_body))
+    return _local(rfc.tag), rfc
+
+
+def _envelope(rfc_name: str, contenido: str) -> bytes:
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        f'<soap-env:Envelope xmlns:soap-env="{NS_SOAP}">'
+        "<soap-env:Body>"
+        f'<n0:{rfc_name}Response xmlns:n0="urn:sap-com:document:sap:rfc:functions">'
+        f"{contenido}"
+        f"</n0:{rfc_name}Response>"
+        "</soap-env:Body>"
+        "</soap-env:Envelope>"
+    ).encode("utf-8")
+
+
+def _fault(mensaje: str) -> bytes:
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        f'<soap-env:Envelope xmlns:soap-env="{NS_SOAP}"><soap-env:Body>'
+        f"<soap-env:Fault><faultcode>soap-env:Server</faultcode><faultstring>{escape(mensaje)}</faultstring></soap-env:Fault>"
+        "</soap-env:Body></soap-env:Envelope>"
+    ).encode("utf-8")
+
+
+def respuesta_stock(rfc: ET.Element, config: FakeSapConfig) -> bytes:
+    """T_STOCK de los materiales pedidos (o `stock_items` filas si no se pidió ninguno)."""
+    campos = {_local(e.tag): e for e in rfc}
+    werks = (campos["I_WERKS"].text or "1000") if "I_WERKS" in campos else "1000"
+    lgort = (campos["I_LGORT"].text or "G001") if "I_LGORT" in campos else "G001"
+
+    materiales = []
+    if "T_MATNR" in campos:
+        for item in campos["T_MATNR"]:
+            matnr = item.findtext("MATNR") or item.text or ""
+            if matnr.strip():
+                materiales.append(matnr.strip())
+    if not materiales:
+        materiales = [str(100000 + i) for i in range(config.stock_items)]
+
+    filas = []
+    for matnr in materiales:
+        # Stock determinístico por material/almacén para que las corridas sean comparables.
+        rnd = random.Random(f"{werks}/{matnr}")
+        for almacen in (lgort, config.almacenes[rnd.randrange(len(config.almacenes))]):
+            labst = rnd.randint(0, 500)
+            filas.append(
+                f"<item><MATNR>{escape(matnr.zfill(18))}</MATNR><WERKS>{escape(werks)}</WERKS>"
+                f"<LGORT>{escape(almacen)}</LGORT><LABST>{labst}.000</LABST></item>"
+            )
+    return _envelope("ZRFC_STOCK_SMARTSAFETY", f"<T_STOCK>{''.join(filas)}</T_STOCK>")
+
+
+def respuesta_inout(rfc: ET.Element, config: FakeSapConfig) -> bytes:
+    anio = time.strftime("%Y")
+    doc = config.siguiente_doc()
+    return _envelope(
+        "ZRFC_INOUT_SMARTSAFETY",
+        f"<E_RETURN><MAT_DOC>{doc}</MAT_DOC><DOC_YEAR>{anio}</DOC_YEAR>"
+        f"<MESSAGE>Documento {doc} contabilizado</MESSAGE></E_RETURN>",
+    )
+
+
+RFC_SIMULADOS = {
+    "ZRFC_STOCK_SMARTSAFETY": respuesta_stock,
+    "ZRFC_INOUT_SMARTSAFETY": respuesta_inout,
+}
+
+
+def make_handler(config: FakeSapConfig):
+    class FakeSapHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            try:
+                rfc_name, rfc = _parse_request(body)
+            except (ET.ParseError, StopIteration):
+                self._responder(400, _fault("Request SOAP inválido"))
+                return
+
+            clave = _clave_grabacion(rfc_name, body)
+
+            if config.upstream:
+                self._proxy(body, clave)
+                return
+
+            demora = max(0.0, random.gauss(config.latencia_ms, config.jitter_ms)) / 1000
+            time.sleep(demora)
+
+            if random.random() < config.error_rate:
+                self._responder(500, _fault("Error simulado"))
+                return
+
+            if config.replay_dir:
+                grabado = config.replay_dir / f"{clave}.xml"
+                if grabado.exists():
+                    meta = json.loads((config.replay_dir / f"{clave}.json").read_text())
+                    self._responder(meta.get("status", 200), grabado.read_bytes())
+                    return
+
+            generador = RFC_SIMULADOS.get(rfc_name)
+            if generador is None:
+                self._responder(500, _fault(f"RFC {rfc_name} no simulado"))
+                return
+            self._responder(200, generador(rfc, config))
+
+        def _proxy(self, body: bytes, clave: str):
+            response = httpx.post(
+                config.upstream,
+                content=body,
+                headers={"Content-Type": "text/xml; charset=utf-8"},
+                auth=config.upstream_auth,
+                verify=False,
+                timeout=60,
+            )
+            if config.record_dir:
+                config.record_dir.mkdir(parents=True, exist_ok=True)
+                (config.record_dir / f"{clave}.xml").write_bytes(response.content)
+                (config.record_dir / f"{clave}.json").write_text(
+                    json.dumps({"status": response.status_code, "request": body.decode("utf-8", "replace")})
+                )
+            self._responder(response.status_code, response.content)
+
+        def _responder(self, status: int, contenido: bytes):
+            self.send_response(status)
+            self.send_header("Content-Type", "text/xml; charset=utf-8")
+            self.send_header("Content-Length", str(len(contenido)))
+            self.end_headers()
+            self.wfile.write(contenido)
+
+        def log_message(self, format, *args):
+            pass
+
+    return FakeSapHandler
+
+
+def run_fake_sap(host: str, port: int, config: FakeSapConfig):
+    server = ThreadingHTTPServer((host, port), make_handler(config))
+    server.daemon_threads = True
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
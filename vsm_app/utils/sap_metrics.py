@@ -0,0 +1,139 @@
+import bisect
+import os
+import threading
+import xml.etree.ElementTree as ET
+
+import httpx
+
+from vsm_app.utils.circuit_breaker import CircuitOpenError
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BUCKETS_BYTES = (512, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+class _Histograma:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.cuentas = [0] * (len(buckets) + 1)
+        self.suma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        self.cuentas[bisect.bisect_left(self.buckets, valor)] += 1
+        self.suma += valor
+        self.total += 1
+
+
+class SapMetrics:
+    """
+    Métricas de llamadas SAP por (RFC, entorno), en memoria del proceso.
+
+    Separa tiempo de red (hasta tener los bytes) de tiempo de parseo, y
+    registra tamaños de request/response y errores por clase. Cada worker de
+    gunicorn tiene las suyas: render() las etiqueta con el pid.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._red = {}
+        self._parseo = {}
+        self._bytes_request = {}
+        self._bytes_response = {}
+        self._llamadas = {}
+        self._errores = {}
+
+    def observe(self, rfc: str, env: str, red_s: float | None, parseo_s: float = 0.0,
+                request_bytes: int = 0, response_bytes: int = 0, error: str | None = None):
+        """red_s=None: la llamada no llegó a la red (circuito abierto), sólo cuenta en los contadores."""
+        clave = (rfc, env.upper())
+        with self._lock:
+            if red_s is not None:
+                self._histo(self._red, clave, BUCKETS_SEGUNDOS).observar(red_s)
+                self._histo(self._bytes_request, clave, BUCKETS_BYTES).observar(request_bytes)
+            if error is None:
+                self._histo(self._parseo, clave, BUCKETS_SEGUNDOS).observar(parseo_s)
+                self._histo(self._bytes_response, clave, BUCKETS_BYTES).observar(response_bytes)
+            resultado = "ok" if error is None else "error"
+            self._llamadas[clave + (resultado,)] = self._llamadas.get(clave + (resultado,), 0) + 1
+            if error is not None:
+                self._errores[clave + (error,)] = self._errores.get(clave + (error,), 0) + 1
+
+    @staticmethod
+    def _histo(tabla, clave, buckets):
+        histo = tabla.get(clave)
+        if histo is None:
+            histo = tabla[clave] = _Histograma(buckets)
+        return histo
+
+    def render(self) -> str:
+        """Formato de texto de Prometheus (text/plain; version=0.0.4)."""
+        pid = os.getpid()
+        lineas = []
+        with self._lock:
+            lineas += [
+                "# HELP sap_rfc_calls_total Llamadas RFC a SAP por resultado.",
+                "# TYPE sap_rfc_calls_total counter",
+            ]
+            for (rfc, env, resultado), n in sorted(self._llamadas.items()):
+                lineas.append(f'sap_rfc_calls_total{{rfc="{rfc}",env="{env}",result="{resultado}",pid="{pid}"}} {n}')
+
+            lineas += [
+                "# HELP sap_rfc_errors_total Errores de llamadas RFC por clase.",
+                "# TYPE sap_rfc_errors_total counter",
+            ]
+            for (rfc, env, clase), n in sorted(self._errores.items()):
+                lineas.append(f'sap_rfc_errors_total{{rfc="{rfc}",env="{env}",error_class="{clase}",pid="{pid}"}} {n}')
+
+            for nombre, tabla, ayuda in (
+                ("sap_rfc_network_seconds", self._red, "Tiempo de red (request + recepción de la respuesta)."),
+                ("sap_rfc_parse_seconds", self._parseo, "Tiempo de parseo de la respuesta SOAP."),
+                ("sap_rfc_request_bytes", self._bytes_request, "Tamaño del request SOAP."),
+                ("sap_rfc_response_bytes", self._bytes_response, "Tamaño de la respuesta SOAP."),
+            ):
+                lineas += [f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} histogram"]
+                for (rfc, env), histo in sorted(tabla.items()):
+                    etiquetas = f'rfc="{rfc}",env="{env}",pid="{pid}"'
+                    acumulado = 0
+                    for limite, cuenta in zip(histo.buckets, histo.cuentas):
+                        acumulado += cuenta
+                        lineas.append(f'{nombre}_bucket{{{etiquetas},le="{limite}"}} {acumulado}')
+                    lineas.append(f'{nombre}_bucket{{{etiquetas},le="+Inf"}} {histo.total}')
+                    lineas.append(f"{nombre}_sum{{{etiquetas}}} {histo.suma}")
+                    lineas.append(f"{nombre}_count{{{etiquetas}}} {histo.total}")
+        return "\n".join(lineas) + "\n"
+
+    @staticmethod
+    def render_series(series) -> str:
+        """
+        Series sueltas del proceso (cache, single-flight, circuitos) con el
+        mismo pid que render(). `series` es [(nombre, tipo, ayuda, muestras)]
+        con muestras [(etiquetas, valor)].
+        """
+        pid = os.getpid()
+        lineas = []
+        for nombre, tipo, ayuda, muestras in series:
+            lineas += [f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} {tipo}"]
+            for etiquetas, valor in muestras:
+                etiquetas = "".join(f'{k}="{v}",' for k, v in etiquetas.items())
+                lineas.append(f'{nombre}{{{etiquetas}pid="{pid}"}} {valor}')
+        return "\n".join(lineas) + "\n"
+
+
+def clase_error(exc: BaseException) -> str:
+    """Clase de error estable para etiquetar métricas."""
+    if isinstance(exc, CircuitOpenError):
+        return "circuit_open"
+    if isinstance(exc, httpx.TimeoutException):
+        return "timeout"
+    if isinstance(exc, httpx.ConnectError):
+        return "connect"
+    if isinstance(exc, httpx.HTTPStatusError):
+        return f"http_{exc.response.status_code}"
+    if isinstance(exc, httpx.HTTPError):
+        return "http"
+    if isinstance(exc, (ET.ParseError, ValueError)) or type(exc).__name__ == "XMLSyntaxError":
+        return "parse"
+    return type(exc).__name__
+
+
+sap_metrics = SapMetrics()
@@ -0,0 +1,139 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from vsm_app.models import VSM, outbox_entrega_sap
+from vsm_app.utils import consumo
+from vsm_app.utils.sap_rfc import eliminar_entrega_de_sap, enviar_entrega_a_sap
+
+
+def encolar_entrega(vsm) -> outbox_entrega_sap:
+    """
+    Encola el posteo de la entrega en SAP. Llamar dentro de la misma
+    transacción que guarda la entrega: si la entrega no se commitea, no se encola.
+    Si ya hay un envío en curso para el VSM se reutiliza.
+    """
+    existente = outbox_entrega_sap.objects.filter(
+        vsm=vsm, estado__in=["pendiente", "procesando"]
+    ).first()
+    if existente:
+        return existente
+    return outbox_entrega_sap.objects.create(vsm=vsm)
+
+
+def _backoff(intentos: int) -> timedelta:
+    base = getattr(settings, "SAP_OUTBOX_BACKOFF_BASE", 30)
+    maximo = getattr(settings, "SAP_OUTBOX_BACKOFF_MAX", 3600)
+    return timedelta(seconds=min(base * (2 ** (intentos - 1)), maximo))
+
+
+def reclamar_pendientes(limite: int = 10) -> list[int]:
+    """
+    Toma hasta `limite` items vencidos y los marca como 'procesando'.
+    SKIP LOCKED permite correr varios workers sin que se pisen. El item queda
+    "alquilado" hasta proximo_intento: si el worker muere, otro lo retoma.
+    """
+    ahora = timezone.now()
+    lease = timedelta(seconds=getattr(settings, "SAP_OUTBOX_LEASE", 300))
+
+    with transaction.atomic():
+        ids = list(
+            outbox_entrega_sap.objects.select_for_update(skip_locked=True)
+            .filter(estado__in=["pendiente", "procesando"], proximo_intento__lte=ahora)
+            .order_by("proximo_intento")
+            .values_list("id", flat=True)[:limite]
+        )
+        outbox_entrega_sap.objects.filter(id__in=ids).update(
+            estado="procesando", proximo_intento=ahora + lease, actualizado=ahora
+        )
+    return ids
+
+
+def procesar_item(item_id: int) -> bool:
+    """Postea un item de la cola en SAP y vuelca el resultado en el VSM."""
+    item = outbox_entrega_sap.objects.select_related(
+        "vsm__retirante", "vsm__centro_costos", "vsm__almacen"
+    ).get(id=item_id)
+    vsm = item.vsm
+
+    if not vsm.active:
+        item.estado = "error"
+        item.ultimo_error = "VSM eliminado antes de enviarse a SAP"
+        item.save()
+        return False
+
+    try:
+        resultado = enviar_entrega_a_sap(vsm)
+    except Exception as e:
+        resultado = {"success": False, "error": str(e), "reintentable": True}
+
+    item.intentos += 1
+
+    if resultado.get("success"):
+        with transaction.atomic():
+            # eliminar_vsm no borra con el envío en curso, pero si el vale se
+            # desactivó igual (lease vencido) no se le escribe el documento
+            vsm = VSM.objects.select_for_update().get(id=vsm.id)
+            vsm.numero_sap = resultado.get("mat_doc")
+            vsm.anio_documento = resultado.get("doc_year")
+            if vsm.active:
+                vsm.estado = "entregado"
+                vsm.estado_sap = "procesado"
+                vsm.save(update_fields=["numero_sap", "anio_documento", "estado", "estado_sap", "actualizado"])
+                item.estado = "procesado"
+                item.ultimo_error = None
+                item.save()
+        if vsm.active:
+            print(f"✅ Entrega del VSM {vsm.id} enviada a SAP correctamente. Documento SAP: {vsm.numero_sap}")
+            return True
+        return _revertir_entrega_de_vale_eliminado(item, vsm)
+
+    item.ultimo_error = resultado.get("error")
+    max_intentos = getattr(settings, "SAP_OUTBOX_MAX_INTENTOS", 8)
+
+    if resultado.get("reintentable", True) and item.intentos < max_intentos:
+        item.estado = "pendiente"
+        item.proximo_intento = timezone.now() + _backoff(item.intentos)
+        item.save()
+        print(f"⚠️ VSM {vsm.id}: fallo al enviar a SAP (intento {item.intentos}), se reintenta: {item.ultimo_error}")
+        return False
+
+    # Sin más reintentos: el vale vuelve a pendiente para poder entregarlo de nuevo,
+    # y deja de sumar en los acumulados de consumo hasta que se reconfirme.
+    with transaction.atomic():
+        vsm = VSM.objects.select_for_update().get(id=vsm.id)
+        if consumo.cuenta(vsm):
+            consumo.restar(vsm, vsm.vsmproducto_set.only("producto_id", "cantidad_entregada"))
+        vsm.estado = "pendiente"
+        vsm.estado_sap = "error"
+        vsm.save(update_fields=["estado", "estado_sap", "actualizado"])
+        item.estado = "error"
+        item.save()
+    print(f"❌ VSM {vsm.id}: SAP rechazó la entrega: {item.ultimo_error}")
+    return False
+
+
+def _revertir_entrega_de_vale_eliminado(item, vsm) -> bool:
+    """El vale se eliminó mientras se posteaba: se anula en SAP el documento recién creado."""
+    reversa = eliminar_entrega_de_sap(vsm)
+    item.estado = "error"
+    if reversa.get("success"):
+        item.ultimo_error = f"VSM eliminado durante el envío; documento SAP {vsm.numero_sap} revertido"
+    else:
+        item.ultimo_error = (
+            f"VSM eliminado durante el envío; no se pudo revertir el documento SAP "
+            f"{vsm.numero_sap}/{vsm.anio_documento}: {reversa.get('error')}"
+        )
+    item.save()
+    print(f"❌ VSM {vsm.id}: {item.ultimo_error}")
+    return False
+
+
+def procesar_pendientes(limite: int = 10) -> int:
+    """Procesa un lote de la cola. Devuelve cuántos items se tomaron."""
+    ids = reclamar_pendientes(limite)
+    for item_id in ids:
+        procesar_item(item_id)
+    return len(ids)
@@ -1,38 +1,221 @@
 import os
 import re
+import time
 import html
 import json
-import requests
+import httpx
 import xml.etree.ElementTree as ET
+from contextlib import contextmanager
 from test_saponoso import Saponoso
 from vsm_app.models import VSMProducto
+from vsm_app.utils.stock_cache import StockResult, stock_cache
+from vsm_app.utils.singleflight import stock_singleflight
+from vsm_app.utils.sap_transport import get_sap_client, sap_base_url, sap_env
+from vsm_app.utils.soap_stream import iter_stock_rows
+from vsm_app.utils.circuit_breaker import CircuitOpenError, get_breaker
+from vsm_app.utils.sap_metrics import clase_error, sap_metrics
 from django.utils import timezone
 
-# Evitar warnings SSL
-requests.packages.urllib3.disable_warnings()
+SOAP_HEADERS = {"Content-Type": "text/xml; charset=utf-8"}
 
 
 def call_sap_rfc(rfc_name: str, params: dict | None = None, debug: bool = False) -> dict | None:
     """
     Llama a un RFC SOAP en SAP y devuelve las tablas internas en un dict.
     Si debug=True, imprime el XML enviado y la respuesta completa.
+    Devuelve None si SAP falla o si el circuito del RFC está abierto.
     """
-    SAP_ENV = os.getenv("SAP_ENV", "QAS").upper()
+    SAP_ENV = sap_env()
+    base_url = sap_base_url(SAP_ENV)
+    payload = _build_soap_payload(rfc_name, params).encode("utf-8")
 
-    BASE_URLS = {
-        "QAS": "https://frclouds4qas.rioplatense.local:10443/sap/bc/soap/rfc",
-        "PRO": "https://frclouds4pro.rioplatense.local:10443/sap/bc/soap/rfc",
-    }
+    breaker = get_breaker(rfc_name, SAP_ENV)
+    try:
+        breaker.antes()
+    except CircuitOpenError as e:
+        sap_metrics.observe(rfc_name, SAP_ENV, None, error="circuit_open")
+        print(f"⛔ {e}")
+        return None
+
+    inicio = time.monotonic()
+    try:
+        client = get_sap_client(SAP_ENV)
+        response = client.post(base_url, auth=_sap_auth(), headers=SOAP_HEADERS, content=payload, timeout=breaker.timeout())
+        red_s = time.monotonic() - inicio
 
-    base_url = BASE_URLS.get(SAP_ENV)
-    if not base_url:
-        raise ValueError(f"Entorno SAP desconocido: {SAP_ENV}")
+        if response.status_code != 200:
+            breaker.fallo(red_s)
+            sap_metrics.observe(rfc_name, SAP_ENV, red_s, request_bytes=len(payload), error=f"http_{response.status_code}")
+            print(f"❌ Error HTTP {response.status_code}: {response.text[:400]}")
+            return None
 
-    auth = (
+        breaker.exito(red_s)
+
+    except httpx.HTTPError as e:
+        breaker.fallo(time.monotonic() - inicio)
+        sap_metrics.observe(rfc_name, SAP_ENV, time.monotonic() - inicio, request_bytes=len(payload), error=clase_error(e))
+        print(f"💥 Error de conexión con SAP ({SAP_ENV}): {e}")
+        return None
+
+    inicio_parseo = time.monotonic()
+    try:
+        resultado = parse_soap_response(response.text)
+    except ET.ParseError:
+        sap_metrics.observe(rfc_name, SAP_ENV, red_s, request_bytes=len(payload), error="parse")
+        raise
+    sap_metrics.observe(
+        rfc_name, SAP_ENV, red_s,
+        parseo_s=time.monotonic() - inicio_parseo,
+        request_bytes=len(payload),
+        response_bytes=len(response.content),
+    )
+    return resultado
+
+
+class _StreamMedido:
+    """Respuesta httpx en streaming que mide el tiempo esperando bytes (red) y los bytes recibidos."""
+
+    def __init__(self, response):
+        self.response = response
+        self.status_code = response.status_code
+        self.red_s = 0.0
+        self.bytes = 0
+
+    @property
+    def text(self):
+        return self.response.text
+
+    def read(self) -> bytes:
+        inicio = time.monotonic()
+        data = self.response.read()
+        self.red_s += time.monotonic() - inicio
+        self.bytes = len(data)
+        return data
+
+    def iter_bytes(self):
+        chunks = self.response.iter_bytes()
+        while True:
+            inicio = time.monotonic()
+            chunk = next(chunks, None)
+            self.red_s += time.monotonic() - inicio
+            if chunk is None:
+                return
+            self.bytes += len(chunk)
+            yield chunk
+
+
+@contextmanager
+def sap_rfc_stream(rfc_name: str, params: dict | None = None):
+    """
+    Igual que call_sap_rfc pero devuelve la respuesta sin leer, para
+    parsearla a medida que llega (ver utils/soap_stream.py). Lo que el
+    llamador tarda entre chunks se cuenta como parseo en las métricas.
+    Lanza CircuitOpenError si el circuito del RFC está abierto.
+    """
+    SAP_ENV = sap_env()
+    client = get_sap_client(SAP_ENV)
+    payload = _build_soap_payload(rfc_name, params).encode("utf-8")
+    breaker = get_breaker(rfc_name, SAP_ENV)
+    try:
+        breaker.antes()
+    except CircuitOpenError:
+        sap_metrics.observe(rfc_name, SAP_ENV, None, error="circuit_open")
+        raise
+
+    inicio = time.monotonic()
+    stream = None
+    try:
+        with client.stream(
+            "POST",
+            sap_base_url(SAP_ENV),
+            auth=_sap_auth(),
+            headers=SOAP_HEADERS,
+            content=payload,
+            timeout=breaker.timeout(),
+        ) as response:
+            stream = _StreamMedido(response)
+            stream.red_s = time.monotonic() - inicio
+            yield stream
+    except Exception as e:
+        total = time.monotonic() - inicio
+        breaker.fallo(total)
+        red_s = stream.red_s if stream is not None else total
+        sap_metrics.observe(rfc_name, SAP_ENV, red_s, request_bytes=len(payload), error=clase_error(e))
+        raise
+
+    total = time.monotonic() - inicio
+    if stream.status_code == 200:
+        breaker.exito(total)
+        sap_metrics.observe(
+            rfc_name, SAP_ENV, stream.red_s,
+            parseo_s=max(0.0, total - stream.red_s),
+            request_bytes=len(payload),
+            response_bytes=stream.bytes,
+        )
+    else:
+        breaker.fallo(total)
+        sap_metrics.observe(rfc_name, SAP_ENV, stream.red_s, request_bytes=len(payload), error=f"http_{stream.status_code}")
+
+
+def _call_saponoso(rfc_name: str, params: dict, **kwargs) -> dict:
+    """
+    Llamada vía Saponoso (entregas) con pool compartido, circuit breaker,
+    timeout adaptativo y métricas. Lanza CircuitOpenError si el circuito está abierto.
+    """
+    # Las entregas van siempre a QAS, salvo contra el SAP simulado.
+    env = "LOCAL" if sap_env() == "LOCAL" else "QAS"
+    breaker = get_breaker(rfc_name, env, timeout_default=10.0)
+    try:
+        breaker.antes()
+    except CircuitOpenError:
+        sap_metrics.observe(rfc_name, env, None, error="circuit_open")
+        raise
+
+    sap = Saponoso(
+        endpoint=env.lower(),
+        username=os.environ.get("SAP_USERNAME", "COMM_USER1"),
+        password=os.environ.get("SAP_PASSWORD", "Sistemas2013"),
+        verify_ssl=False,
+        timeout=breaker.timeout(),
+        client=get_sap_client(env),
+        **kwargs,
+    )
+
+    inicio = time.monotonic()
+    try:
+        resultado = sap.call_rfc(rfc_name, params)
+    except Exception as e:
+        # last_call_stats viene con network_s=0 hasta que llega la respuesta:
+        # en timeouts y errores de conexión se mide desde acá.
+        segundos = time.monotonic() - inicio
+        breaker.fallo(segundos)
+        stats = sap.last_call_stats or {}
+        sap_metrics.observe(
+            rfc_name, env, segundos,
+            request_bytes=stats.get("request_bytes", 0),
+            error=clase_error(e),
+        )
+        raise
+
+    stats = sap.last_call_stats
+    breaker.exito(stats["network_s"])
+    sap_metrics.observe(
+        rfc_name, env, stats["network_s"],
+        parseo_s=stats["parse_s"],
+        request_bytes=stats["request_bytes"],
+        response_bytes=stats["response_bytes"],
+    )
+    return resultado
+
+
+def _sap_auth() -> tuple[str, str]:
+    return (
         os.getenv("SAP_USER", "comm_user1"),
         os.getenv("SAP_PASS", "Sistemas2013"),
     )
 
+
+def _build_soap_payload(rfc_name: str, params: dict | None) -> str:
     # Construcción del body XML
     body_params = ""
     if params:
@@ -45,7 +228,7 @@ def call_sap_rfc(rfc_name: str, params: dict | None = None, debug: bool = False)
             else:
                 body_params += f"<{k}>{v}</{k}>"
 
-    payload = f"""<?xml version="1.0" encoding="UTF-8"?>
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
     <soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/"
                       xmlns:urn="urn:sap-com:document:sap:rfc:functions">
         <soapenv:Body>
@@ -55,21 +238,6 @@ def call_sap_rfc(rfc_name: str, params: dict | None = None, debug: bool = False)
         </soapenv:Body>
     </soapenv:Envelope>"""
 
-    headers = {"Content-Type": "text/xml; charset=utf-8"}
-
-    try:
-        response = requests.post(base_url, auth=auth, headers=headers, data=payload, verify=False, timeout=30)
-
-        if response.status_code != 200:
-            print(f"❌ Error HTTP {response.status_code}: {response.text[:400]}")
-            return None
-
-        return parse_soap_response(response.text)
-
-    except requests.exceptions.RequestException as e:
-        print(f"💥 Error de conexión con SAP ({SAP_ENV}): {e}")
-        return None
-
 def parse_soap_response(xml_text: str) -> dict:
     """
     Convierte la respuesta SOAP en un dict.
@@ -106,13 +274,49 @@ def parse_soap_response(xml_text: str) -> dict:
                     result[tag_name].append(record)
     return result
 
-def get_stock_sap_multiple(codigos: list[str], almacen_id: str = "1100", centro: str = "1000", debug: bool = False) -> dict[str, int]:
-    
-    almacen_buscado = almacen_id.upper() 
-    centro_sap = centro.upper() 
-    
-    codigos_norm = [c.lstrip("0") for c in codigos]
-    stock_dict = {c: 0 for c in codigos} 
+def get_stock_sap_multiple(codigos: list[str], almacen_id: str = "1100", centro: str = "1000", debug: bool = False, use_cache: bool = True) -> dict[str, int]:
+    """
+    Stock por material para un centro/almacén.
+    Pasa por el cache TTL de stock (ver utils/stock_cache.py) salvo use_cache=False,
+    y las consultas iguales en vuelo se coalescen (utils/singleflight.py).
+    """
+    almacen_buscado = almacen_id.upper()
+    centro_sap = centro.upper()
+
+    stock_dict = StockResult({c: 0 for c in codigos})
+
+    def fetch(codigos_pedidos):
+        # Consultas idénticas concurrentes comparten una sola llamada a SAP.
+        clave = (centro_sap, almacen_buscado, tuple(sorted(set(codigos_pedidos))))
+        data = stock_singleflight.do(
+            clave, lambda: _consultar_stock_sap(codigos_pedidos, almacen_buscado, centro_sap)
+        )
+        return dict(data) if data is not None else None
+
+    if use_cache:
+        data = stock_cache.get_many(centro_sap, almacen_buscado, codigos, fetch)
+    else:
+        data = fetch(codigos)
+
+    if data is None:
+        # SAP caído o circuito abierto: último stock conocido, marcado como stale.
+        stock_dict.update(stock_cache.peek_many(centro_sap, almacen_buscado, codigos))
+        stock_dict.stale = True
+    else:
+        stock_dict.update(data)
+    return stock_dict
+
+
+def _consultar_stock_sap(codigos: list[str], almacen_buscado: str, centro_sap: str) -> dict[str, int] | None:
+    """
+    Consulta ZRFC_STOCK_SMARTSAFETY y devuelve {codigo: stock}.
+    Devuelve None si SAP no respondió (para no cachear ceros falsos).
+    """
+    # MATNR sin ceros -> código tal como lo pidió el llamador (el primero gana)
+    codigos_norm = {}
+    for c in codigos:
+        codigos_norm.setdefault(c.lstrip("0"), c)
+    stock_dict = {c: 0 for c in codigos}
 
     params = {
         "I_WERKS": centro_sap, 
@@ -120,36 +324,29 @@ def get_stock_sap_multiple(codigos: list[str], almacen_id: str = "1100", centro:
         "T_MATNR": codigos,
     }
 
-    data = call_sap_rfc("ZRFC_STOCK_SMARTSAFETY", params)
-
-    if not data:
-        return stock_dict
-
-    tabla_stock = data.get("T_STOCK") or data.get("STOCK") or data.get("E_RETURN") or []
-    
-    # 🟢 Iteramos y filtramos
-    for item in tabla_stock:
-        # CLAVE: Usar 'LGORT' para filtrar
-        almacen_devuelto = item.get("LGORT", "").strip().upper() 
-
-        # Solo procesamos si coincide con el almacén que el usuario seleccionó
-        if almacen_devuelto != almacen_buscado:
-            continue  
-
-        matnr_sap = item.get("MATNR", "").strip().lstrip("0")
-        labst = int(float(item.get("LABST", "0")))
+    try:
+        with sap_rfc_stream("ZRFC_STOCK_SMARTSAFETY", params) as response:
+            if response.status_code != 200:
+                response.read()
+                print(f"❌ Error HTTP {response.status_code}: {response.text[:400]}")
+                return None
+
+            # Sólo llegan acá las filas del almacén pedido y de los materiales pedidos.
+            filas = iter_stock_rows(response.iter_bytes(), almacen_buscado, set(codigos_norm))
+            for matnr_sap, labst in filas:
+                codigo = codigos_norm[matnr_sap]
+                stock_dict[codigo] += labst
+
+    except CircuitOpenError as e:
+        print(f"⛔ {e}")
+        return None
+    except (httpx.HTTPError, ET.ParseError) as e:
+        print(f"💥 Error consultando stock en SAP: {e}")
+        return None
 
-        if matnr_sap in codigos_norm:
-            index = codigos_norm.index(matnr_sap)
-            # Sumamos el stock (aunque en este caso es un único almacén)
-            stock_actual = stock_dict.get(codigos[index], 0)
-            stock_dict[codigos[index]] = stock_actual + labst 
-            
     return stock_dict
 
 
-
-
 def get_stock_sap(codigo: str, centro: str = "1000", almacen: str = "1100", debug: bool = False) -> int:
     """
     Consulta el stock de un solo material.
@@ -162,15 +359,6 @@ def enviar_entrega_a_sap(vsm):
     Envía una entrega VSM al SAP vía SOAP RFC ZRFC_INOUT_SMARTSAFETY.
     Imprime en consola el JSON exacto que se envía y la respuesta.
     """
-    sap = Saponoso(
-        endpoint="qas", 
-        username=os.environ.get("SAP_USERNAME", "COMM_USER1"),
-        password=os.environ.get("SAP_PASSWORD", "Sistemas2013"),
-        verify_ssl=False,
-        debug=True,        
-        pretty_xml=False   
-    )
-
     cabecera = {
         "LEGAJO": str(vsm.retirante.legajo),
         "FECHA": vsm.fecha_entrega.strftime("%Y%m%d"),
@@ -197,7 +385,7 @@ def enviar_entrega_a_sap(vsm):
     print(json.dumps(params, indent=2, ensure_ascii=False))
 
     try:
-        resultado = sap.call_rfc("ZRFC_INOUT_SMARTSAFETY", params)
+        resultado = _call_saponoso("ZRFC_INOUT_SMARTSAFETY", params, debug=True, pretty_xml=False)
 
         print("\n📥 Respuesta recibida de SAP:")
         print(json.dumps(resultado, indent=2, ensure_ascii=False))
@@ -213,23 +401,18 @@ def enviar_entrega_a_sap(vsm):
 
         print("⚠️ SAP devolvió mensaje sin documento:")
         print(json.dumps(e_return, indent=2, ensure_ascii=False))
-        return {"success": False, "error": f"SAP devolvió error: {mensaje or 'Sin mensaje'}"}
+        # Error de negocio: reintentar no cambia el resultado.
+        return {"success": False, "error": f"SAP devolvió error: {mensaje or 'Sin mensaje'}", "reintentable": False}
 
     except Exception as e:
         print(f"💥 Error al enviar a SAP: {e}")
-        return {"success": False, "error": f"Error al enviar a SAP: {e}"}
+        return {"success": False, "error": f"Error al enviar a SAP: {e}", "reintentable": True}
 
 def eliminar_entrega_de_sap(vsm):
 
     if not vsm.numero_sap:
         return {"success": False, "error": "El VSM no tiene documento SAP asociado"}
 
-    sap = Saponoso(
-        endpoint="qas",
-        username=os.environ.get("SAP_USERNAME", "COMM_USER1"),
-        password=os.environ.get("SAP_PASSWORD", "Sistemas2013"),
-        verify_ssl=False
-    )
     cabecera = {
         "LEGAJO": str(vsm.retirante.legajo),
         "FECHA": timezone.now().strftime("%Y%m%d"),
@@ -257,7 +440,7 @@ def eliminar_entrega_de_sap(vsm):
     print(json.dumps(params, indent=4))
 
     try:
-        res = sap.call_rfc("ZRFC_INOUT_SMARTSAFETY", params)
+        res = _call_saponoso("ZRFC_INOUT_SMARTSAFETY", params)
         print("⬅️ RESPUESTA SAP:", res)
 
         e_return = res.get("E_RETURN", {})
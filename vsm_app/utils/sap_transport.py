@@ -0,0 +1,69 @@
+import os
+import threading
+
+import httpx
+from django.conf import settings
+
+
+# Mismas variables de entorno que Saponoso.endpoints
+SAP_BASE_URLS = {
+    "QAS": os.environ.get("SAP_ENDPOINT_QAS", "https://frclouds4qas.rioplatense.local:10443/sap/bc/soap/rfc"),
+    "PRO": os.environ.get("SAP_ENDPOINT_PRO", "https://frclouds4pro.rioplatense.local:10443/sap/bc/soap/rfc"),
+    # SAP simulado (manage.py sap_fake_server) para pruebas de carga sin red
+    "LOCAL": os.environ.get("SAP_ENDPOINT_LOCAL", "http://127.0.0.1:8089/sap/bc/soap/rfc"),
+}
+
+_clients: dict[str, httpx.Client] = {}
+_lock = threading.Lock()
+
+
+def sap_env() -> str:
+    """Entorno SAP activo (QAS/PRO/LOCAL) según SAP_ENV."""
+    return os.getenv("SAP_ENV", "QAS").upper()
+
+
+def sap_base_url(env: str | None = None) -> str:
+    env = (env or sap_env()).upper()
+    base_url = SAP_BASE_URLS.get(env)
+    if not base_url:
+        raise ValueError(f"Entorno SAP desconocido: {env}")
+    return base_url
+
+
+def new_sap_client() -> httpx.Client:
+    """
+    Cliente httpx con keep-alive y pool acotado.
+    Los certificados del gateway SAP son internos: no se verifican.
+    """
+    limits = httpx.Limits(
+        max_connections=getattr(settings, "SAP_POOL_MAX_CONNECTIONS", 10),
+        max_keepalive_connections=getattr(settings, "SAP_POOL_MAX_KEEPALIVE", 5),
+        keepalive_expiry=getattr(settings, "SAP_POOL_KEEPALIVE_EXPIRY", 30),
+    )
+    return httpx.Client(verify=False, limits=limits)
+
+
+def get_sap_client(env: str | None = None) -> httpx.Client:
+    """
+    Cliente compartido por proceso para el entorno SAP dado.
+    Hay un pool por entorno, así QAS no le come conexiones a PRO.
+    """
+    env = (env or sap_env()).upper()
+    client = _clients.get(env)
+    if client is not None and not client.is_closed:
+        return client
+
+    with _lock:
+        client = _clients.get(env)
+        if client is None or client.is_closed:
+            client = new_sap_client()
+            _clients[env] = client
+        return client
+
+
+def close_sap_clients():
+    """Cierra los pools (por ejemplo al terminar un worker o en benchmarks)."""
+    with _lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
@@ -0,0 +1,68 @@
+import threading
+
+
+class _Llamada:
+    def __init__(self):
+        self.evento = threading.Event()
+        self.resultado = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalescencia de llamadas idénticas en vuelo.
+
+    Si ya hay una llamada en curso para la misma clave, las siguientes esperan
+    a que termine y reciben el mismo resultado (o la misma excepción).
+    Con el worker gevent, threading está parcheado y Lock/Event coordinan
+    greenlets del mismo worker.
+    """
+
+    def __init__(self):
+        self._en_vuelo = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, clave, fn):
+        with self._lock:
+            self.calls += 1
+            llamada = self._en_vuelo.get(clave)
+            if llamada is not None:
+                self.coalesced += 1
+                lider = False
+            else:
+                llamada = _Llamada()
+                self._en_vuelo[clave] = llamada
+                self.executions += 1
+                lider = True
+
+        if not lider:
+            llamada.evento.wait()
+            if llamada.error is not None:
+                raise llamada.error
+            return llamada.resultado
+
+        try:
+            llamada.resultado = fn()
+        except Exception as e:
+            llamada.error = e
+            raise
+        finally:
+            with self._lock:
+                self._en_vuelo.pop(clave, None)
+            llamada.evento.set()
+        return llamada.resultado
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "executions": self.executions,
+                "saved": self.coalesced,
+                "in_flight": len(self._en_vuelo),
+            }
+
+
+stock_singleflight = SingleFlight()
@@ -0,0 +1,81 @@
+import html
+import json
+import xml.etree.ElementTree as ET
+from typing import Iterable, Iterator
+
+TABLAS_STOCK = {"T_STOCK", "STOCK", "E_RETURN"}
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def iter_stock_rows(chunks: Iterable[bytes], almacen: str, materiales: set[str] | None = None) -> Iterator[tuple[str, int]]:
+    """
+    Parser incremental de la respuesta SOAP de ZRFC_STOCK_SMARTSAFETY.
+
+    Recibe la respuesta en trozos (p. ej. response.iter_bytes()) y va
+    devolviendo (MATNR sin ceros a la izquierda, LABST) a medida que llegan
+    los <item> de T_STOCK. Filtra por LGORT y por `materiales` (ya
+    normalizados sin ceros) antes de armar nada, y libera cada <item> al
+    terminarlo, así la memoria no crece con el tamaño de la tabla.
+    """
+    almacen = almacen.strip().upper()
+    parser = ET.XMLPullParser(events=("start", "end"))
+    pila = []
+
+    def procesar(eventos):
+        for evento, elem in eventos:
+            if evento == "start":
+                pila.append(elem)
+                continue
+
+            pila.pop()
+            if _local(elem.tag) != "item" or not pila or _local(pila[-1].tag) not in TABLAS_STOCK:
+                continue
+
+            fila = _leer_item(elem, almacen, materiales)
+            if fila is not None:
+                yield fila
+
+            elem.clear()
+            pila[-1].remove(elem)
+
+    for chunk in chunks:
+        parser.feed(chunk)
+        yield from procesar(parser.read_events())
+    parser.close()
+    yield from procesar(parser.read_events())
+
+
+def _leer_item(item, almacen: str, materiales: set[str] | None) -> tuple[str, int] | None:
+    if len(item):
+        # Columnas como hijos: se miran LGORT y MATNR antes de leer el resto.
+        if (item.findtext("{*}LGORT") or "").strip().upper() != almacen:
+            return None
+        matnr = (item.findtext("{*}MATNR") or "").strip().lstrip("0")
+        if materiales is not None and matnr not in materiales:
+            return None
+        return matnr, int(float(item.findtext("{*}LABST") or 0))
+
+    text = (item.text or "").strip()
+    # Descarte barato antes de decodificar el JSON embebido.
+    if not text or almacen not in text.upper():
+        return None
+    if "&" in text:
+        text = html.unescape(text)
+    try:
+        campos = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(campos, dict):
+        return None
+
+    if str(campos.get("LGORT") or "").strip().upper() != almacen:
+        return None
+
+    matnr = str(campos.get("MATNR") or "").strip().lstrip("0")
+    if materiales is not None and matnr not in materiales:
+        return None
+
+    return matnr, int(float(campos.get("LABST") or 0))
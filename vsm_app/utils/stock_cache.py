@@ -0,0 +1,176 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class StockResult(dict):
+    """{codigo: stock}; stale=True si SAP no respondió y son los últimos valores conocidos."""
+    stale = False
+
+
+class StockCache:
+    """
+    Cache en memoria del stock SAP por (centro, almacen, material).
+
+    - Dentro del TTL el valor se sirve directo (hit).
+    - Vencido el TTL pero dentro de la ventana stale, se sirve el valor viejo
+      y se dispara UN refresh en segundo plano por clave (stale-while-revalidate).
+    - Fuera de esa ventana (o sin valor) se consulta a SAP en línea (miss).
+
+    Guarda a lo sumo `max_entries` claves (se descartan las menos usadas) y
+    nada más viejo que `max_age`, que es también lo más viejo que devuelve
+    peek_many con SAP caído.
+    """
+
+    def __init__(self, ttl: float, stale_ttl: float, max_entries: int = 20000, max_age: float = 86400):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.evictions = 0
+
+    def _vigente(self, clave, ahora):
+        """(valor, guardado) de la clave, o None si no está o pasó max_age. Con el lock tomado."""
+        entry = self._entries.get(clave)
+        if entry is None:
+            return None
+        if ahora - entry[1] > self.max_age:
+            del self._entries[clave]
+            self.evictions += 1
+            return None
+        self._entries.move_to_end(clave)
+        return entry
+
+    def get_many(self, centro: str, almacen: str, codigos: list[str], fetch) -> dict[str, int] | None:
+        """
+        Devuelve {codigo: stock} para los códigos pedidos.
+        `fetch(codigos)` consulta SAP y devuelve un dict o None si SAP no respondió.
+        Devuelve None sólo si hubo que ir a SAP y no respondió.
+        """
+        ahora = time.monotonic()
+        resultado = {}
+        faltantes = []
+        vencidos = []
+
+        with self._lock:
+            for codigo in codigos:
+                entry = self._vigente((centro, almacen, codigo), ahora)
+                if entry is None:
+                    faltantes.append(codigo)
+                    continue
+                valor, guardado = entry
+                edad = ahora - guardado
+                if edad <= self.ttl:
+                    self.hits += 1
+                    resultado[codigo] = valor
+                elif edad <= self.ttl + self.stale_ttl:
+                    self.stale_hits += 1
+                    resultado[codigo] = valor
+                    clave = (centro, almacen, codigo)
+                    if clave not in self._refreshing:
+                        self._refreshing.add(clave)
+                        vencidos.append(codigo)
+                else:
+                    faltantes.append(codigo)
+            self.misses += len(faltantes)
+
+        if vencidos:
+            self._refresh_en_background(centro, almacen, vencidos, fetch)
+
+        if faltantes:
+            data = fetch(faltantes)
+            if data is None:
+                return None
+            self.set_many(centro, almacen, data)
+            resultado.update(data)
+
+        return resultado
+
+    def set_many(self, centro: str, almacen: str, stock: dict[str, int]):
+        ahora = time.monotonic()
+        with self._lock:
+            for codigo, valor in stock.items():
+                clave = (centro, almacen, codigo)
+                self._entries[clave] = (valor, ahora)
+                self._entries.move_to_end(clave)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def peek_many(self, centro: str, almacen: str, codigos: list[str]) -> dict[str, int]:
+        """Último valor conocido de hasta `max_age` de antigüedad (fallback con SAP caído)."""
+        ahora = time.monotonic()
+        with self._lock:
+            resultado = {}
+            for codigo in codigos:
+                entry = self._vigente((centro, almacen, codigo), ahora)
+                if entry is not None:
+                    resultado[codigo] = entry[0]
+            return resultado
+
+    def invalidate(self, centro: str | None = None, almacen: str | None = None):
+        """Borra las entradas del centro/almacén indicado (o todas)."""
+        with self._lock:
+            for clave in list(self._entries):
+                if centro is not None and clave[0] != centro:
+                    continue
+                if almacen is not None and clave[1] != almacen:
+                    continue
+                del self._entries[clave]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "ttl": self.ttl,
+                "stale_ttl": self.stale_ttl,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "evictions": self.evictions,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "refreshes": self.refreshes,
+                "refresh_errors": self.refresh_errors,
+                "refreshing": len(self._refreshing),
+            }
+
+    def _refresh_en_background(self, centro, almacen, codigos, fetch):
+        def _refresh():
+            try:
+                data = fetch(codigos)
+                if data is None:
+                    with self._lock:
+                        self.refresh_errors += 1
+                    return
+                self.set_many(centro, almacen, data)
+                with self._lock:
+                    self.refreshes += 1
+            except Exception as e:
+                print(f"💥 Error refrescando stock en background ({centro}/{almacen}): {e}")
+                with self._lock:
+                    self.refresh_errors += 1
+            finally:
+                with self._lock:
+                    for codigo in codigos:
+                        self._refreshing.discard((centro, almacen, codigo))
+
+        # Con el worker gevent de gunicorn threading está parcheado: esto es un greenlet.
+        threading.Thread(target=_refresh, daemon=True).start()
+
+
+stock_cache = StockCache(
+    ttl=getattr(settings, "SAP_STOCK_CACHE_TTL", 60),
+    stale_ttl=getattr(settings, "SAP_STOCK_CACHE_STALE_TTL", 300),
+    max_entries=getattr(settings, "SAP_STOCK_CACHE_MAX_ENTRIES", 20000),
+    max_age=getattr(settings, "SAP_STOCK_CACHE_MAX_AGE", 86400),
+)
@@ -0,0 +1,102 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from vsm_app.models import stock_snapshot, stock_snapshot_sync
+from vsm_app.utils.sap_rfc import _consultar_stock_sap, get_stock_sap_multiple
+
+
+def sincronizar_almacen(centro: str, almacen: str, codigos: list[str], lote: int = 1000) -> dict | None:
+    """
+    Trae de SAP el stock de `codigos` para el almacén y lo vuelca en stock_snapshot.
+    Sólo se insertan filas nuevas y se actualizan las que cambiaron (bulk),
+    las demás no se tocan; se borran las de materiales que SAP ya no
+    devolvió (salieron del maestro o del almacén). Devuelve None si SAP no
+    respondió algún lote o si no hay `codigos` (maestro vacío, filtro mal
+    puesto): en ese caso el snapshot del almacén no se toca ni se marca
+    como sincronizado.
+    """
+    if not codigos:
+        return None
+    centro = centro.upper()
+    almacen = almacen.upper()
+
+    stock_sap = {}
+    for i in range(0, len(codigos), lote):
+        data = _consultar_stock_sap(codigos[i:i + lote], almacen, centro)
+        if data is None:
+            return None
+        stock_sap.update(data)
+
+    ahora = timezone.now()
+    existentes = {
+        fila.material: fila
+        for fila in stock_snapshot.objects.filter(centro=centro, almacen=almacen).only("id", "material", "stock")
+    }
+
+    nuevas = []
+    cambiadas = []
+    for material, stock in stock_sap.items():
+        fila = existentes.get(material)
+        if fila is None:
+            nuevas.append(stock_snapshot(centro=centro, almacen=almacen, material=material, stock=stock, modificado=ahora))
+        elif fila.stock != stock:
+            fila.stock = stock
+            fila.modificado = ahora
+            cambiadas.append(fila)
+    borradas = [fila.id for material, fila in existentes.items() if material not in stock_sap]
+
+    with transaction.atomic():
+        stock_snapshot.objects.bulk_create(nuevas, batch_size=lote, ignore_conflicts=True)
+        stock_snapshot.objects.bulk_update(cambiadas, ["stock", "modificado"], batch_size=lote)
+        stock_snapshot.objects.filter(id__in=borradas).delete()
+        stock_snapshot_sync.objects.update_or_create(
+            centro=centro,
+            almacen=almacen,
+            defaults={
+                "sincronizado": ahora,
+                "materiales": len(stock_sap),
+                "cambios": len(nuevas) + len(cambiadas) + len(borradas),
+            },
+        )
+
+    return {"materiales": len(stock_sap), "nuevas": len(nuevas), "cambiadas": len(cambiadas), "borradas": len(borradas)}
+
+
+def leer_snapshot(codigos: list[str], almacen: str, centro: str = "1000", max_age: int | None = None) -> dict[str, int] | None:
+    """
+    Stock desde stock_snapshot si la última sincronización del almacén tiene
+    menos de `max_age` segundos (SAP_STOCK_SNAPSHOT_MAX_AGE). Si no, None.
+    """
+    if max_age is None:
+        max_age = getattr(settings, "SAP_STOCK_SNAPSHOT_MAX_AGE", 900)
+    if max_age <= 0:
+        return None
+
+    centro = centro.upper()
+    almacen = almacen.upper()
+
+    fresco = stock_snapshot_sync.objects.filter(
+        centro=centro,
+        almacen=almacen,
+        sincronizado__gte=timezone.now() - timedelta(seconds=max_age),
+    ).exists()
+    if not fresco:
+        return None
+
+    stock_dict = {c: 0 for c in codigos}
+    stock_dict.update(
+        stock_snapshot.objects.filter(centro=centro, almacen=almacen, material__in=codigos)
+        .values_list("material", "stock")
+    )
+    return stock_dict
+
+
+def get_stock(codigos: list[str], almacen_id: str = "1100", centro: str = "1000") -> dict[str, int]:
+    """Stock desde el snapshot local si está fresco; si no, desde SAP (con cache)."""
+    stock_dict = leer_snapshot(codigos, almacen_id, centro)
+    if stock_dict is None:
+        stock_dict = get_stock_sap_multiple(codigos, almacen_id=almacen_id, centro=centro)
+    return stock_dict
@@ -4,87 +4,251 @@ from django.contrib.auth.decorators import login_required
 from datetime import datetime
 from django.shortcuts import get_object_or_404, redirect
 from django.utils import timezone
-from django.core.paginator import Paginator
-from django.http import JsonResponse
-from django.db.models import Q
+from django.http import Http404, JsonResponse
+from django.db.models import Q, Sum
+from django.db import transaction
 from django.template.loader import render_to_string
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from .models import empleados, PermisoRetiro, VSM, VSMProducto, maestro_de_materiales, permiso_empresa_almacen, almacenes
 from django.contrib import messages
 from .decorator import permission_required
 from django.utils.safestring import mark_safe
 import json
+import uuid
 from xhtml2pdf import pisa
-from .utils.sap_rfc import call_sap_rfc, enviar_entrega_a_sap, eliminar_entrega_de_sap
-import base64
-from django.core.files.base import ContentFile
+from .utils.sap_rfc import call_sap_rfc, eliminar_entrega_de_sap
 from django.views.decorators.csrf import csrf_exempt
-from vsm_app.utils.sap_rfc import get_stock_sap_multiple
+from django.views.decorators.http import condition
 from django.shortcuts import get_object_or_404, redirect
 from django.utils.timezone import now
 from vsm_app.utils.sap_rfc import get_stock_sap
+from vsm_app.utils.stock_cache import stock_cache
+from vsm_app.utils.singleflight import stock_singleflight
+from vsm_app.utils.sap_outbox import encolar_entrega
+from vsm_app.utils.stock_snapshot import get_stock
+from vsm_app.utils.circuit_breaker import breakers_stats
+from vsm_app.utils.sap_metrics import sap_metrics
+from vsm_app.utils.material_search import buscar_materiales
+from vsm_app.utils.keyset import paginar_keyset
+from vsm_app.utils.json_paginado import pagina_json
+from vsm_app.utils.firmas import guardar_firma
+from vsm_app.utils import consumo, exportar_registros, pdf_canvas, pdf_lote
+from django.conf import settings
 
 
 
 def home(request):
     return render(request, "home.html")
 
+def _filtrar_registros(vales, request):
+    """Aplica los filtros de registros (GET) a `vales`; los usan también las exportaciones."""
+    filtros = {
+        campo: request.GET.get(campo, "").strip()
+        for campo in ("solicitante", "retirante", "cc", "almacen", "estado")
+    }
+
+    if filtros["solicitante"]:
+        vales = vales.filter(solicitante__username__icontains=filtros["solicitante"])
+
+    if filtros["retirante"]:
+        vales = vales.filter(retirante__nombre__icontains=filtros["retirante"])
+
+    if filtros["cc"]:
+        vales = vales.filter(centro_costos__codigo__icontains=filtros["cc"])
+
+    if filtros["almacen"]:
+        vales = vales.filter(almacen__almacen=filtros["almacen"])
+
+    if filtros["estado"] and filtros["estado"] != "#":
+        vales = vales.filter(estado=filtros["estado"])
+
+    return vales, filtros
+
+
 @login_required
 @permission_required("registros_can_view")
 def registros(request):
     vales = (
         models.VSM.objects.filter(estado__in=["pendiente", "entregado"], active=True)
-        .prefetch_related("vsmproducto_set__producto")
+        .select_related("solicitante", "retirante__cc", "almacen__empresa")
+        .con_resumen()
         .order_by("-fecha_solicitud")
     )
 
-    # ---- FILTROS ----
-    solicitante = request.GET.get("solicitante", "").strip()
-    retirante = request.GET.get("retirante", "").strip()
-    cc = request.GET.get("cc", "").strip()
-    estado = request.GET.get("estado", "").strip()
+    vales, filtros = _filtrar_registros(vales, request)
 
-    if solicitante:
-        vales = vales.filter(solicitante__username__icontains=solicitante)
+    # ---- PAGINAR DESPUÉS DE FILTRAR (keyset por fecha_solicitud, id) ----
+    page_obj = paginar_keyset(vales, request, 7, "registros")
 
-    if retirante:
-        vales = vales.filter(retirante__nombre__icontains=retirante)
+    context = {
+        "registros": page_obj,
+        "page_obj": page_obj,
+        "filtros": filtros,
+    }
 
-    if cc:
-        vales = vales.filter(centro_costos__codigo__icontains=cc)
+    return render(request, "registros.html", context)
 
-    if estado and estado != "#":
-        vales = vales.filter(estado=estado)
 
-    # ---- PAGINAR DESPUÉS DE FILTRAR ----
-    paginator = Paginator(vales, 7)
-    page_number = request.GET.get("page")
-    page_obj = paginator.get_page(page_number)
+@login_required
+@permission_required("registros_can_view")
+def exportar_registros_planilla(request):
+    """
+    Líneas de los vales de registros (mismos filtros) en CSV o, con
+    ?formato=xlsx, en Excel. Se arma mientras se manda: ver
+    utils/exportar_registros.
+    """
+    vales = models.VSM.objects.filter(estado__in=["pendiente", "entregado"], active=True)
+    vales, _ = _filtrar_registros(vales, request)
+    filas = exportar_registros.filas(vales)
+    nombre = f"registros_{timezone.localdate():%Y%m%d}"
+
+    if request.GET.get("formato") == "xlsx":
+        response = StreamingHttpResponse(
+            exportar_registros.xlsx_en_trozos(filas),
+            content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        )
+        response["Content-Disposition"] = f'attachment; filename="{nombre}.xlsx"'
+    else:
+        response = StreamingHttpResponse(exportar_registros.csv_en_trozos(filas), content_type="text/csv; charset=utf-8")
+        response["Content-Disposition"] = f'attachment; filename="{nombre}.csv"'
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+@login_required
+@permission_required("registros_can_view")
+def exportar_pdfs(request):
+    """
+    ZIP con el PDF de cada vale que muestra registros con los mismos
+    filtros (GET). Se manda a medida que se dibujan (ver utils/pdf_lote);
+    ?exportacion=<id> es la clave para consultar el avance o cancelar.
+    """
+    vales = models.VSM.objects.filter(estado__in=["pendiente", "entregado"], active=True)
+    vales, _ = _filtrar_registros(vales, request)
+    vales = vales.order_by("-fecha_solicitud", "-id")
+
+    exportacion = (request.GET.get("exportacion") or uuid.uuid4().hex)[:64]
+    total = vales.count()
+    avance = pdf_lote.iniciar_avance(request.user.pk, exportacion, total)
+
+    response = StreamingHttpResponse(pdf_lote.zip_de_vales(vales, avance), content_type="application/zip")
+    response["Content-Disposition"] = f'attachment; filename="vales_{timezone.localdate():%Y%m%d}.zip"'
+    response["X-Exportacion"] = exportacion
+    response["X-Vales-Total"] = total
+    # Que nginx no junte todo el ZIP antes de mandarlo
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+@login_required
+@permission_required("registros_can_view")
+def estado_exportacion_pdfs(request, exportacion):
+    """GET: avance de la exportación ({total, hechos, cancelada}). POST: la cancela."""
+    if request.method == "POST":
+        pdf_lote.cancelar(request.user.pk, exportacion)
+    estado = pdf_lote.estado_avance(request.user.pk, exportacion)
+    if estado is None:
+        return JsonResponse({"error": "Exportación no encontrada"}, status=404)
+    return JsonResponse(estado)
+
+def _mes_param(valor, defecto):
+    try:
+        return datetime.strptime(valor, "%Y-%m").date()
+    except (TypeError, ValueError):
+        return defecto
+
+
+def _sumar_meses(mes, n):
+    indice = mes.year * 12 + mes.month - 1 + n
+    return mes.replace(year=indice // 12, month=indice % 12 + 1)
+
+
+@login_required
+@permission_required("registros_can_view")
+def reporte_consumo(request):
+    """
+    Consumo por mes y por CC, material o almacén (?por=), con filtros de
+    tipo de entrega y facturación. Lee sólo los acumulados
+    consumo_mensual_* (ver utils/consumo), no las líneas de los vales.
+    """
+    por = request.GET.get("por") if request.GET.get("por") in ("cc", "material", "almacen") else "cc"
+    modelo, campo = {
+        "cc": (models.consumo_mensual_cc, "cc"),
+        "material": (models.consumo_mensual_material, "producto"),
+        "almacen": (models.consumo_mensual_almacen, "almacen"),
+    }[por]
+
+    hoy = timezone.localdate().replace(day=1)
+    hasta = _mes_param(request.GET.get("hasta"), hoy)
+    # Por defecto los últimos 12 meses; como mucho 36 columnas
+    desde = max(_mes_param(request.GET.get("desde"), _sumar_meses(hasta, -11)), _sumar_meses(hasta, -35))
+    tipo_entrega = request.GET.get("tipo_entrega", "")
+    tipo_facturacion = request.GET.get("tipo_facturacion", "")
+
+    acumulados = modelo.objects.filter(mes__gte=desde, mes__lte=hasta)
+    if tipo_entrega:
+        acumulados = acumulados.filter(tipo_entrega=tipo_entrega)
+    if tipo_facturacion:
+        acumulados = acumulados.filter(tipo_facturacion=tipo_facturacion)
+
+    meses = []
+    mes = desde
+    while mes <= hasta:
+        meses.append(mes)
+        mes = _sumar_meses(mes, 1)
+
+    # Tabla cruzada: una fila por CC/material/almacén, una columna por mes
+    cruce = {}
+    for fila in acumulados.values(campo, "mes").annotate(
+        cantidad=Sum("cantidad"), lineas=Sum("lineas"), vales=Sum("vales")
+    ):
+        item = cruce.setdefault(fila[campo], {"por_mes": {}, "total": 0, "lineas": 0, "vales": 0})
+        item["por_mes"][fila["mes"]] = fila["cantidad"]
+        item["total"] += fila["cantidad"]
+        item["lineas"] += fila["lineas"]
+        item["vales"] += fila["vales"]
+
+    limite = 200
+    claves = sorted(cruce, key=lambda k: cruce[k]["total"], reverse=True)[:limite]
+    dimension = modelo._meta.get_field(campo).related_model.objects
+    if por == "almacen":
+        dimension = dimension.select_related("empresa")
+    nombres = dimension.in_bulk([k for k in claves if k is not None])
+    filas = [
+        {
+            "nombre": str(nombres[k]) if k in nombres else "Sin almacén",
+            "meses": [cruce[k]["por_mes"].get(m, 0) for m in meses],
+            **{c: cruce[k][c] for c in ("total", "lineas", "vales")},
+        }
+        for k in claves
+    ]
 
     context = {
-        "vales": vales,
-        "registros": page_obj,
-        "page_obj": page_obj,
+        "filas": filas,
+        "meses": meses,
+        "recortado": len(cruce) > limite,
+        "limite": limite,
         "filtros": {
-            "solicitante": solicitante,
-            "retirante": retirante,
-            "cc": cc,
-            "estado": estado,
+            "por": por,
+            "desde": f"{desde:%Y-%m}",
+            "hasta": f"{hasta:%Y-%m}",
+            "tipo_entrega": tipo_entrega,
+            "tipo_facturacion": tipo_facturacion,
         },
     }
+    return render(request, "reporte_consumo.html", context)
 
-    return render(request, "registros.html", context)
 
 @login_required
 @permission_required(["facturado_can_create", "no_facturado_can_create"])
 def nuevo_vsm(request):
-    empleados = models.empleados.objects.all()
-    centro_costos = models.centro_costos.objects.all()
-    usuario_logeado = request.user.first_name + " " + request.user.last_name
-    centro_usuario = request.user.cc_permitidos.all()
-    productos = models.maestro_de_materiales.objects.all()
-    empresas = request.user.empresas.all()
-    almacen_obj_list = models.almacenes.objects.filter(empresa__in=empresas)
+    # Sólo los CC y empresas del usuario; retirantes, almacenes y productos
+    # los pide la página a los endpoints JSON paginados.
+    contexto = {
+        "usuario_logeado": request.user.first_name + " " + request.user.last_name,
+        "centro_usuario": request.user.cc_permitidos.order_by("codigo"),
+        "empresas": request.user.empresas.order_by("empresa"),
+    }
     if request.method == "POST":
         solicitante_id = request.POST.get("solicitante")
         observaciones = request.POST.get("detalles", "")
@@ -100,11 +264,7 @@ def nuevo_vsm(request):
             return render(
                 request,
                 "nuevo_vsm.html",
-                {
-                    "productos": productos,
-                    "empleados": empleados,
-                    "error": "Debe seleccionar un solicitante.",
-                },
+                {**contexto, "error": "Debe seleccionar un solicitante."},
             )
 
         # --- BUSCAR EL OBJETO ALMACÉN POR EL CÓDIGO SAP ---
@@ -116,61 +276,61 @@ def nuevo_vsm(request):
                 messages.error(request, f"❌ El código de almacén '{almacen_codigo_sap}' no fue encontrado.")
                 return redirect("nuevo_vsm") # Redirigir o manejar el error
 
-        productos_solicitados = []
+        cantidades = {}
         for key, value in request.POST.items():
             if key.startswith("producto_"):
                 try:
                     producto_id = int(key.split("_")[1])
                     cantidad_solicitada = int(value)
-                    if cantidad_solicitada > 0:
-                        producto = get_object_or_404(
-                            models.maestro_de_materiales, id=producto_id
-                        )
-                        productos_solicitados.append((producto, cantidad_solicitada))
                 except (ValueError, IndexError):
                     continue
+                if cantidad_solicitada > 0:
+                    cantidades[producto_id] = cantidad_solicitada
+
+        # Todos los productos en una consulta, y todos permitidos para el CC
+        productos = models.maestro_de_materiales.objects.in_bulk(cantidades)
+        if len(productos) != len(cantidades):
+            raise Http404("Producto inexistente")
+
+        permitidos = set(
+            PermisoRetiro.producto.through.objects.filter(
+                permisoretiro__centro_costo_id=centro_costos_id,
+                maestro_de_materiales_id__in=cantidades,
+            ).values_list("maestro_de_materiales_id", flat=True)
+        )
+        no_permitidos = [productos[i].descripcion for i in cantidades if i not in permitidos]
+        if no_permitidos:
+            messages.error(request, f"❌ Productos no permitidos para el centro de costos: {', '.join(no_permitidos)}")
+            return redirect("nuevo_vsm")
 
         # --- Retirante ---
         retirante_obj = None
         if retirante:
             retirante_obj = get_object_or_404(models.empleados, pk=retirante)
 
-        # --- Creación del VSM ---
-        vsm = models.VSM.objects.create(
-            centro_costos_id=centro_costos_id,
-            solicitante=request.user,
-            retirante=retirante_obj,
-            fecha_solicitud=now(),
-            observaciones=observaciones,
-            tipo_entrega=tipo_entrega,
-            almacen=almacen_objeto, 
-            tipo_facturacion=tipo_facturacion,
-            estado_aprobacion=estado_aprobacion_inicial,
-        )
+        # --- Creación del VSM (cabecera y líneas juntas) ---
+        with transaction.atomic():
+            vsm = models.VSM.objects.create(
+                centro_costos_id=centro_costos_id,
+                solicitante=request.user,
+                retirante=retirante_obj,
+                fecha_solicitud=now(),
+                observaciones=observaciones,
+                tipo_entrega=tipo_entrega,
+                almacen=almacen_objeto, 
+                tipo_facturacion=tipo_facturacion,
+                estado_aprobacion=estado_aprobacion_inicial,
+            )
 
-        for producto, cantidad_solicitada in productos_solicitados:
-            models.VSMProducto.objects.create(
-                vsm=vsm,
-                producto=producto,
-                cantidad_solicitada=cantidad_solicitada
+            models.VSMProducto.objects.bulk_create(
+                models.VSMProducto(vsm=vsm, producto=productos[producto_id], cantidad_solicitada=cantidad)
+                for producto_id, cantidad in cantidades.items()
             )
 
         messages.success(request, "✅ VSM creado con éxito")
         return redirect("home")
 
-    return render(
-        request,
-        "nuevo_vsm.html",
-        {
-            "productos": productos,
-            "empleados": empleados,
-            "usuario_logeado": usuario_logeado,
-            "centro_costos": centro_costos,
-            "centro_usuario": centro_usuario,
-            "empresas": empresas,
-            "almacen_id": almacen_obj_list,
-        },
-    )
+    return render(request, "nuevo_vsm.html", contexto)
 
 def detalle_vsm(request, id):
     vsm = models.VSM.objects.get(id=id)
@@ -202,17 +362,39 @@ def editar_vsm(request, id):
 def eliminar_vsm(request, vsm_id):
     vsm = get_object_or_404(models.VSM, id=vsm_id)
 
-    if vsm.numero_sap:
-        res = eliminar_entrega_de_sap(vsm)
-
-        if not res.get("success"):
+    with transaction.atomic():
+        # Con el vale y su envío a SAP bloqueados el worker no puede escribir
+        # numero_sap en el medio: o ya está (y se revierte) o no se envía
+        previo = models.VSM.objects.select_for_update().get(id=vsm.id)
+        envio = (
+            models.outbox_entrega_sap.objects.select_for_update()
+            .filter(vsm=previo, estado__in=["pendiente", "procesando"])
+            .first()
+        )
+        if envio and envio.estado == "procesando":
             return JsonResponse({
                 "success": False,
-                "error": f"No se pudo revertir en SAP: {res.get('error')}"
-            })
-
-    vsm.active = False
-    vsm.save()
+                "error": "La entrega se está enviando a SAP; probá de nuevo en unos segundos"
+            }, status=409)
+
+        if previo.numero_sap:
+            res = eliminar_entrega_de_sap(previo)
+
+            if not res.get("success"):
+                return JsonResponse({
+                    "success": False,
+                    "error": f"No se pudo revertir en SAP: {res.get('error')}"
+                })
+
+        if envio:
+            envio.estado = "error"
+            envio.ultimo_error = "VSM eliminado antes de enviarse a SAP"
+            envio.save()
+        if consumo.cuenta(previo):
+            consumo.restar(previo, previo.vsmproducto_set.only("producto_id", "cantidad_entregada"))
+        # Sólo estos campos: el resto de la fila puede haberlo escrito el worker de SAP
+        previo.active = False
+        previo.save(update_fields=["active", "actualizado"])
 
     return JsonResponse({
         "success": True,
@@ -231,62 +413,50 @@ def confirmar_entrega(request, vsm_id):
         observaciones_entrega = request.POST.get("observaciones_entrega")
         firma_base64 = request.POST.get("firma_base64", None)
 
-        for vp in vsm.vsmproducto_set.all():
-            cantidad_str = request.POST.get(f"cantidad_entregada_{vp.id}", 0)
-            try:
-                cantidad = float(cantidad_str) if cantidad_str else 0
-            except ValueError:
-                cantidad = 0
+        # La entrega se guarda y se encola para SAP en la misma transacción;
+        # el posteo lo hace el worker procesar_outbox_sap (sin bloquear el request).
+        # La firma es una sola para el vale: se decodifica y se escribe una vez
+        firma = None
+        if tipo_entrega == "EPP" and firma_base64:
+            firma = guardar_firma(firma_base64)
+
+        with transaction.atomic():
+            # Bloquea el vale: si ya estaba entregado (doble envío, reconfirmación)
+            # se descuenta de los acumulados lo que aportaba antes de sumar lo nuevo
+            previo = models.VSM.objects.select_for_update().get(id=vsm.id)
+            if not previo.active:
+                return JsonResponse({"success": False, "error": "El VSM fue eliminado"}, status=409)
+            if consumo.cuenta(previo):
+                consumo.restar(previo, previo.vsmproducto_set.only("producto_id", "cantidad_entregada"))
+
+            lineas = list(vsm.vsmproducto_set.all())
+            for vp in lineas:
+                cantidad_str = request.POST.get(f"cantidad_entregada_{vp.id}", 0)
+                try:
+                    cantidad = float(cantidad_str) if cantidad_str else 0
+                except ValueError:
+                    cantidad = 0
 
-            vp.cantidad_entregada = cantidad
+                vp.cantidad_entregada = cantidad
+                if firma:
+                    vp.firma_retirante = firma
 
-            if tipo_entrega == "EPP" and firma_base64:
-                formato, imgstr = firma_base64.split(";base64,")
-                archivo = ContentFile(
-                    base64.b64decode(imgstr), name=f"firma_{vsm.id}_{vp.id}.png"
-                )
-                vp.firma_retirante.save(
-                    f"firma_{vsm.id}_{vp.id}.png", archivo, save=False
-                )
+            campos = ["cantidad_entregada", "firma_retirante"] if firma else ["cantidad_entregada"]
+            models.VSMProducto.objects.bulk_update(lineas, campos)
 
-            vp.save()
+            vsm.observaciones_entrega = observaciones_entrega
+            vsm.fecha_entrega = timezone.now()
+            vsm.estado = "entregado"
+            vsm.estado_sap = "no_procesado"
+            vsm.save(update_fields=["observaciones_entrega", "fecha_entrega", "estado", "estado_sap", "actualizado"])
 
-        vsm.observaciones_entrega = observaciones_entrega
-        vsm.fecha_entrega = timezone.now()
-        vsm.save()
+            if consumo.cuenta(vsm):
+                consumo.sumar(vsm, lineas)
+            encolar_entrega(vsm)
 
-        try:
-            resultado_sap = enviar_entrega_a_sap(vsm)
-
-            if resultado_sap.get("success"):
-                vsm.numero_sap = resultado_sap.get("mat_doc")
-                vsm.anio_documento = resultado_sap.get("doc_year")
-                vsm.estado = "entregado"
-                vsm.save()
-                print(
-                    f"✅ Entrega del VSM {vsm.id} enviada a SAP correctamente. Documento SAP: {vsm.numero_sap}"
-                )
-
-                return JsonResponse({"success": True, "estado": vsm.estado})
-            else:
-                vsm.estado = "pendiente"
-                vsm.save()
-                print(f"⚠️ SAP devolvió error: {resultado_sap.get('error')}")
-                return JsonResponse(
-                    {
-                        "success": False,
-                        "estado": vsm.estado,
-                        "error": resultado_sap.get("error"),
-                    }
-                )
-
-        except Exception as e:
-            vsm.estado = "pendiente"
-            vsm.save()
-            print(f"💥 Error al enviar entrega a SAP: {str(e)}")
-            return JsonResponse(
-                {"success": False, "estado": vsm.estado, "error": str(e)}
-            )
+        return JsonResponse(
+            {"success": True, "estado": vsm.estado, "estado_sap": vsm.estado_sap}
+        )
 
     return render(
         request,
@@ -322,7 +492,8 @@ def rechazar_entrega(request, vsm_id):
 def listar_vsm_pendientes(request):
     vales = (
         models.VSM.objects.filter(estado__in=["pendiente", "entregado"], active=True)
-        .prefetch_related("vsmproducto_set__producto")
+        .select_related("solicitante", "retirante__cc", "almacen__empresa")
+        .con_resumen()
         .order_by("-fecha_solicitud")
     )
 
@@ -350,9 +521,7 @@ def listar_vsm_pendientes(request):
     if estado_aprobacion and estado_aprobacion != "#":
         vales = vales.filter(estado_aprobacion=estado_aprobacion)
 
-    paginator = Paginator(vales, 7)
-    page_number = request.GET.get("page")
-    page_obj = paginator.get_page(page_number)
+    page_obj = paginar_keyset(vales, request, 7, "pendientes")
 
     context = {
         "pendientes": page_obj,
@@ -387,21 +556,32 @@ def buscar_solicitantes(request):
     return JsonResponse({"results": results})
 
 
+@login_required
 def obtener_empleados_por_centro(request):
+    """
+    Retirantes para el select2 de nuevo_vsm: empleados del centro elegido
+    (que tiene que estar entre los permitidos del usuario), filtrados por
+    nombre o legajo y de a una página.
+    """
+    query = request.GET.get("q", "").strip()
+    centro_id = request.GET.get("centro_id", "")
+
+    centros = request.user.cc_permitidos.all()
+    if centro_id:
+        if not centro_id.isdigit():
+            return JsonResponse({"results": [], "pagination": {"more": False}})
+        centros = centros.filter(pk=centro_id)
+
+    empleados_qs = empleados.objects.filter(cc__in=centros.values("pk"))
+    if query:
+        filtro = Q(nombre__icontains=query)
+        if query.isdigit():
+            filtro |= Q(legajo__startswith=query)
+        empleados_qs = empleados_qs.filter(filtro)
 
-    cc_permitidos_ids = request.user.cc_permitidos.values_list('pk', flat=True)
-    
-    if not cc_permitidos_ids:
-        return JsonResponse({"empleados": []})
-
-    empleados_qs = empleados.objects.filter(
-        cc_id__in=cc_permitidos_ids  
-    ).values(
-        "id", "nombre", "legajo"
-    ).order_by("legajo")
-
-    empleados_list = list(empleados_qs)
-    return JsonResponse({"empleados": empleados_list})
+    filas, hay_mas = pagina_json(empleados_qs.values("id", "nombre", "legajo").order_by("legajo"), request)
+    results = [{"id": e["id"], "text": f"{e['legajo']}, {e['nombre']}"} for e in filas]
+    return JsonResponse({"results": results, "pagination": {"more": hay_mas}})
 
 
 def buscar_productos(request):
@@ -417,11 +597,7 @@ def buscar_productos(request):
             ).values_list("producto", flat=True)
         )
 
-
-    if query:
-        productos = productos.filter(descripcion__icontains=query)
-
-    productos = productos[:20]
+    productos = buscar_materiales(productos, query)
 
     results = [{"id": p.id, "text": p.descripcion} for p in productos]
     return JsonResponse({"results": results})
@@ -439,14 +615,15 @@ def buscar_productos_por_centro(request):
 
     try:
         permiso = PermisoRetiro.objects.get(centro_costo_id=centro_id)
-        productos = permiso.producto.filter(descripcion__icontains=query)
+        productos = permiso.producto.all()
 
         if tipo_entrega == "EPP":
             productos = productos.filter(clase_sap="EPP")
         elif tipo_entrega == "INSUMOS":
             productos = productos.exclude(clase_sap="EPP")
 
-        productos = productos[:20]
+        # Código o descripción, sin tildes y por similitud (índices pg_trgm)
+        productos = buscar_materiales(productos, query)
 
     except PermisoRetiro.DoesNotExist:
         return JsonResponse({"results": []})
@@ -459,12 +636,13 @@ def buscar_productos_por_centro(request):
     print("📦 Códigos consultados a SAP:", codigos)
 
     
-    stock_dict = get_stock_sap_multiple(
-        codigos, 
-        almacen_id=almacen_id, # <--- ¡Nuevo argumento!
-        debug=True
-    )
-    print("📊 Stock devuelto por SAP:", stock_dict)
+    # Snapshot local si está fresco; si no, SAP (con cache)
+    stock_dict = get_stock(codigos, almacen_id=almacen_id)
+    print("📊 Stock devuelto:", stock_dict)
+
+    # Con SAP caído el stock es el último conocido: se avisa en el texto.
+    stale = getattr(stock_dict, "stale", False)
+    aviso_stale = " (stock no actualizado)" if stale else ""
 
     results = []
     for p in productos:
@@ -473,14 +651,14 @@ def buscar_productos_por_centro(request):
 
         if stock and stock > 0:
             results.append(
-                {"id": p.id, "text": f"{p.descripcion} ({p.codigo}) — STOCK: {stock}"}
+                {"id": p.id, "text": f"{p.descripcion} ({p.codigo}) — STOCK: {stock}{aviso_stale}"}
             )
 
     if not results:
         print("❌ Ningún producto con stock > 0")
         results = [{"id": "0", "text": "⚠️ No hay productos con stock disponible"}]
 
-    return JsonResponse({"results": results})
+    return JsonResponse({"results": results, "stale": stale})
 
 def get_materiales_por_centro(request):
     centro_id = request.GET.get("centro_id")
@@ -581,15 +759,48 @@ def get_tags_por_empleado(request, empleado_id):
     return JsonResponse(data, safe=False)
 
 
+def _pdf_actualizado(request, vsm_id):
+    return VSM.objects.filter(id=vsm_id).values_list("actualizado", flat=True).first()
+
+
+def _pdf_etag(request, vsm_id):
+    actualizado = _pdf_actualizado(request, vsm_id)
+    if not actualizado:
+        return None
+    formato, motor = _pdf_opciones(request)
+    return f"vsm-{vsm_id}-{formato}-{motor}-{actualizado.timestamp()}"
+
+
+def _pdf_opciones(request):
+    formato = "epp" if request.GET.get("formato") == "epp" else "vsm"
+    motor = request.GET.get("motor") or getattr(settings, "VSM_PDF_MOTOR", "html")
+    return formato, motor
+
+
+# Los vales entregados se reimprimen mucho: con ETag/Last-Modified por
+# `actualizado` el navegador revalida y recibe 304 sin volver a renderizar.
+@condition(etag_func=_pdf_etag, last_modified_func=_pdf_actualizado)
 def generar_pdf(request, vsm_id):
-    vsm = get_object_or_404(VSM, id=vsm_id)
+    """
+    PDF del vale. ?formato=vsm|epp elige el layout y ?motor=html|canvas el
+    render: html pasa el template por xhtml2pdf, canvas lo dibuja directo
+    con ReportLab (utils/pdf_canvas). Por defecto VSM_PDF_MOTOR.
+    """
+    vsm = get_object_or_404(VSM.objects.select_related("retirante__cc", "solicitante"), id=vsm_id)
     productos = vsm.vsmproducto_set.select_related("producto").all()
+    formato, motor = _pdf_opciones(request)
 
-    template_path = "vsm_pdf.html"
-    context = {"vsm": vsm, "productos": productos}
     response = HttpResponse(content_type="application/pdf")
     response["Content-Disposition"] = f'inline; filename="VSM_{vsm.id}.pdf"'
 
+    if motor == "canvas":
+        render = pdf_canvas.render_epp if formato == "epp" else pdf_canvas.render_vsm
+        response.write(render(vsm, list(productos)))
+        return response
+
+    template_path = "epp_pdf.html" if formato == "epp" else "vsm_pdf.html"
+    context = {"vsm": vsm, "productos": productos}
+
     html = render_to_string(template_path, context)
 
     pisa_status = pisa.CreatePDF(html, dest=response)
@@ -628,44 +839,96 @@ def consultar_stock(request):
         )
 
     lista_codigos = [c.strip() for c in codigos.split(",") if c.strip()]
-    stock_data = get_stock_sap_multiple(lista_codigos)
+    almacen_id = request.GET.get("almacen", "1100")
+    stock_data = get_stock(lista_codigos, almacen_id=almacen_id)
 
-    return JsonResponse({"stocks": stock_data})
+    return JsonResponse(
+        {"stocks": stock_data, "stale": getattr(stock_data, "stale", False)}
+    )
+
+@login_required
+def estado_cache_stock(request):
+    return JsonResponse(
+        {
+            **stock_cache.stats(),
+            "singleflight": stock_singleflight.stats(),
+            "circuitos": breakers_stats(),
+        }
+    )
+
+def metricas_sap(request):
+    """Métricas SAP de este worker en formato de texto de Prometheus. Sólo local o staff."""
+    ip = request.META.get("REMOTE_ADDR")
+    if ip not in settings.SAP_METRICS_ALLOWED_IPS and not request.user.is_staff:
+        return HttpResponse(status=403)
+
+    cache = stock_cache.stats()
+    singleflight = stock_singleflight.stats()
+    circuitos = breakers_stats()
+    series = [
+        ("sap_stock_cache_entries", "gauge", "Claves de stock en el cache.", [({}, cache["entries"])]),
+        ("sap_stock_cache_max_entries", "gauge", "Tope de claves del cache de stock.", [({}, cache["max_entries"])]),
+        ("sap_stock_cache_refreshing", "gauge", "Claves de stock refrescándose en segundo plano.", [({}, cache["refreshing"])]),
+        ("sap_stock_cache_hits_total", "counter", "Consultas de stock servidas dentro del TTL.", [({}, cache["hits"])]),
+        ("sap_stock_cache_stale_hits_total", "counter", "Consultas de stock servidas vencidas, mientras se refrescan.", [({}, cache["stale_hits"])]),
+        ("sap_stock_cache_misses_total", "counter", "Consultas de stock que fueron a SAP en línea.", [({}, cache["misses"])]),
+        ("sap_stock_cache_refreshes_total", "counter", "Refrescos en segundo plano terminados.", [({}, cache["refreshes"])]),
+        ("sap_stock_cache_refresh_errors_total", "counter", "Refrescos en segundo plano fallidos.", [({}, cache["refresh_errors"])]),
+        ("sap_stock_cache_evictions_total", "counter", "Claves descartadas por tope o por antigüedad.", [({}, cache["evictions"])]),
+        ("sap_stock_singleflight_calls_total", "counter", "Consultas de stock que pasaron por single-flight.", [({}, singleflight["calls"])]),
+        ("sap_stock_singleflight_executions_total", "counter", "Consultas de stock que fueron a SAP.", [({}, singleflight["executions"])]),
+        ("sap_stock_singleflight_saved_total", "counter", "Consultas de stock resueltas con una llamada en vuelo.", [({}, singleflight["saved"])]),
+        ("sap_stock_singleflight_in_flight", "gauge", "Consultas de stock en vuelo.", [({}, singleflight["in_flight"])]),
+        ("sap_circuit_open", "gauge", "1 si el circuito no está cerrado.", [
+            ({"circuit": c}, 0 if s["estado"] == "closed" else 1) for c, s in circuitos.items()
+        ]),
+        ("sap_circuit_timeout_seconds", "gauge", "Timeout vigente del circuito.", [
+            ({"circuit": c}, s["timeout"]) for c, s in circuitos.items()
+        ]),
+        ("sap_circuit_openings_total", "counter", "Veces que se abrió el circuito.", [
+            ({"circuit": c}, s["aperturas"]) for c, s in circuitos.items()
+        ]),
+        ("sap_circuit_rejected_total", "counter", "Llamadas rechazadas con el circuito abierto.", [
+            ({"circuit": c}, s["rechazadas"]) for c, s in circuitos.items()
+        ]),
+    ]
+    lineas = [sap_metrics.render(), sap_metrics.render_series(series)]
 
+    return HttpResponse(
+        "".join(lineas), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+@login_required
 def obtener_almacenes_por_empresa(request):
-    empresa_id = request.GET.get('empresa_id')
+    empresa_id = request.GET.get('empresa_id', '')
+
+    # Sólo empresas que el usuario representa
+    if not empresa_id.isdigit() or not request.user.empresas.filter(pk=empresa_id).exists():
+        return JsonResponse({'almacenes': [], 'pagination': {'more': False}})
 
-    if not empresa_id:
-        return JsonResponse({'almacenes': []})
+    vinculos_permitidos = (
+        permiso_empresa_almacen.objects.filter(empresa_id=empresa_id)
+        .select_related('almacen__empresa')
+        .prefetch_related('usuarios_aprobadores')
+        .order_by('almacen__almacen', 'id')
+    )
+    vinculos, hay_mas = pagina_json(vinculos_permitidos, request)
 
     results = []
+    for vinculo in vinculos:
+        almacen = vinculo.almacen
+        results.append({
+            'value': almacen.almacen,
+            'text': f"{almacen.almacen} - {almacen.empresa}",
+            'id': almacen.id,
 
-    try:
-        vinculos_permitidos = permiso_empresa_almacen.objects.filter(
-            empresa_id=empresa_id
-        ).select_related('almacen')
-        
-        for vinculo in vinculos_permitidos:
-            almacen = vinculo.almacen
-            
-            aprobadores_ids = list(vinculo.usuarios_aprobadores.values_list('id', flat=True))
-
-            results.append({
-                'value': almacen.almacen,
-                'text': f"{almacen.almacen} - {almacen.empresa}", 
-                'id': almacen.id, 
-                
-                'empresa_propietaria_id': almacen.empresa.id,
-                
-                'requiere_aprobacion': vinculo.requiere_aprobacion,
-                'usuarios_aprobadores': aprobadores_ids,
-            })
-            
-    except Exception as e:
-        print(f"Error al obtener almacenes para empresa {empresa_id}: '{e}'")
-        return JsonResponse({'almacenes': []})
-
-    return JsonResponse({'almacenes': results})
+            'empresa_propietaria_id': almacen.empresa_id,
+
+            'requiere_aprobacion': vinculo.requiere_aprobacion,
+            'usuarios_aprobadores': [u.id for u in vinculo.usuarios_aprobadores.all()],
+        })
+
+    return JsonResponse({'almacenes': results, 'pagination': {'more': hay_mas}})
 
 @login_required
 def aprobar_vsm(request, vsm_id):
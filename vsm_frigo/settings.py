@@ -32,6 +32,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "vsm_app",
     "mozilla_django_oidc",
     "corsheaders",
@@ -97,6 +98,10 @@ INTERNAL_IPS = [
 ]
 
 
+# IPs que pueden leer /metrics (además de usuarios staff)
+SAP_METRICS_ALLOWED_IPS = os.getenv("SAP_METRICS_ALLOWED_IPS", ",".join(INTERNAL_IPS)).split(",")
+
+
 USE_X_FORWARDED_HOST = True
 SECURE_PROXY_SSL_HEADER = ("HTTP_X_FORWARDED_PROTO", "https")
  
@@ -124,6 +129,78 @@ DATABASES = {
     }
 }
 
+# Pool de conexiones a Postgres (psycopg 3), uno por proceso de gunicorn.
+# Con el worker gevent cada request es un greenlet con su propia conexión:
+# el pool la presta y la recupera al terminar el request, y como gunicorn
+# parchea antes de cargar la app, psycopg espera las queries cediendo el hub
+# en vez de bloquear el worker. Con más requests que DB_POOL_MAX_SIZE los
+# demás esperan una conexión hasta DB_POOL_TIMEOUT segundos.
+# Total de conexiones: GUNICORN_WORKERS x DB_POOL_MAX_SIZE (+ comandos).
+# DB_POOL_MAX_SIZE=0 vuelve a abrir una conexión por request.
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+if DB_POOL_MAX_SIZE:
+    DATABASES["default"]["OPTIONS"] = {
+        "pool": {
+            "min_size": min(DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE),
+            "max_size": DB_POOL_MAX_SIZE,
+            "timeout": DB_POOL_TIMEOUT,
+        }
+    }
+
+
+# Cache de stock SAP (segundos)
+# TTL: se sirve sin consultar SAP. STALE_TTL: ventana extra en la que se sirve
+# el valor viejo mientras se refresca en segundo plano.
+SAP_STOCK_CACHE_TTL = int(os.getenv("SAP_STOCK_CACHE_TTL", "60"))
+SAP_STOCK_CACHE_STALE_TTL = int(os.getenv("SAP_STOCK_CACHE_STALE_TTL", "300"))
+# Tope de claves (centro, almacén, material) por proceso y edad máxima de lo
+# que se guarda; es también lo más viejo que se muestra con SAP caído.
+SAP_STOCK_CACHE_MAX_ENTRIES = int(os.getenv("SAP_STOCK_CACHE_MAX_ENTRIES", "20000"))
+SAP_STOCK_CACHE_MAX_AGE = int(os.getenv("SAP_STOCK_CACHE_MAX_AGE", "86400"))
+
+# stock_snapshot (manage.py sincronizar_stock): se usa si la última
+# sincronización del almacén tiene menos de estos segundos. 0 = no usar.
+SAP_STOCK_SNAPSHOT_MAX_AGE = int(os.getenv("SAP_STOCK_SNAPSHOT_MAX_AGE", "900"))
+
+# Pool HTTP hacia el gateway SAP (uno por entorno QAS/PRO, por proceso)
+SAP_POOL_MAX_CONNECTIONS = int(os.getenv("SAP_POOL_MAX_CONNECTIONS", "10"))
+SAP_POOL_MAX_KEEPALIVE = int(os.getenv("SAP_POOL_MAX_KEEPALIVE", "5"))
+SAP_POOL_KEEPALIVE_EXPIRY = float(os.getenv("SAP_POOL_KEEPALIVE_EXPIRY", "30"))
+
+# Circuit breaker por RFC/entorno y timeouts adaptativos (p95 * factor)
+SAP_CB_FALLOS = int(os.getenv("SAP_CB_FALLOS", "5"))
+SAP_CB_LENTO_MS = int(os.getenv("SAP_CB_LENTO_MS", "10000"))
+SAP_CB_COOLDOWN = int(os.getenv("SAP_CB_COOLDOWN", "30"))
+SAP_TIMEOUT_MIN = float(os.getenv("SAP_TIMEOUT_MIN", "2"))
+SAP_TIMEOUT_FACTOR = float(os.getenv("SAP_TIMEOUT_FACTOR", "3"))
+
+# Outbox de entregas a SAP (worker: manage.py procesar_outbox_sap)
+SAP_OUTBOX_MAX_INTENTOS = int(os.getenv("SAP_OUTBOX_MAX_INTENTOS", "8"))
+SAP_OUTBOX_BACKOFF_BASE = int(os.getenv("SAP_OUTBOX_BACKOFF_BASE", "30"))
+SAP_OUTBOX_BACKOFF_MAX = int(os.getenv("SAP_OUTBOX_BACKOFF_MAX", "3600"))
+SAP_OUTBOX_LEASE = int(os.getenv("SAP_OUTBOX_LEASE", "300"))
+
+# Listados de vales (paginación keyset): total cacheado por combinación de
+# filtros; por encima de EXACTO_MAX filas estimadas se muestra la estimación.
+VSM_LISTADO_COUNT_TTL = int(os.getenv("VSM_LISTADO_COUNT_TTL", "120"))
+VSM_LISTADO_COUNT_EXACTO_MAX = int(os.getenv("VSM_LISTADO_COUNT_EXACTO_MAX", "10000"))
+
+# Endpoints JSON de nuevo_vsm (retirantes, almacenes): filas por página de select2
+VSM_JSON_POR_PAGINA = int(os.getenv("VSM_JSON_POR_PAGINA", "30"))
+
+# Render de generar_pdf: "html" (template + xhtml2pdf) o "canvas" (ReportLab directo)
+VSM_PDF_MOTOR = os.getenv("VSM_PDF_MOTOR", "html")
+
+# Exportación de PDF en lote: procesos del pool (0 = en el mismo proceso) y
+# vales leídos de la base por tanda
+VSM_PDF_PROCESOS = int(os.getenv("VSM_PDF_PROCESOS", str(os.cpu_count() or 1)))
+VSM_EXPORTAR_CHUNK = int(os.getenv("VSM_EXPORTAR_CHUNK", "100"))
+
+# Exportación de registros a CSV/XLSX: líneas leídas de la base por tanda
+VSM_EXPORTAR_FILAS_CHUNK = int(os.getenv("VSM_EXPORTAR_FILAS_CHUNK", "2000"))
+
 
 AUTH_USER_MODEL = "vsm_app.Usuarios"
 